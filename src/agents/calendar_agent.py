@@ -1,150 +1,152 @@
 """
-Calendar Agent using OpenAI function calling
+Calendar Agent using OpenAI tool calling
 """
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
+import asyncio
 import json
 import logging
 from openai import AsyncOpenAI
 
+from src.agents.result_renderer import render_results
 from src.core.config import settings
+from src.core.deadline import Deadline
+from src.core.openai_client import get_openai_client
 from src.services.calendar_service import CalendarService
 from src.nlp.datetime_parser import DateTimeParser
+from src.repositories.conversation_repository import match_event_reference
 
 logger = logging.getLogger(__name__)
 
 
-class CalendarAgent:
-    """AI Agent for natural calendar interactions"""
-    
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-        self.calendar_service = CalendarService()
-        self.datetime_parser = DateTimeParser()
-        self.model = "gpt-4o-mini"  # Cost-effective model
-        
-        # Define available functions
-        self.functions = [
-            {
-                "name": "search_events",
-                "description": "カレンダーから予定を検索します",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "date": {
-                            "type": "string",
-                            "description": "検索する日付 (YYYY-MM-DD形式)"
-                        },
-                        "keyword": {
-                            "type": "string",
-                            "description": "検索キーワード（オプション）"
-                        }
-                    },
-                    "required": ["date"]
+# Functions available to the model
+AGENT_FUNCTIONS = [
+    {
+        "name": "search_events",
+        "description": "カレンダーから予定を検索します",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "date": {
+                    "type": "string",
+                    "description": "検索する日付 (YYYY-MM-DD形式)"
+                },
+                "keyword": {
+                    "type": "string",
+                    "description": "検索キーワード（オプション）"
                 }
             },
-            {
-                "name": "add_event",
-                "description": "カレンダーに新しい予定を追加します",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "title": {
-                            "type": "string",
-                            "description": "予定のタイトル"
-                        },
-                        "datetime": {
-                            "type": "string",
-                            "description": "予定の日時 (ISO形式)"
-                        },
-                        "duration_minutes": {
-                            "type": "integer",
-                            "description": "予定の長さ（分）",
-                            "default": 60
-                        },
-                        "location": {
-                            "type": "string",
-                            "description": "場所（オプション）"
-                        }
-                    },
-                    "required": ["title", "datetime"]
+            "required": ["date"]
+        }
+    },
+    {
+        "name": "add_event",
+        "description": "カレンダーに新しい予定を追加します",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "title": {
+                    "type": "string",
+                    "description": "予定のタイトル"
+                },
+                "datetime": {
+                    "type": "string",
+                    "description": "予定の日時 (ISO形式)"
+                },
+                "duration_minutes": {
+                    "type": "integer",
+                    "description": "予定の長さ（分）",
+                    "default": 60
+                },
+                "location": {
+                    "type": "string",
+                    "description": "場所（オプション）"
                 }
             },
-            {
-                "name": "delete_event",
-                "description": "予定を削除します",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "event_id": {
-                            "type": "string",
-                            "description": "削除する予定のID"
-                        },
-                        "title": {
-                            "type": "string",
-                            "description": "削除する予定のタイトル（IDが不明な場合）"
-                        },
-                        "date": {
-                            "type": "string",
-                            "description": "予定の日付（タイトルで検索する場合）"
-                        }
-                    },
-                    "required": []
+            "required": ["title", "datetime"]
+        }
+    },
+    {
+        "name": "delete_event",
+        "description": "予定を削除します",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "event_id": {
+                    "type": "string",
+                    "description": "削除する予定のID（直近で話題になった予定のIDが使えます）"
+                },
+                "title": {
+                    "type": "string",
+                    "description": "削除する予定のタイトル（IDが不明な場合）"
+                },
+                "date": {
+                    "type": "string",
+                    "description": "予定の日付（タイトルで検索する場合）"
                 }
             },
-            {
-                "name": "update_reminder_settings",
-                "description": "リマインダーの設定を更新します",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "reminder_enabled": {
-                            "type": "boolean",
-                            "description": "リマインダーを有効にするか"
-                        },
-                        "morning_time": {
-                            "type": "string",
-                            "description": "朝のリマインダー時刻 (HH:MM形式)"
-                        },
-                        "evening_time": {
-                            "type": "string",
-                            "description": "夜のリマインダー時刻 (HH:MM形式)"
-                        },
-                        "days_ahead": {
-                            "type": "integer",
-                            "description": "何日先までの予定を通知するか"
-                        }
-                    },
-                    "required": []
+            "required": []
+        }
+    },
+    {
+        "name": "update_reminder_settings",
+        "description": "リマインダーの設定を更新します",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "reminder_enabled": {
+                    "type": "boolean",
+                    "description": "リマインダーを有効にするか"
+                },
+                "morning_time": {
+                    "type": "string",
+                    "description": "朝のリマインダー時刻 (HH:MM形式)"
+                },
+                "evening_time": {
+                    "type": "string",
+                    "description": "夜のリマインダー時刻 (HH:MM形式)"
+                },
+                "days_ahead": {
+                    "type": "integer",
+                    "description": "何日先までの予定を通知するか"
                 }
             },
-            {
-                "name": "check_subscription",
-                "description": "現在の課金プランとAI利用状況を確認します",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
+            "required": []
+        }
+    },
+    {
+        "name": "check_subscription",
+        "description": "現在の課金プランとAI利用状況を確認します",
+        "parameters": {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+    },
+    {
+        "name": "upgrade_subscription",
+        "description": "課金プランをアップグレードします",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "plan": {
+                    "type": "string",
+                    "enum": ["basic", "premium"],
+                    "description": "アップグレード先のプラン"
                 }
             },
-            {
-                "name": "upgrade_subscription",
-                "description": "課金プランをアップグレードします",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "plan": {
-                            "type": "string",
-                            "enum": ["basic", "premium"],
-                            "description": "アップグレード先のプラン"
-                        }
-                    },
-                    "required": ["plan"]
-                }
-            }
-        ]
-        
-        self.system_prompt = """あなたは優秀なカレンダー管理アシスタントです。
+            "required": ["plan"]
+        }
+    }
+]
+
+# Tools API wrapping of the functions above
+AGENT_TOOLS = [
+    {"type": "function", "function": function}
+    for function in AGENT_FUNCTIONS
+]
+
+SYSTEM_PROMPT = """あなたは優秀なカレンダー管理アシスタントです。
 ユーザーの自然な日本語を理解し、適切にカレンダーを操作します。
 
 重要なルール：
@@ -159,12 +161,35 @@ class CalendarAgent:
 - 「来週の予定は？」→ 来週1週間の予定を検索
 - 「さっきの会議キャンセル」→ 直前に話題になった会議を削除
 """
+
+
+class CalendarAgent:
+    """
+    AI Agent for natural calendar interactions
+    
+    Holds no per-request state: conversation history and function results
+    live in process_message locals, so one instance serves all users.
+    """
+    
+    def __init__(self):
+        self.calendar_service = CalendarService()
+        self.datetime_parser = DateTimeParser()
+        self.model = "gpt-4o-mini"  # Cost-effective model
+        self.tools = AGENT_TOOLS
+        self.system_prompt = SYSTEM_PROMPT
+    
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Shared, connection-pooled OpenAI client"""
+        return get_openai_client()
     
     async def process_message(
         self,
         user_id: str,
         message: str,
-        conversation_history: List[Dict[str, str]] = None
+        conversation_history: List[Dict[str, str]] = None,
+        context_summary: Optional[str] = None,
+        recent_events: Optional[List[Dict[str, Any]]] = None
     ) -> tuple[str, List[Any]]:
         """
         Process user message with AI
@@ -173,6 +198,8 @@ class CalendarAgent:
             user_id: LINE user ID
             message: User's message
             conversation_history: Past conversation context
+            context_summary: Summary of older turns no longer in the history
+            recent_events: Recently referenced events (newest first)
             
         Returns:
             Tuple of (response text, function results)
@@ -181,6 +208,24 @@ class CalendarAgent:
             # Build messages
             messages = [{"role": "system", "content": self.system_prompt}]
             
+            # Add summary of earlier conversation
+            if context_summary:
+                messages.append({
+                    "role": "system",
+                    "content": f"これまでの会話の要約：\n{context_summary}"
+                })
+            
+            # Add recently referenced events so references can use their IDs
+            if recent_events:
+                lines = [
+                    f"- ID: {ref['event_id']} / {ref.get('title', '')} / {ref.get('datetime') or ''}"
+                    for ref in recent_events
+                ]
+                messages.append({
+                    "role": "system",
+                    "content": "直近で話題になった予定（新しい順）：\n" + "\n".join(lines)
+                })
+            
             # Add conversation history
             if conversation_history:
                 for entry in conversation_history[-5:]:  # Last 5 messages
@@ -192,68 +237,211 @@ class CalendarAgent:
             # Add current message
             messages.append({"role": "user", "content": message})
             
-            # Call OpenAI
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                functions=self.functions,
-                function_call="auto",
-                temperature=0.7
-            )
-            
-            assistant_message = response.choices[0].message
-            
-            # Process function calls
+            # Tool steps run until the model answers or the budget is spent
             function_results = []
-            if assistant_message.function_call:
-                function_name = assistant_message.function_call.name
-                function_args = json.loads(assistant_message.function_call.arguments)
-                
-                logger.info(f"AI calling function: {function_name} with args: {function_args}")
-                
-                # Execute function
-                result = await self._execute_function(
+            budget = Deadline.after(settings.AGENT_TIME_BUDGET_SECONDS)
+            
+            for _ in range(settings.AGENT_MAX_STEPS):
+                content, tool_calls, results = await self._complete(
                     user_id,
-                    function_name,
-                    function_args
+                    messages,
+                    recent_events or []
                 )
-                function_results.append(result)
+                if not tool_calls:
+                    return content, function_results
+                
+                function_results.extend(results)
                 
-                # Get final response with function result
+                # Feed results back for the next step
                 messages.append({
                     "role": "assistant",
-                    "content": None,
-                    "function_call": {
-                        "name": function_name,
-                        "arguments": assistant_message.function_call.arguments
-                    }
-                })
-                messages.append({
-                    "role": "function",
-                    "name": function_name,
-                    "content": json.dumps(result, ensure_ascii=False)
+                    "content": content,
+                    "tool_calls": [
+                        {
+                            "id": tool_call["id"],
+                            "type": "function",
+                            "function": {
+                                "name": tool_call["name"],
+                                "arguments": tool_call["arguments"]
+                            }
+                        }
+                        for tool_call in tool_calls
+                    ]
                 })
+                for tool_call, result in zip(tool_calls, results):
+                    messages.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call["id"],
+                        "content": json.dumps(result, ensure_ascii=False, default=str)
+                    })
                 
-                # Get final response
-                final_response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=0.7
-                )
+                # Deterministic outcomes are phrased locally, saving a round trip
+                rendered = render_results([
+                    (tool_call["name"], result)
+                    for tool_call, result in zip(tool_calls, results)
+                ])
+                if rendered is not None:
+                    return rendered, function_results
                 
-                return final_response.choices[0].message.content, function_results
+                if budget.expired:
+                    logger.warning(f"Agent time budget spent for {user_id}")
+                    break
+            
+            # Out of steps or time: answer from the results gathered so far
+            content, _, _ = await self._complete(
+                user_id,
+                messages,
+                recent_events or [],
+                tool_choice="none"
+            )
             
-            return assistant_message.content, function_results
+            return content, function_results
             
         except Exception as e:
             logger.error(f"AI Agent error: {e}")
             return "申し訳ございません。処理中にエラーが発生しました。", []
     
+    async def _complete(
+        self,
+        user_id: str,
+        messages: List[Dict[str, Any]],
+        recent_events: List[Dict[str, Any]],
+        tool_choice: str = "auto"
+    ) -> tuple:
+        """
+        Run one model turn and execute its tool calls
+        
+        Tool calls in one turn do not depend on each other, so they run
+        concurrently and the step takes as long as its slowest call.
+        Streaming only pays off by starting tool calls early, so a turn
+        that cannot call tools (tool_choice "none") is never streamed.
+        
+        Args:
+            user_id: LINE user ID
+            messages: Conversation so far
+            recent_events: Recently referenced events (newest first)
+            tool_choice: "auto", or "none" to force a text answer
+        
+        Returns:
+            Tuple of (text content, tool calls, results in call order)
+        """
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "tools": self.tools,
+            "tool_choice": tool_choice,
+            "temperature": 0.7
+        }
+        if tool_choice == "auto":
+            request["parallel_tool_calls"] = True
+        
+        if settings.AGENT_STREAMING and tool_choice != "none":
+            return await self._complete_streaming(user_id, request, recent_events)
+        
+        response = await self.client.chat.completions.create(**request)
+        message = response.choices[0].message
+        tool_calls = [
+            {
+                "id": tool_call.id,
+                "name": tool_call.function.name,
+                "arguments": tool_call.function.arguments
+            }
+            for tool_call in message.tool_calls or []
+        ]
+        
+        results = await asyncio.gather(*(
+            self._run_tool_call(user_id, tool_call, recent_events)
+            for tool_call in tool_calls
+        ))
+        return message.content, tool_calls, list(results)
+    
+    async def _complete_streaming(
+        self,
+        user_id: str,
+        request: Dict[str, Any],
+        recent_events: List[Dict[str, Any]]
+    ) -> tuple:
+        """
+        Streaming variant of _complete
+        
+        Each tool call starts executing as soon as its arguments are
+        complete (when the next call begins), while the model is still
+        generating the rest. Text is not sent to the user before the
+        stream ends, so a text-only answer arrives no sooner than without
+        streaming; the stream is left as soon as a finish reason arrives.
+        """
+        content = []
+        tool_calls: List[Dict[str, str]] = []
+        tasks: List[asyncio.Task] = []
+        
+        def start_ready(count: int):
+            """Start the tool calls whose arguments are complete"""
+            for tool_call in tool_calls[len(tasks):count]:
+                tasks.append(asyncio.create_task(
+                    self._run_tool_call(user_id, tool_call, recent_events)
+                ))
+        
+        stream = await self.client.chat.completions.create(**request, stream=True)
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = choice.delta
+                
+                if delta.content:
+                    content.append(delta.content)
+                
+                for part in delta.tool_calls or []:
+                    if part.index >= len(tool_calls):
+                        # A new call begins, so the earlier ones are complete
+                        start_ready(part.index)
+                        tool_calls.append({"id": "", "name": "", "arguments": ""})
+                    tool_call = tool_calls[part.index]
+                    if part.id:
+                        tool_call["id"] = part.id
+                    if part.function and part.function.name:
+                        tool_call["name"] += part.function.name
+                    if part.function and part.function.arguments:
+                        tool_call["arguments"] += part.function.arguments
+                
+                if choice.finish_reason:
+                    break
+            
+            start_ready(len(tool_calls))
+        
+        except Exception:
+            # Let started calls finish; a half-applied Calendar write is worse
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await stream.close()
+        
+        results = await asyncio.gather(*tasks)
+        return "".join(content) or None, tool_calls, list(results)
+    
+    async def _run_tool_call(
+        self,
+        user_id: str,
+        tool_call: Dict[str, str],
+        recent_events: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Parse a tool call's arguments and execute it"""
+        function_name = tool_call["name"]
+        try:
+            function_args = json.loads(tool_call["arguments"] or "{}")
+        except json.JSONDecodeError:
+            return {"error": f"Invalid arguments for {function_name}"}
+        
+        logger.info(f"AI calling function: {function_name} with args: {function_args}")
+        return await self._execute_function(user_id, function_name, function_args, recent_events)
+    
     async def _execute_function(
         self,
         user_id: str,
         function_name: str,
-        args: Dict[str, Any]
+        args: Dict[str, Any],
+        recent_events: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """Execute the specified function"""
         
@@ -265,7 +453,7 @@ class CalendarAgent:
                 return await self._add_event(user_id, args)
             
             elif function_name == "delete_event":
-                return await self._delete_event(user_id, args)
+                return await self._delete_event(user_id, args, recent_events)
             
             elif function_name == "update_reminder_settings":
                 return await self._update_reminder_settings(user_id, args)
@@ -340,6 +528,7 @@ class CalendarAgent:
             "success": result.get("success", False),
             "message": result.get("message", ""),
             "event": {
+                "event_id": result.get("event_id"),
                 "title": title,
                 "datetime": datetime_str,
                 "duration": duration,
@@ -347,16 +536,43 @@ class CalendarAgent:
             }
         }
     
-    async def _delete_event(self, user_id: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    async def _delete_event(
+        self,
+        user_id: str,
+        args: Dict[str, Any],
+        recent_events: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
         """Delete calendar event"""
         event_id = args.get("event_id")
         title = args.get("title")
         date_str = args.get("date")
         
-        # If event_id is provided, use it directly
+        # Resolve references like "さっきの会議" from recent events; only an
+        # explicitly named event is deleted, otherwise the user confirms
+        if not event_id and not date_str and recent_events:
+            reference = match_event_reference(recent_events, title) if title else None
+            if not reference:
+                return {
+                    "error": "削除する予定を特定できませんでした。どの予定か確認してください",
+                    "candidates": [
+                        {
+                            "event_id": ref["event_id"],
+                            "title": ref.get("title", ""),
+                            "datetime": ref.get("datetime")
+                        }
+                        for ref in recent_events
+                    ]
+                }
+            event_id = reference["event_id"]
+        
+        # If event_id is known, delete it directly
         if event_id:
-            # Direct deletion by ID (需要在calendar_service中实现)
-            return {"message": "Event ID による削除は実装予定です"}
+            result = await self.calendar_service.delete_event_by_id(user_id, event_id)
+            return {
+                "success": result.get("success", False),
+                "message": result.get("message", ""),
+                "deleted_event_id": event_id if result.get("success") else None
+            }
         
         # Search by title and date
         if title and date_str:
@@ -370,7 +586,8 @@ class CalendarAgent:
             
             return {
                 "success": result.get("success", False),
-                "message": result.get("message", "")
+                "message": result.get("message", ""),
+                "deleted_event_id": result.get("event_id")
             }
         
         return {"error": "削除する予定を特定できませんでした"}
@@ -439,4 +656,20 @@ class CalendarAgent:
             "message": result.get("message", ""),
             "old_plan": result.get("old_plan"),
             "new_plan": result.get("new_plan")
-        }
\ No newline at end of file
+        }
+
+
+_calendar_agent: Optional[CalendarAgent] = None
+
+
+def get_calendar_agent() -> CalendarAgent:
+    """
+    Get the shared agent instance
+    
+    Returns:
+        CalendarAgent created on first use
+    """
+    global _calendar_agent
+    if _calendar_agent is None:
+        _calendar_agent = CalendarAgent()
+    return _calendar_agent
\ No newline at end of file
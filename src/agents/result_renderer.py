@@ -0,0 +1,141 @@
+"""
+Local rendering of deterministic function results
+
+Replies for outcomes such as "event added" or "reminder updated" follow a
+fixed shape, so they are rendered here instead of asking the model to
+phrase them in a second completion.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+
+WEEKDAYS = ['月', '火', '水', '木', '金', '土', '日']
+
+# Functions whose results are rendered locally; anything else (e.g.
+# search_events, which may need an open-ended summary) goes to the model
+RENDERED_FUNCTIONS = {
+    'add_event',
+    'delete_event',
+    'update_reminder_settings',
+    'check_subscription',
+    'upgrade_subscription'
+}
+
+
+def render_results(calls: List[Tuple[str, Dict[str, Any]]]) -> Optional[str]:
+    """
+    Render the reply for executed functions without the model
+    
+    Args:
+        calls: (function name, result) pairs in execution order
+    
+    Returns:
+        Reply text, or None if any result needs the model to phrase it
+    """
+    if not calls:
+        return None
+    
+    parts = []
+    for function_name, result in calls:
+        text = render_result(function_name, result)
+        if text is None:
+            return None
+        parts.append(text)
+    
+    return "\n\n".join(parts)
+
+
+def render_result(function_name: str, result: Dict[str, Any]) -> Optional[str]:
+    """
+    Render a single function result
+    
+    Args:
+        function_name: Executed function
+        result: Function result
+    
+    Returns:
+        Reply text, or None if the model should phrase it
+    """
+    # Errors may need a clarifying question, which the model does better
+    if function_name not in RENDERED_FUNCTIONS or result.get('error'):
+        return None
+    
+    if function_name == 'add_event':
+        return _render_add_event(result)
+    if function_name == 'delete_event':
+        return _render_status(result, '予定を削除しました。')
+    if function_name == 'update_reminder_settings':
+        return _render_reminder_settings(result)
+    if function_name == 'check_subscription':
+        return format_subscription_info(result)
+    if function_name == 'upgrade_subscription':
+        return _render_status(result, 'プランを変更しました。')
+    return None
+
+
+def format_subscription_info(info: Dict[str, Any]) -> str:
+    """
+    Format subscription info for display
+    
+    Args:
+        info: Subscription info from SubscriptionService.get_subscription_info
+    
+    Returns:
+        Formatted text message
+    """
+    return (
+        f"📊 **現在のプラン情報**\n\n"
+        f"プラン: {info['plan_name']}\n"
+        f"料金: {info['price']}円/月\n"
+        f"AI利用回数: {info['ai_calls_used']}/{info['ai_calls_limit']}\n"
+        f"残り回数: {info['ai_calls_remaining']}\n\n"
+        f"{'✅' if info['features']['ai_agent'] else '❌'} AIエージェントモード\n"
+        f"✅ パターン認識モード"
+    )
+
+
+def format_datetime(value: Optional[str]) -> str:
+    """Format an ISO datetime as e.g. 6月3日(火) 15:00"""
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value or ''
+    return f"{dt.month}月{dt.day}日({WEEKDAYS[dt.weekday()]}) {dt.strftime('%H:%M')}"
+
+
+def _render_status(result: Dict[str, Any], default: str) -> str:
+    """Render a plain success/failure result from its service message"""
+    if result.get('success'):
+        return result.get('message') or default
+    return result.get('message') or '処理に失敗しました。'
+
+
+def _render_add_event(result: Dict[str, Any]) -> str:
+    """Render an added event with its details"""
+    if not result.get('success'):
+        return result.get('message') or '予定の追加に失敗しました。'
+    
+    event = result.get('event', {})
+    lines = [result.get('message') or f"予定「{event.get('title', '')}」を追加しました。"]
+    if event.get('datetime'):
+        lines.append(f"🕐 {format_datetime(event['datetime'])}（{event.get('duration', 60)}分）")
+    if event.get('location'):
+        lines.append(f"📍 {event['location']}")
+    return "\n".join(lines)
+
+
+def _render_reminder_settings(result: Dict[str, Any]) -> str:
+    """Render updated reminder preferences"""
+    if not result.get('success'):
+        return result.get('message') or '設定の更新に失敗しました。'
+    
+    updated = result.get('updated_settings', {})
+    lines = [result.get('message') or 'リマインダー設定を更新しました']
+    if 'reminder_enabled' in updated:
+        lines.append(f"・リマインダー: {'オン' if updated['reminder_enabled'] else 'オフ'}")
+    if 'reminder_time_morning' in updated:
+        lines.append(f"・朝の通知: {updated['reminder_time_morning']}")
+    if 'reminder_time_evening' in updated:
+        lines.append(f"・夜の通知: {updated['reminder_time_evening']}")
+    if 'reminder_days_ahead' in updated:
+        lines.append(f"・通知する範囲: {updated['reminder_days_ahead']}日先まで")
+    return "\n".join(lines)
\ No newline at end of file
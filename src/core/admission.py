@@ -0,0 +1,107 @@
+"""
+Admission control and load shedding for message processing
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import time
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """
+    Bounds how many messages are processed at once
+    
+    Up to max_in_flight requests run concurrently and up to max_waiting
+    wait for a slot, each for at most queue_timeout seconds. Requests
+    beyond that are shed so the caller can answer with a fast canned
+    reply instead of timing out.
+    
+    The webhook worker pool already caps how many events reach this point,
+    so max_waiting defaults to the workers left over once every slot is
+    taken; anything beyond that comes from concurrent drains.
+    
+    Old events are not shed: the reply falls back to push once the reply
+    token has expired, so an event reclaimed or redelivered from the
+    queue still gets its answer.
+    """
+    
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        max_waiting: Optional[int] = None,
+        queue_timeout: Optional[float] = None
+    ):
+        self.max_in_flight = max_in_flight or min(
+            settings.ADMISSION_MAX_IN_FLIGHT,
+            settings.WEBHOOK_WORKERS
+        )
+        if max_waiting is None:
+            max_waiting = settings.ADMISSION_MAX_WAITING
+        if max_waiting is None:
+            max_waiting = settings.WEBHOOK_WORKERS - self.max_in_flight
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout or settings.ADMISSION_QUEUE_TIMEOUT
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._shed = {'queue_full': 0, 'timeout': 0}
+        self._total_wait = 0.0
+    
+    async def acquire(self) -> bool:
+        """
+        Wait for a processing slot
+        
+        Returns:
+            True if admitted (call release() when done), False if shed
+        """
+        if self._waiting >= self.max_waiting and self._semaphore.locked():
+            return self._reject('queue_full')
+        
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            return self._reject('timeout')
+        finally:
+            self._waiting -= 1
+        
+        self._in_flight += 1
+        self._admitted += 1
+        self._total_wait += time.monotonic() - started
+        return True
+    
+    def release(self):
+        """Free the slot taken by acquire()"""
+        self._in_flight -= 1
+        self._semaphore.release()
+    
+    def _reject(self, reason: str) -> bool:
+        """Record a shed request"""
+        self._shed[reason] += 1
+        logger.warning(
+            f"Shedding message ({reason}): {self._in_flight} in flight, "
+            f"{self._waiting} waiting"
+        )
+        return False
+    
+    def metrics(self) -> Dict[str, Any]:
+        """Current state and counters"""
+        return {
+            'in_flight': self._in_flight,
+            'waiting': self._waiting,
+            'max_in_flight': self.max_in_flight,
+            'max_waiting': self.max_waiting,
+            'admitted': self._admitted,
+            'shed': dict(self._shed),
+            'avg_wait_ms': int(self._total_wait / self._admitted * 1000) if self._admitted else 0
+        }
+
+
+# Global instance for LINE message processing
+message_admission = AdmissionController()
\ No newline at end of file
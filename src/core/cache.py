@@ -0,0 +1,71 @@
+"""
+In-process caching utilities
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import time
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a time-to-live
+    
+    Not shared between instances; use it in front of a shared store.
+    """
+    
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a live entry, refreshing its LRU position"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Store an entry, evicting the least recently used ones if full"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def add(self, key: Hashable, value: Any = True) -> bool:
+        """
+        Store an entry only if there is no live one
+        
+        Returns:
+            True if the entry was added
+        """
+        if key in self:
+            return False
+        self.set(key, value)
+        return True
+    
+    def delete(self, key: Hashable):
+        """Remove an entry"""
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        """Remove all entries"""
+        self._entries.clear()
+
+
+_MISSING = object()
\ No newline at end of file
@@ -23,6 +23,7 @@ class Settings(BaseSettings):
     # LINE Settings
     LINE_CHANNEL_SECRET: Optional[str] = None
     LINE_CHANNEL_ACCESS_TOKEN: Optional[str] = None
+    LINE_CONNECTION_POOL_SIZE: int = 100  # Pooled connections to api.line.me
     LIFF_ID: Optional[str] = None
     
     # Google OAuth Settings
@@ -39,6 +40,84 @@ class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: Optional[str] = None
     USE_AI_AGENT: bool = True  # Toggle AI agent vs pattern matching
+    OPENAI_TIMEOUT: float = 60.0  # Seconds per API request
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 60.0  # Seconds idle connections stay open
+    OPENAI_HTTP2: bool = False  # Requires the h2 package
+    AGENT_MAX_STEPS: int = 4  # Model turns with tool calls per message
+    AGENT_TIME_BUDGET_SECONDS: float = 30.0  # No new tool steps after this
+    AGENT_STREAMING: bool = True  # Stream tool-enabled turns to start tools as their arguments complete
+    
+    # Background conversation persistence
+    CONVERSATION_WRITER_MAX_PENDING: int = 1000  # Buffered exchanges before writing inline
+    CONVERSATION_WRITER_FLUSH_INTERVAL: float = 0.2  # Seconds to wait before committing
+    CONVERSATION_RETENTION_DAYS: int = 7  # Used for the expire_at TTL field
+    
+    # Webhook redelivery deduplication ("memory" per instance, "firestore" shared)
+    WEBHOOK_DEDUP_BACKEND: str = "memory"
+    WEBHOOK_DEDUP_TTL_SECONDS: int = 86400  # LINE redelivers for up to a day
+    WEBHOOK_DEDUP_MAX_ENTRIES: int = 10000
+    
+    # Webhook event queue ("memory", "sqlite" or "firestore" for durability)
+    WEBHOOK_QUEUE_BACKEND: str = "memory"
+    WEBHOOK_QUEUE_PATH: str = "webhook_events.db"  # SQLite file for the sqlite backend
+    WEBHOOK_WORKERS: int = 20  # Events processed concurrently
+    WEBHOOK_USER_MAILBOX_SIZE: int = 5  # Events queued per user; keeps one user from taking every worker
+    WEBHOOK_QUEUE_LEASE_SECONDS: float = 120.0  # Unacked events are redelivered after this
+    WEBHOOK_QUEUE_POLL_INTERVAL: float = 1.0  # Seconds between polls when idle
+    WEBHOOK_QUEUE_MAX_ATTEMPTS: int = 3
+    WEBHOOK_QUEUE_DRAIN_TIMEOUT: float = 20.0  # Seconds to finish in-flight events on shutdown
+    
+    # Admission control for message processing
+    ADMISSION_MAX_IN_FLIGHT: int = 16  # Messages processed concurrently (at most WEBHOOK_WORKERS)
+    ADMISSION_MAX_WAITING: Optional[int] = None  # Waiting before shedding; defaults to WEBHOOK_WORKERS minus in-flight
+    ADMISSION_QUEUE_TIMEOUT: float = 5.0  # Seconds to wait for a slot
+    
+    # Reply deadlines
+    REPLY_TOKEN_TTL_SECONDS: float = 60.0  # How long LINE accepts a reply token
+    REPLY_SAFETY_MARGIN_SECONDS: float = 10.0  # Send the interim reply this long before expiry
+    MESSAGE_PROCESSING_TIMEOUT: float = 120.0  # Seconds of processing before work is cancelled
+    
+    # Google credentials cache
+    CREDENTIALS_CACHE_MAX_ENTRIES: int = 1000
+    CREDENTIALS_EXPIRY_MARGIN_SECONDS: int = 300  # Refresh access tokens this long before expiry
+    
+    # Negative cache for users without a linked Google account
+    UNLINKED_CACHE_MAX_ENTRIES: int = 10000
+    UNLINKED_CACHE_TTL_SECONDS: int = 120  # Bounds staleness on instances that did not see the link
+    
+    # Reminders
+    REMINDER_TIMEZONE: str = "Asia/Tokyo"
+    REMINDER_BUCKET_MINUTES: int = 5  # Scheduler interval for /tasks/generate-reminders
+    REMINDER_CONCURRENCY: int = 20  # Users processed in parallel
+    REMINDER_CALENDAR_TIMEOUT: float = 15.0  # Seconds for credentials + Calendar list
+    REMINDER_SHARD_SIZE: int = 200  # Users per /tasks/reminder-shard task
+    DIGEST_MAX_AGE_MINUTES: int = 360  # Fresher precomputed digests are sent without calling Google
+    EVENT_REMINDERS_ENABLED: bool = True  # Enqueue "N minutes before" reminder tasks
+    EVENT_REMINDER_SYNC_DAYS: int = 1  # Days after today loaded by /tasks/sync-event-reminders
+    EVENT_REMINDER_DEDUP_BACKEND: str = "firestore"  # Sent markers; "memory" only dedups per instance
+    
+    # Outbound LINE push queue
+    LINE_PUSH_RATE_LIMIT: float = 2000  # Push requests per second
+    LINE_MULTICAST_RATE_LIMIT: float = 200  # Multicast requests per second
+    PUSH_QUEUE_WORKERS: int = 20
+    PUSH_QUEUE_MAX_PENDING: int = 10000  # Queued messages before sending inline
+    PUSH_QUEUE_DRAIN_TIMEOUT: float = 10.0  # Seconds to flush on shutdown
+    PUSH_TIMEOUT: float = 10.0  # Seconds per LINE request
+    PUSH_MAX_RETRIES: int = 5
+    PUSH_RETRY_BASE_DELAY: float = 1.0  # Seconds, doubled per attempt
+    PUSH_RETRY_MAX_DELAY: float = 60.0
+    PUSH_DEAD_LETTER_BACKEND: str = "firestore"  # "firestore", "sqlite" or "memory"
+    PUSH_DEAD_LETTER_PATH: str = "dead_letters.db"  # SQLite file for the sqlite backend
+    
+    # Task queue ("local" runs tasks in-process, "cloud_tasks" for Cloud Run)
+    TASK_QUEUE_BACKEND: str = "local"
+    CLOUD_TASKS_LOCATION: str = "asia-northeast1"
+    CLOUD_TASKS_QUEUE: str = "default"
+    CLOUD_TASKS_SERVICE_ACCOUNT: Optional[str] = None  # For OIDC auth on task requests
+    TASK_DEDUP_TTL_SECONDS: int = 86400  # Local enqueuer remembers task IDs this long
+    TASK_DEDUP_MAX_ENTRIES: int = 10000
     
     # Vercel specific
     GOOGLE_SERVICE_ACCOUNT_KEY: Optional[str] = None  # JSON string
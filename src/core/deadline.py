@@ -0,0 +1,32 @@
+"""
+Deadlines for time-bounded request processing
+"""
+from typing import Optional
+import time
+
+
+class Deadline:
+    """Point in time (epoch seconds) by which work must be done"""
+    
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+    
+    @classmethod
+    def after(cls, seconds: float, start: Optional[float] = None) -> 'Deadline':
+        """
+        Create a deadline relative to a start time
+        
+        Args:
+            seconds: Budget in seconds
+            start: Epoch seconds to count from (defaults to now)
+        """
+        return cls((start if start is not None else time.time()) + seconds)
+    
+    def remaining(self) -> float:
+        """Seconds left (negative once expired)"""
+        return self.expires_at - time.time()
+    
+    @property
+    def expired(self) -> bool:
+        """Whether the deadline has passed"""
+        return self.remaining() <= 0
\ No newline at end of file
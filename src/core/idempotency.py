@@ -0,0 +1,110 @@
+"""
+Idempotency store for deduplicating webhook deliveries and scheduled sends
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import asyncio
+import logging
+
+from src.core.cache import TTLCache
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyStore:
+    """
+    Remembers processed keys so redelivered work is skipped
+    
+    A bounded in-memory LRU answers repeats on this instance. With the
+    "firestore" backend, keys are also claimed in the webhook_events
+    collection, so redeliveries that land on another instance are caught
+    as well; documents carry an expire_at field for a Firestore TTL policy.
+    """
+    
+    collection_name = 'webhook_events'
+    
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        collection_name: Optional[str] = None
+    ):
+        self.backend = backend or settings.WEBHOOK_DEDUP_BACKEND
+        self.collection_name = collection_name or self.collection_name
+        self.ttl_seconds = ttl_seconds or settings.WEBHOOK_DEDUP_TTL_SECONDS
+        self._seen = TTLCache(
+            max_entries or settings.WEBHOOK_DEDUP_MAX_ENTRIES,
+            self.ttl_seconds
+        )
+        self.stats = {'claimed': 0, 'duplicates': 0}
+    
+    async def claim(self, key: Optional[str]) -> bool:
+        """
+        Claim a key for processing
+        
+        Args:
+            key: Idempotency key (e.g. webhookEventId)
+        
+        Returns:
+            True if the key has not been seen before and should be processed
+        """
+        if not key:
+            return True
+        
+        if not self._seen.add(key):
+            self.stats['duplicates'] += 1
+            return False
+        
+        if self.backend == "firestore" and not await self._claim_shared(key):
+            self.stats['duplicates'] += 1
+            return False
+        
+        self.stats['claimed'] += 1
+        return True
+    
+    async def release(self, key: Optional[str]):
+        """
+        Forget a key so a later delivery is processed again
+        
+        Used when processing could not even be started.
+        """
+        if not key:
+            return
+        
+        self._seen.delete(key)
+        if self.backend == "firestore":
+            try:
+                from src.core.firestore import get_db
+                
+                doc_ref = get_db().collection(self.collection_name).document(key)
+                await asyncio.to_thread(doc_ref.delete)
+            except Exception as e:
+                logger.error(f"Failed to release idempotency key {key}: {e}")
+    
+    async def _claim_shared(self, key: str) -> bool:
+        """Atomically create the key document; fails if it already exists"""
+        from google.api_core import exceptions
+        from src.core.firestore import get_db
+        
+        now = datetime.now(timezone.utc)
+        doc_ref = get_db().collection(self.collection_name).document(key)
+        
+        try:
+            await asyncio.to_thread(doc_ref.create, {
+                'created_at': now,
+                'expire_at': now + timedelta(seconds=self.ttl_seconds)
+            })
+            return True
+        
+        except exceptions.AlreadyExists:
+            return False
+        except Exception as e:
+            # Fail open: processing twice beats dropping the message
+            logger.error(f"Idempotency store unavailable, processing {key}: {e}")
+            return True
+
+
+# Global instance for LINE webhook events
+webhook_dedup = IdempotencyStore()
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+Shared LINE Messaging API client
+"""
+import asyncio
+import logging
+from typing import Optional, Set
+from linebot.v3.messaging import (
+    AsyncApiClient,
+    AsyncMessagingApi,
+    Configuration
+)
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LineClient:
+    """
+    Long-lived, connection-pooled LINE Messaging API client
+    
+    Created on first use and closed in the application lifespan. The
+    underlying HTTP session is bound to an event loop, so the client is
+    recreated if it is used from a different loop (e.g. serverless runs),
+    and the replaced client is closed so its connections are not leaked.
+    """
+    
+    def __init__(self):
+        self._api_client: Optional[AsyncApiClient] = None
+        self._api: Optional[AsyncMessagingApi] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Future] = set()
+    
+    @property
+    def api(self) -> AsyncMessagingApi:
+        """Get the shared Messaging API instance"""
+        loop = asyncio.get_running_loop()
+        if self._api is None or self._loop is not loop:
+            if self._api_client is not None:
+                self._close_previous(self._api_client, self._loop)
+            self._api = self._create_api()
+            self._loop = loop
+        return self._api
+    
+    def _close_previous(self, api_client: AsyncApiClient, loop: asyncio.AbstractEventLoop):
+        """
+        Close a client created on another event loop
+        
+        The close runs on the client's own loop while that loop is still
+        running; otherwise it is done on the current loop.
+        """
+        if loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._close_client(api_client), loop)
+        else:
+            future = asyncio.ensure_future(self._close_client(api_client))
+        self._closing.add(future)
+        future.add_done_callback(self._closing.discard)
+    
+    async def _close_client(self, api_client: AsyncApiClient):
+        """Close one API client, logging failures"""
+        try:
+            await api_client.close()
+        except Exception as e:
+            logger.error(f"Error closing LINE client: {e}")
+    
+    def _create_api(self) -> AsyncMessagingApi:
+        """Create the pooled API client"""
+        configuration = Configuration(
+            host="https://api.line.me",
+            access_token=settings.LINE_CHANNEL_ACCESS_TOKEN
+        )
+        configuration.connection_pool_maxsize = settings.LINE_CONNECTION_POOL_SIZE
+        
+        self._api_client = AsyncApiClient(configuration=configuration)
+        logger.info("Created LINE Messaging API client")
+        return AsyncMessagingApi(self._api_client)
+    
+    async def start(self):
+        """Open the client up front instead of on the first message"""
+        self.api
+    
+    async def close(self):
+        """Close pooled connections"""
+        if self._api_client is not None:
+            await self._close_client(self._api_client)
+            self._api_client = None
+            self._api = None
+            self._loop = None
+
+
+# Global instance
+line_client = LineClient()
+
+
+def get_messaging_api() -> AsyncMessagingApi:
+    """
+    Get the shared LINE Messaging API
+    
+    Returns:
+        AsyncMessagingApi backed by the pooled client
+    """
+    return line_client.api
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Shared OpenAI API client
+"""
+import asyncio
+import importlib.util
+import logging
+from typing import Optional, Set
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIClient:
+    """
+    Long-lived, connection-pooled OpenAI client
+    
+    One client (and one HTTP connection pool) serves every message, so
+    the TLS handshake to the API is paid once rather than per request.
+    Like the LINE client, it is recreated if used from a different event
+    loop, because the pooled connections are bound to the loop, and the
+    replaced client is closed.
+    """
+    
+    def __init__(self):
+        self._client: Optional[AsyncOpenAI] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Future] = set()
+    
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Get the shared AsyncOpenAI instance"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            if self._client is not None:
+                self._close_previous(self._client, self._loop)
+            self._client = self._create_client()
+            self._loop = loop
+        return self._client
+    
+    def _close_previous(self, client: AsyncOpenAI, loop: asyncio.AbstractEventLoop):
+        """
+        Close a client created on another event loop
+        
+        The close runs on the client's own loop while that loop is still
+        running; otherwise it is done on the current loop.
+        """
+        if loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._close_client(client), loop)
+        else:
+            future = asyncio.ensure_future(self._close_client(client))
+        self._closing.add(future)
+        future.add_done_callback(self._closing.discard)
+    
+    async def _close_client(self, client: AsyncOpenAI):
+        """Close one client, logging failures"""
+        try:
+            await client.close()
+        except Exception as e:
+            logger.error(f"Error closing OpenAI client: {e}")
+    
+    def _create_client(self) -> AsyncOpenAI:
+        """Create the pooled client"""
+        http2 = settings.OPENAI_HTTP2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+        
+        http_client = DefaultAsyncHttpxClient(
+            http2=http2,
+            timeout=httpx.Timeout(settings.OPENAI_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY
+            )
+        )
+        
+        logger.info(f"Created OpenAI client (http2={http2})")
+        return AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=http_client
+        )
+    
+    async def start(self):
+        """Create the client up front instead of on the first message"""
+        if settings.OPENAI_API_KEY:
+            self.client
+    
+    async def close(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._close_client(self._client)
+            self._client = None
+            self._loop = None
+
+
+# Global instance
+openai_client = OpenAIClient()
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Get the shared OpenAI client
+    
+    Returns:
+        AsyncOpenAI backed by the pooled HTTP client
+    """
+    return openai_client.client
\ No newline at end of file
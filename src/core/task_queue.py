@@ -0,0 +1,192 @@
+"""
+Task queue abstraction for fanning work out across instances
+"""
+from typing import Dict, Any, Callable, Awaitable, Optional
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+
+from src.core.cache import TTLCache
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TaskHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+# Handlers for task names, used by the local enqueuer
+_task_handlers: Dict[str, TaskHandler] = {}
+
+
+def register_task_handler(task_name: str, handler: TaskHandler):
+    """
+    Register the coroutine that processes a task
+    
+    The /tasks/{task_name} endpoint calls the same handler when the task is
+    delivered by Cloud Tasks.
+    
+    Args:
+        task_name: Task name (also the /tasks endpoint path)
+        handler: Coroutine taking the task payload
+    """
+    _task_handlers[task_name] = handler
+
+
+class TaskEnqueuer:
+    """Base class for task enqueuers"""
+    
+    async def enqueue(
+        self,
+        task_name: str,
+        payload: Dict[str, Any],
+        task_id: Optional[str] = None,
+        schedule_at: Optional[datetime] = None
+    ) -> bool:
+        """
+        Enqueue a task
+        
+        Args:
+            task_name: Task name (also the /tasks endpoint path)
+            payload: JSON-serialisable payload
+            task_id: Optional ID used to deduplicate retried enqueues
+            schedule_at: Optional time (timezone-aware) to run the task at
+        
+        Returns:
+            True if the task was accepted
+        """
+        raise NotImplementedError
+
+
+class LocalTaskEnqueuer(TaskEnqueuer):
+    """
+    In-process stand-in for Cloud Tasks
+    
+    Runs registered handlers as background tasks on this instance.
+    Suitable for local development and the emulator.
+    """
+    
+    def __init__(self):
+        self._tasks: set = set()
+        # Bounded like Cloud Tasks' name deduplication window
+        self._seen_ids = TTLCache(
+            settings.TASK_DEDUP_MAX_ENTRIES,
+            settings.TASK_DEDUP_TTL_SECONDS
+        )
+    
+    async def enqueue(
+        self,
+        task_name: str,
+        payload: Dict[str, Any],
+        task_id: Optional[str] = None,
+        schedule_at: Optional[datetime] = None
+    ) -> bool:
+        handler = _task_handlers.get(task_name)
+        if not handler:
+            logger.error(f"No handler registered for task {task_name}")
+            return False
+        
+        if task_id and not self._seen_ids.add(task_id):
+            logger.info(f"Skipping duplicate task {task_id}")
+            return True
+        
+        task = asyncio.create_task(self._run(task_name, handler, payload, schedule_at))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+    
+    async def _run(
+        self,
+        task_name: str,
+        handler: TaskHandler,
+        payload: Dict[str, Any],
+        schedule_at: Optional[datetime] = None
+    ):
+        """Run a task handler (at schedule_at, if given) and log failures"""
+        try:
+            if schedule_at is not None:
+                delay = (schedule_at - datetime.now(timezone.utc)).total_seconds()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            
+            await handler(payload)
+        except Exception as e:
+            logger.error(f"Local task {task_name} failed: {e}")
+
+
+class CloudTasksEnqueuer(TaskEnqueuer):
+    """Enqueue HTTP tasks that call /tasks/{task_name} through Cloud Tasks"""
+    
+    def __init__(self):
+        from google.cloud import tasks_v2
+        
+        self._tasks_v2 = tasks_v2
+        self._client = tasks_v2.CloudTasksAsyncClient()
+        self._queue_path = self._client.queue_path(
+            settings.GOOGLE_CLOUD_PROJECT,
+            settings.CLOUD_TASKS_LOCATION,
+            settings.CLOUD_TASKS_QUEUE
+        )
+    
+    async def enqueue(
+        self,
+        task_name: str,
+        payload: Dict[str, Any],
+        task_id: Optional[str] = None,
+        schedule_at: Optional[datetime] = None
+    ) -> bool:
+        from google.api_core import exceptions
+        from google.protobuf import timestamp_pb2
+        
+        http_request = {
+            "http_method": self._tasks_v2.HttpMethod.POST,
+            "url": f"{settings.BASE_URL}/tasks/{task_name}",
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        }
+        
+        if settings.CLOUD_TASKS_SERVICE_ACCOUNT:
+            http_request["oidc_token"] = {
+                "service_account_email": settings.CLOUD_TASKS_SERVICE_ACCOUNT,
+                "audience": settings.BASE_URL
+            }
+        
+        task = {"http_request": http_request}
+        if task_id:
+            task["name"] = f"{self._queue_path}/tasks/{task_id}"
+        if schedule_at is not None:
+            schedule_time = timestamp_pb2.Timestamp()
+            schedule_time.FromDatetime(schedule_at.astimezone(timezone.utc).replace(tzinfo=None))
+            task["schedule_time"] = schedule_time
+        
+        try:
+            await self._client.create_task(parent=self._queue_path, task=task)
+            return True
+        
+        except exceptions.AlreadyExists:
+            logger.info(f"Task {task_id} already enqueued")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to enqueue task {task_name}: {e}")
+            return False
+
+
+_enqueuer: Optional[TaskEnqueuer] = None
+
+
+def get_task_enqueuer() -> TaskEnqueuer:
+    """
+    Get the configured task enqueuer
+    
+    Returns:
+        CloudTasksEnqueuer when TASK_QUEUE_BACKEND is "cloud_tasks",
+        otherwise LocalTaskEnqueuer
+    """
+    global _enqueuer
+    
+    if _enqueuer is None:
+        if settings.TASK_QUEUE_BACKEND == "cloud_tasks":
+            _enqueuer = CloudTasksEnqueuer()
+        else:
+            _enqueuer = LocalTaskEnqueuer()
+    
+    return _enqueuer
\ No newline at end of file
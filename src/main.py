@@ -8,7 +8,12 @@ import logging
 
 from src.core.config import settings
 from src.core.logging import setup_logging
+from src.core.line_client import line_client
+from src.core.openai_client import openai_client
 from src.routers import webhook, liff, tasks, health
+from src.services.conversation_writer import conversation_writer
+from src.services.push_queue import push_queue
+from src.services.webhook_queue import webhook_workers
 
 # Setup logging
 setup_logging()
@@ -24,10 +29,30 @@ async def lifespan(app: FastAPI):
     logger.info(f"Starting application in {settings.ENVIRONMENT} mode")
     logger.info(f"Project: {settings.GOOGLE_CLOUD_PROJECT}")
     
+    await line_client.start()
+    await openai_client.start()
+    await push_queue.start()
+    
+    await conversation_writer.start()
+    await webhook_workers.start()
+    
     yield
     
     # Shutdown
     logger.info("Shutting down application")
+    
+    # Finish in-flight webhook events; queued ones stay in the event queue
+    await webhook_workers.stop()
+    
+    # Flush buffered conversation writes
+    await conversation_writer.stop()
+    
+    # Send queued pushes before the LINE client goes away
+    await push_queue.stop()
+    
+    # Close pooled LINE and OpenAI connections
+    await line_client.close()
+    await openai_client.close()
 
 
 # Create FastAPI app
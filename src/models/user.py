@@ -21,9 +21,8 @@ class SubscriptionStatus(BaseModel):
     plan: str = "free"  # free, basic, premium
     is_active: bool = True
     expires_at: Optional[datetime] = None
-    ai_calls_used: int = 0
     ai_calls_limit: int = 10  # Monthly limit for free plan
-    last_reset_at: Optional[datetime] = None
+    billing_anchor_day: Optional[int] = None  # Day of month the billing period starts
 
 
 class User(BaseModel):
@@ -35,6 +34,7 @@ class User(BaseModel):
     calendars_access: list[str] = []
     preferences: UserPreferences = UserPreferences()
     subscription: SubscriptionStatus = SubscriptionStatus()
+    ai_usage: Dict[str, int] = {}  # AI calls per billing period (YYYY-MM)
     is_active: bool = True
     created_at: Optional[datetime] = None
     last_updated: Optional[datetime] = None
@@ -2,20 +2,125 @@
 Conversation history repository for Firestore
 """
 from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import asyncio
 import logging
 from google.cloud import firestore
 
+from src.core.config import settings
 from src.repositories.base_repository import BaseRepository
+from src.services.conversation_writer import conversation_writer
 
 logger = logging.getLogger(__name__)
 
+# Recent context document settings
+RECENT_CONTEXT_COLLECTION = 'conversation_context'
+RECENT_TURNS_LIMIT = 10  # Turns kept in the ring buffer
+RECENT_CONTEXT_HOURS = 2  # Context older than this is treated as a new conversation
+SUMMARY_MAX_CHARS = 500  # Rolling summary length
+RECENT_EVENTS_LIMIT = 5  # Referenced events kept for anaphora resolution
+
+
+def get_expire_at(timestamp: Optional[datetime] = None) -> datetime:
+    """
+    Get the expiry time for a conversation document
+    
+    Stored as expire_at so a Firestore TTL policy can remove documents.
+    
+    Args:
+        timestamp: Document time (defaults to now)
+    
+    Returns:
+        Expiry datetime
+    """
+    timestamp = timestamp or datetime.now(timezone.utc)
+    return timestamp + timedelta(days=settings.CONVERSATION_RETENTION_DAYS)
+
+
+def to_event_reference(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convert an event dict from the calendar service or agent to a reference
+    
+    Args:
+        event: Event data with event_id/id, title and start datetime
+    
+    Returns:
+        Event reference or None if the event has no ID
+    """
+    event_id = event.get('event_id') or event.get('id')
+    if not event_id:
+        return None
+    
+    return {
+        'event_id': event_id,
+        'title': event.get('title', ''),
+        'datetime': event.get('datetime') or event.get('start'),
+        'referenced_at': datetime.now(timezone.utc)
+    }
+
+
+def merge_event_references(
+    existing: List[Dict[str, Any]],
+    events: List[Dict[str, Any]],
+    removed_ids: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Merge newly referenced events into the recent events list
+    
+    Args:
+        existing: Current references (newest first)
+        events: Newly referenced events (newest first)
+        removed_ids: Event IDs to drop (e.g. deleted events)
+    
+    Returns:
+        Updated references, newest first, at most RECENT_EVENTS_LIMIT
+    """
+    removed = set(removed_ids or [])
+    merged = []
+    seen = set()
+    
+    new_refs = [ref for ref in (to_event_reference(e) for e in events) if ref]
+    for ref in new_refs + list(existing):
+        event_id = ref['event_id']
+        if event_id in seen or event_id in removed:
+            continue
+        seen.add(event_id)
+        merged.append(ref)
+    
+    return merged[:RECENT_EVENTS_LIMIT]
+
+
+def match_event_reference(
+    recent_events: List[Dict[str, Any]],
+    message: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Find the recent event a message names explicitly
+    
+    There is no fallback to the newest event, so words like "その" alone
+    never select an event.
+    
+    Args:
+        recent_events: Recent event references (newest first)
+        message: User's message
+    
+    Returns:
+        The event whose title or ID appears in the message, or None
+    """
+    for ref in recent_events:
+        ref_title = ref.get('title', '')
+        if ref['event_id'] in message or (len(ref_title) >= 2 and ref_title in message):
+            return ref
+    
+    return None
+
 
 class ConversationRepository(BaseRepository):
     """Repository for conversation history"""
     
     def __init__(self):
         super().__init__('conversations')
+        self.context_collection = self.db.collection(RECENT_CONTEXT_COLLECTION)
     
     async def add_message(
         self,
@@ -39,26 +144,60 @@ class ConversationRepository(BaseRepository):
             True if successful
         """
         try:
-            # Create conversation document ID (user_id + timestamp)
-            doc_id = f"{line_user_id}_{datetime.utcnow().timestamp()}"
-            
-            data = {
-                'line_user_id': line_user_id,
-                'role': role,
-                'content': content,
-                'timestamp': firestore.SERVER_TIMESTAMP,
-                'metadata': metadata or {}
-            }
-            
-            if function_call:
-                data['function_call'] = function_call
-            
-            return await self.create(doc_id, data)
+            doc_ref, data = self.build_message(
+                line_user_id, role, content, function_call, metadata
+            )
+            doc_ref.set(data)
+            return True
             
         except Exception as e:
             logger.error(f"Error adding conversation message: {e}")
             return False
     
+    def build_message(
+        self,
+        line_user_id: str,
+        role: str,
+        content: str,
+        function_call: Optional[Dict[str, Any]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        timestamp: Optional[datetime] = None
+    ) -> tuple:
+        """
+        Build the document reference and data for a conversation message
+        
+        Args:
+            line_user_id: LINE user ID
+            role: Message role (user/assistant/function)
+            content: Message content
+            function_call: Function call data if any
+            metadata: Additional metadata
+            timestamp: Client timestamp (keeps order within a batched commit)
+        
+        Returns:
+            Tuple of (document reference, data)
+        """
+        timestamp = timestamp or datetime.now(timezone.utc)
+        
+        # Create conversation document ID (user_id + timestamp)
+        doc_id = f"{line_user_id}_{timestamp.timestamp()}"
+        
+        data = {
+            'line_user_id': line_user_id,
+            'role': role,
+            'content': content,
+            'timestamp': timestamp,
+            'metadata': metadata or {},
+            'expire_at': get_expire_at(timestamp),
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'last_updated': firestore.SERVER_TIMESTAMP
+        }
+        
+        if function_call:
+            data['function_call'] = function_call
+        
+        return self.collection.document(doc_id), data
+    
     async def get_conversation_history(
         self,
         line_user_id: str,
@@ -98,69 +237,237 @@ class ConversationRepository(BaseRepository):
             logger.error(f"Error getting conversation history: {e}")
             return []
     
-    async def get_last_mentioned_event(
+    async def purge_expired_conversations(
         self,
-        line_user_id: str
-    ) -> Optional[Dict[str, Any]]:
+        page_size: int = 500,
+        max_pages: int = 20
+    ) -> Dict[str, Any]:
         """
-        Get the last event mentioned in conversation
+        Delete expired conversation documents in pages
+        
+        Production relies on a Firestore TTL policy on expire_at; this is for
+        environments without TTL such as the emulator. Each call handles at
+        most max_pages pages so it never turns into one long scan.
         
         Args:
-            line_user_id: LINE user ID
+            page_size: Documents deleted per page
+            max_pages: Maximum pages per collection in this call
             
         Returns:
-            Event data or None
+            Dict with deleted count and whether expired documents remain
         """
+        deleted = 0
+        has_more = False
+        
         try:
-            # Get recent messages with event metadata
-            messages = await self.get_conversation_history(
-                line_user_id,
-                limit=20,
-                hours_back=2
-            )
+            for collection in (self.collection, self.context_collection):
+                count, remaining = await asyncio.to_thread(
+                    self._purge_expired, collection, page_size, max_pages
+                )
+                deleted += count
+                has_more = has_more or remaining
             
-            # Look for messages with event metadata
-            for message in reversed(messages):
-                metadata = message.get('metadata', {})
-                if 'event' in metadata:
-                    return metadata['event']
+            logger.info(f"Purged {deleted} expired conversation documents")
             
-            return None
+        except Exception as e:
+            logger.error(f"Error purging expired conversations: {e}")
+        
+        return {"deleted": deleted, "has_more": has_more}
+    
+    def _purge_expired(self, collection, page_size: int, max_pages: int) -> tuple:
+        """Delete expired documents of a collection with a BulkWriter"""
+        now = datetime.now(timezone.utc)
+        query = (
+            collection
+            .where('expire_at', '<', now)
+            .order_by('expire_at')
+            .limit(page_size)
+        )
+        
+        bulk_writer = self.db.bulk_writer()
+        deleted = 0
+        cursor = None
+        
+        try:
+            for _ in range(max_pages):
+                page = query.start_after(cursor) if cursor else query
+                docs = list(page.stream())
+                
+                for doc in docs:
+                    bulk_writer.delete(doc.reference)
+                bulk_writer.flush()
+                deleted += len(docs)
+                
+                if len(docs) < page_size:
+                    return deleted, False
+                cursor = docs[-1]
             
+            return deleted, True
+        
+        finally:
+            bulk_writer.close()
+    
+    async def save_recent_context(
+        self,
+        line_user_id: str,
+        context: Dict[str, Any],
+        new_turns: List[Dict[str, Any]],
+        referenced_events: Optional[List[Dict[str, Any]]] = None
+    ) -> bool:
+        """
+        Append turns to the recent context ring buffer in a single write
+        
+        Args:
+            line_user_id: LINE user ID
+            context: Context previously returned by get_conversation_context
+            new_turns: Turns of this exchange ({"role", "content"})
+            referenced_events: Events referenced in this exchange, newest first
+        
+        Returns:
+            True if successful
+        """
+        try:
+            doc_ref, data = self.build_recent_context(
+                line_user_id, context, new_turns, referenced_events
+            )
+            doc_ref.set(data)
+            return True
+        
         except Exception as e:
-            logger.error(f"Error getting last mentioned event: {e}")
-            return None
+            logger.error(f"Error saving recent context for {line_user_id}: {e}")
+            return False
+    
+    def build_recent_context(
+        self,
+        line_user_id: str,
+        context: Dict[str, Any],
+        new_turns: List[Dict[str, Any]],
+        referenced_events: Optional[List[Dict[str, Any]]] = None,
+        removed_event_ids: Optional[List[str]] = None
+    ) -> tuple:
+        """Build the document reference and data for the recent context"""
+        turns = list(context.get("messages", [])) + new_turns
+        
+        # Fold turns that fall out of the buffer into the rolling summary
+        overflow = turns[:-RECENT_TURNS_LIMIT]
+        turns = turns[-RECENT_TURNS_LIMIT:]
+        summary = self._roll_summary(context.get("summary", ""), overflow)
+        
+        recent_events = merge_event_references(
+            context.get("recent_events", []),
+            referenced_events or [],
+            removed_event_ids
+        )
+        
+        data = {
+            'line_user_id': line_user_id,
+            'turns': turns,
+            'summary': summary,
+            'recent_events': recent_events,
+            'last_event': recent_events[0] if recent_events else None,
+            'updated_at': firestore.SERVER_TIMESTAMP,
+            'expire_at': get_expire_at()
+        }
+        
+        return self.context_collection.document(line_user_id), data
+    
+    def build_event_references(
+        self,
+        line_user_id: str,
+        context: Dict[str, Any],
+        referenced_events: List[Dict[str, Any]],
+        removed_event_ids: Optional[List[str]] = None
+    ) -> tuple:
+        """
+        Build a merge write that only updates the referenced event pointers
+        
+        Used by the pattern matching path, which has no conversation turns.
+        The write still sets expire_at, so a context document first created
+        here is covered by the TTL policy.
+        """
+        recent_events = merge_event_references(
+            context.get("recent_events", []),
+            referenced_events,
+            removed_event_ids
+        )
+        
+        data = {
+            'line_user_id': line_user_id,
+            'recent_events': recent_events,
+            'last_event': recent_events[0] if recent_events else None,
+            'expire_at': get_expire_at()
+        }
+        
+        return self.context_collection.document(line_user_id), data, True
     
-    async def clear_old_conversations(self, days_to_keep: int = 7) -> int:
+    async def backfill_context_expire_at(
+        self,
+        start_after: Optional[str] = None,
+        page_size: int = 500
+    ) -> Dict[str, Any]:
         """
-        Clear old conversation history
+        Set expire_at on one page of recent context documents missing it
+        
+        Context documents created by event reference writes before they set
+        expire_at are never removed by the TTL policy. Their expiry is
+        derived from updated_at when present, otherwise from now.
         
         Args:
-            days_to_keep: Number of days to keep
-            
+            start_after: Last document ID of the previous page
+            page_size: Documents per page
+        
         Returns:
-            Number of deleted messages
+            Dict with updated count and the cursor for the next page
         """
         try:
-            # Calculate cutoff date
-            cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
-            
-            # Query old messages
-            filters = [('timestamp', '<', cutoff_date)]
-            old_messages = await self.query(filters=filters)
+            query = self._context_page_query(start_after, page_size)
+            docs = list(query.stream())
             
-            # Delete old messages
-            count = 0
-            for message in old_messages:
-                if await self.delete(message['id']):
-                    count += 1
-            
-            logger.info(f"Deleted {count} old conversation messages")
-            return count
+            batch = self.db.batch()
+            updated = 0
+            for doc in docs:
+                data = doc.to_dict()
+                if data.get('expire_at'):
+                    continue
+                updated_at = data.get('updated_at')
+                batch.update(doc.reference, {
+                    'expire_at': get_expire_at(updated_at if isinstance(updated_at, datetime) else None)
+                })
+                updated += 1
+            if updated:
+                batch.commit()
             
+            next_cursor = docs[-1].id if len(docs) == page_size else None
+            return {"updated": updated, "next_cursor": next_cursor}
+        
         except Exception as e:
-            logger.error(f"Error clearing old conversations: {e}")
-            return 0
+            logger.error(f"Error backfilling context expire_at: {e}")
+            return {"updated": 0, "next_cursor": start_after}
+    
+    def _context_page_query(self, start_after: Optional[str], page_size: int):
+        """Query for one page of recent context documents after a document ID"""
+        query = (
+            self.context_collection
+            .select(['expire_at', 'updated_at'])
+            .order_by('__name__')
+            .limit(page_size)
+        )
+        if start_after:
+            query = query.start_after({'__name__': start_after})
+        return query
+    
+    def _roll_summary(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        """Append dropped turns to the summary, keeping only the newest part"""
+        if not turns:
+            return summary
+        
+        labels = {"user": "ユーザー", "assistant": "アシスタント"}
+        lines = [summary] if summary else []
+        for turn in turns:
+            label = labels.get(turn.get("role"), turn.get("role", ""))
+            lines.append(f"{label}: {turn.get('content') or ''}")
+        
+        return "\n".join(lines)[-SUMMARY_MAX_CHARS:]
     
     async def get_conversation_context(
         self,
@@ -169,45 +476,61 @@ class ConversationRepository(BaseRepository):
         """
         Get conversation context for AI processing
         
+        Reads only the per-user recent context document, with writes still
+        buffered in the conversation writer applied on top.
+        
         Args:
             line_user_id: LINE user ID
             
         Returns:
             Context dictionary
         """
+        context = {
+            "messages": [],
+            "summary": "",
+            "recent_events": [],
+            "last_event": None,
+            "user_id": line_user_id
+        }
+        
         try:
-            # Get recent conversation
-            messages = await self.get_conversation_history(
-                line_user_id,
-                limit=10,
-                hours_back=2
+            doc_ref = self.context_collection.document(line_user_id)
+            doc = await asyncio.to_thread(doc_ref.get)
+            data = conversation_writer.apply_pending(
+                doc_ref.path,
+                doc.to_dict() if doc.exists else None
             )
+            if not data:
+                return context
             
-            # Get last mentioned event
-            last_event = await self.get_last_mentioned_event(line_user_id)
-            
-            # Format for AI
-            formatted_messages = []
-            for msg in messages:
-                formatted = {
-                    "role": msg.get("role", "user"),
-                    "content": msg.get("content", "")
-                }
-                if msg.get("function_call"):
-                    formatted["function_call"] = msg["function_call"]
-                
-                formatted_messages.append(formatted)
+            threshold = datetime.now(timezone.utc) - timedelta(hours=RECENT_CONTEXT_HOURS)
+            
+            # Event pointers expire individually
+            recent_events = [
+                ref for ref in data.get('recent_events', [])
+                if ref.get('referenced_at') and ref['referenced_at'] >= threshold
+            ]
+            context["recent_events"] = recent_events
+            context["last_event"] = recent_events[0] if recent_events else None
+            
+            # Treat stale context as the start of a new conversation
+            # A buffered write still holds the SERVER_TIMESTAMP sentinel
+            updated_at = data.get('updated_at')
+            if isinstance(updated_at, datetime) and updated_at < threshold:
+                return context
             
-            return {
-                "messages": formatted_messages,
-                "last_event": last_event,
-                "user_id": line_user_id
-            }
+            context.update({
+                "messages": [
+                    {
+                        "role": turn.get("role", "user"),
+                        "content": turn.get("content", "")
+                    }
+                    for turn in data.get('turns', [])
+                ],
+                "summary": data.get('summary', "")
+            })
+            return context
             
         except Exception as e:
             logger.error(f"Error getting conversation context: {e}")
-            return {
-                "messages": [],
-                "last_event": None,
-                "user_id": line_user_id
-            }
\ No newline at end of file
+            return context
\ No newline at end of file
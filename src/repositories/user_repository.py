@@ -4,12 +4,69 @@ User repository for Firestore operations
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 import logging
+from google.cloud import firestore
 
 from src.repositories.base_repository import BaseRepository
+from src.core.config import settings
 from src.core.crypto import encrypt_token, decrypt_token
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PREFERENCES = {
+    'reminder_enabled': True,
+    'reminder_time_morning': '09:00',
+    'reminder_time_evening': '21:00',
+    'reminder_days_ahead': 1,
+    'reminder_before_event_minutes': 0
+}
+
+
+def get_reminder_bucket(time_str: str) -> Optional[int]:
+    """
+    Convert an HH:MM reminder time to its minute-of-day bucket
+    
+    Args:
+        time_str: Time in HH:MM format
+    
+    Returns:
+        Bucket start as minutes since midnight, or None if invalid
+    """
+    try:
+        hour, minute = (int(part) for part in time_str.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    
+    minute_of_day = hour * 60 + minute
+    return minute_of_day - minute_of_day % settings.REMINDER_BUCKET_MINUTES
+
+
+def get_reminder_buckets(preferences: Dict[str, Any]) -> list:
+    """
+    Get the minute-of-day buckets a user should receive reminders in
+    
+    Denormalised onto the user document as reminder_buckets so the
+    scheduler only loads users due in the current bucket.
+    
+    Args:
+        preferences: User preferences
+    
+    Returns:
+        Sorted list of bucket start minutes
+    """
+    if not preferences.get('reminder_enabled', False):
+        return []
+    
+    buckets = set()
+    for key in ('reminder_time_morning', 'reminder_time_evening'):
+        bucket = get_reminder_bucket(preferences.get(key) or '')
+        if bucket is not None:
+            buckets.add(bucket)
+    
+    return sorted(buckets)
+
 
 class UserRepository(BaseRepository):
     """Repository for user data"""
@@ -49,13 +106,8 @@ class UserRepository(BaseRepository):
                 'google_refresh_token_encrypted': encrypted_token,
                 'google_token_expiry': token_expiry,
                 'calendars_access': [],  # Will be populated later
-                'preferences': {
-                    'reminder_enabled': True,
-                    'reminder_time_morning': '09:00',
-                    'reminder_time_evening': '21:00',
-                    'reminder_days_ahead': 1,
-                    'reminder_before_event_minutes': 0
-                },
+                'preferences': dict(DEFAULT_PREFERENCES),
+                'reminder_buckets': get_reminder_buckets(DEFAULT_PREFERENCES),
                 'is_active': True
             }
             
@@ -86,6 +138,34 @@ class UserRepository(BaseRepository):
             logger.error(f"Error updating tokens for {line_user_id}: {e}")
             return False
     
+    async def set_user_active(
+        self,
+        line_user_id: str,
+        is_active: bool,
+        reason: Optional[str] = None
+    ) -> bool:
+        """
+        Activate or deactivate a user for reminders and other fan-out jobs
+        
+        Args:
+            line_user_id: LINE user ID
+            is_active: New state
+            reason: Why the user was deactivated (e.g. 'unfollowed', 'unreachable')
+        
+        Returns:
+            True if the user exists and was updated
+        """
+        try:
+            return await self.update(line_user_id, {
+                'is_active': is_active,
+                'deactivated_reason': None if is_active else reason,
+                'deactivated_at': None if is_active else firestore.SERVER_TIMESTAMP
+            })
+        
+        except Exception as e:
+            logger.error(f"Error setting is_active for {line_user_id}: {e}")
+            return False
+    
     async def get_user_refresh_token(self, line_user_id: str) -> Optional[str]:
         """Get decrypted refresh token for user"""
         user = await self.get_user(line_user_id)
@@ -103,26 +183,309 @@ class UserRepository(BaseRepository):
         line_user_id: str,
         preferences: Dict[str, Any]
     ) -> bool:
-        """Update user preferences"""
-        return await self.update(line_user_id, {'preferences': preferences})
+        """
+        Update user preferences
+        
+        Merges with the stored preferences and keeps the denormalised
+        reminder_buckets field in sync.
+        
+        Args:
+            line_user_id: LINE user ID
+            preferences: Preference fields to update
+        
+        Returns:
+            True if successful
+        """
+        user = await self.get_user(line_user_id)
+        if not user:
+            return False
+        
+        merged = {**user.get('preferences', {}), **preferences}
+        
+        return await self.update(line_user_id, {
+            'preferences': merged,
+            'reminder_buckets': get_reminder_buckets(merged)
+        })
     
-    async def get_users_for_reminder(self, time_slot: str) -> list:
+    async def increment_ai_usage(self, line_user_id: str, period_key: str) -> bool:
         """
-        Get users who should receive reminders at specified time
+        Increment AI usage counter for a billing period
         
         Args:
-            time_slot: 'morning' or 'evening'
+            line_user_id: LINE user ID
+            period_key: Billing period key (YYYY-MM)
+        
+        Returns:
+            True if successful
+        """
+        # Atomic server-side increment, no read required
+        return await self.update(line_user_id, {
+            f'ai_usage.{period_key}': firestore.Increment(1)
+        })
+    
+    async def get_users_for_reminder(
+        self,
+        bucket: int,
+        start_at: Optional[str] = None,
+        end_at: Optional[str] = None
+    ) -> list:
+        """
+        Get users who should receive reminders in the given bucket
+        
+        Args:
+            bucket: Minute-of-day bucket (see get_reminder_bucket)
+            start_at: First user ID of the shard (inclusive)
+            end_at: Last user ID of the shard (inclusive)
             
         Returns:
             List of users
+        
+        Raises:
+            Exception: The query failed; an empty shard must not look like
+                a successful run
+        """
+        try:
+            query = self._reminder_shard_query(bucket, start_at, end_at)
+            
+            results = []
+            for doc in query.stream():
+                data = doc.to_dict()
+                data['id'] = doc.id
+                results.append(data)
+            
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error getting users for reminder: {e}")
+            raise
+    
+    async def get_user_ids_for_reminder(self, bucket: int) -> list:
         """
-        # Query users with reminders enabled
-        filters = [
-            ('is_active', '==', True),
-            ('preferences.reminder_enabled', '==', True)
-        ]
+        Get IDs of users due in the given bucket, ordered by ID
+        
+        Uses a projection query so no user data is transferred.
+        
+        Args:
+            bucket: Minute-of-day bucket
+        
+        Returns:
+            List of LINE user IDs
         
-        return await self.query(filters=filters)
+        Raises:
+            Exception: The query failed; an empty list would silently skip
+                the whole slot
+        """
+        try:
+            query = self._reminder_query(bucket).select([])
+            return [doc.id for doc in query.stream()]
+        
+        except Exception as e:
+            logger.error(f"Error getting user IDs for reminder: {e}")
+            raise
+    
+    async def get_active_user_ids(self) -> list:
+        """
+        Get IDs of all active users
+        
+        Uses a projection query so no user data is transferred.
+        
+        Returns:
+            List of LINE user IDs
+        """
+        try:
+            query = self.collection.where('is_active', '==', True).select([])
+            return [doc.id for doc in query.stream()]
+        
+        except Exception as e:
+            logger.error(f"Error getting active user IDs: {e}")
+            return []
+    
+    def _reminder_query(self, bucket: int):
+        """Query for active users due in a bucket, ordered by document ID"""
+        return (
+            self.collection
+            .where('is_active', '==', True)
+            .where('reminder_buckets', 'array_contains', bucket)
+            .order_by('__name__')
+        )
+    
+    def _reminder_shard_query(
+        self,
+        bucket: int,
+        start_at: Optional[str] = None,
+        end_at: Optional[str] = None
+    ):
+        """Reminder query bounded to a shard's document ID range"""
+        query = self._reminder_query(bucket)
+        # Cursors on __name__ take the document ID; a bare DocumentReference
+        # is not a valid cursor value
+        if start_at:
+            query = query.start_at({'__name__': start_at})
+        if end_at:
+            query = query.end_at({'__name__': end_at})
+        return query
+    
+    async def get_reminder_users_page(
+        self,
+        start_after: Optional[str] = None,
+        page_size: int = 200
+    ) -> list:
+        """
+        Get one page of active users with reminders enabled, ordered by ID
+        
+        Args:
+            start_after: Last user ID of the previous page
+            page_size: Users per page
+        
+        Returns:
+            List of users
+        """
+        try:
+            query = self._reminder_users_page_query(start_after, page_size)
+            
+            results = []
+            for doc in query.stream():
+                data = doc.to_dict()
+                data['id'] = doc.id
+                results.append(data)
+            
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error getting reminder users page: {e}")
+            return []
+    
+    def _reminder_users_page_query(self, start_after: Optional[str], page_size: int):
+        """Query for one page of reminder users after a document ID"""
+        query = (
+            self.collection
+            .where('is_active', '==', True)
+            .where('preferences.reminder_enabled', '==', True)
+            .order_by('__name__')
+            .limit(page_size)
+        )
+        if start_after:
+            query = query.start_after({'__name__': start_after})
+        return query
+    
+    async def get_event_reminder_settings(self) -> Dict[str, int]:
+        """
+        Get the pre-event reminder lead time of every active user who set one
+        
+        Uses a projection query so only preferences are transferred.
+        
+        Returns:
+            Minutes before events per LINE user ID
+        """
+        try:
+            query = (
+                self.collection
+                .where('preferences.reminder_before_event_minutes', '>', 0)
+                .select(['is_active', 'preferences.reminder_before_event_minutes'])
+            )
+            
+            settings_by_user = {}
+            for doc in query.stream():
+                data = doc.to_dict()
+                if data.get('is_active', True):
+                    settings_by_user[doc.id] = data['preferences']['reminder_before_event_minutes']
+            
+            return settings_by_user
+        
+        except Exception as e:
+            logger.error(f"Error getting event reminder settings: {e}")
+            return {}
+    
+    async def save_reminder_digests(self, digests: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Store precomputed reminder digests on the user documents
+        
+        Args:
+            digests: Digest per LINE user ID
+        
+        Returns:
+            True if successful
+        """
+        if not digests:
+            return True
+        
+        try:
+            batch = self.db.batch()
+            for line_user_id, digest in digests.items():
+                batch.update(self.collection.document(line_user_id), {
+                    'reminder_digest': digest
+                })
+            batch.commit()
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error saving reminder digests: {e}")
+            return False
+    
+    async def clear_reminder_digest(self, line_user_id: str) -> bool:
+        """
+        Drop the user's precomputed reminder digest
+        
+        Called when the bot changes the user's calendar, so the next
+        reminder is computed live instead of sending an outdated digest.
+        
+        Args:
+            line_user_id: LINE user ID
+        
+        Returns:
+            True if successful
+        """
+        try:
+            self.collection.document(line_user_id).update({
+                'reminder_digest': firestore.DELETE_FIELD
+            })
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error clearing reminder digest for {line_user_id}: {e}")
+            return False
+    
+    async def backfill_reminder_buckets(
+        self,
+        start_after: Optional[str] = None,
+        page_size: int = 200
+    ) -> Dict[str, Any]:
+        """
+        Recompute reminder_buckets for one page of users
+        
+        Args:
+            start_after: Last user ID of the previous page
+            page_size: Users per page
+        
+        Returns:
+            Dict with updated count and the cursor for the next page
+        """
+        try:
+            query = self._backfill_page_query(start_after, page_size)
+            docs = list(query.stream())
+            
+            batch = self.db.batch()
+            for doc in docs:
+                preferences = doc.to_dict().get('preferences', {})
+                batch.update(doc.reference, {
+                    'reminder_buckets': get_reminder_buckets(preferences)
+                })
+            if docs:
+                batch.commit()
+            
+            next_cursor = docs[-1].id if len(docs) == page_size else None
+            return {"updated": len(docs), "next_cursor": next_cursor}
+        
+        except Exception as e:
+            logger.error(f"Error backfilling reminder buckets: {e}")
+            return {"updated": 0, "next_cursor": start_after}
+    
+    def _backfill_page_query(self, start_after: Optional[str], page_size: int):
+        """Query for one page of all users after a document ID"""
+        query = self.collection.order_by('__name__').limit(page_size)
+        if start_after:
+            query = query.start_after({'__name__': start_after})
+        return query
     
     async def store_auth_state(
         self,
@@ -33,4 +33,32 @@ async def readiness_check():
         return Response(
             content={"status": "not ready", "error": str(e)},
             status_code=503
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/health/metrics")
+async def metrics():
+    """
+    Load and queue metrics for the message pipeline
+    """
+    from src.core.admission import message_admission
+    from src.core.idempotency import webhook_dedup
+    from src.services.push_queue import push_queue
+    from src.services.webhook_queue import webhook_workers
+    
+    return {
+        "admission": message_admission.metrics(),
+        "webhook_workers": {
+            "running": webhook_workers.is_running,
+            "in_flight": webhook_workers.in_flight,
+            "active_users": webhook_workers.dispatcher.active_users,
+            **webhook_workers.stats,
+            **webhook_workers.dispatcher.stats
+        },
+        "webhook_dedup": webhook_dedup.stats,
+        "push_queue": {
+            "running": push_queue.is_running,
+            "pending": push_queue.pending,
+            **push_queue.stats
+        }
+    }
\ No newline at end of file
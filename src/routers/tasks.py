@@ -60,23 +60,195 @@ async def process_token_refresh(request: Request):
 @router.post("/generate-reminders")
 async def generate_daily_reminders(request: Request):
     """
-    Generate reminders for all users
-    Called by Cloud Scheduler
+    Plan reminders for users due in the current time bucket
+    Called by Cloud Scheduler every REMINDER_BUCKET_MINUTES minutes;
+    enqueues one /tasks/reminder-shard task per shard of users
     """
     try:
+        from src.services.reminder_service import (
+            plan_reminder_shards,
+            get_current_reminder_bucket
+        )
+        
         payload = await request.json()
-        time_slot = payload.get("time_slot", "morning")  # morning or evening
+        bucket = payload.get("bucket")
+        if bucket is None:
+            bucket = get_current_reminder_bucket()
         
-        from src.services.reminder_service import generate_reminders_for_all_users
-        count = await generate_reminders_for_all_users(time_slot)
+        result = await plan_reminder_shards(int(bucket))
         
-        return {"status": "generated", "count": count}
+        return {"status": "planned", "bucket": bucket, **result}
         
     except Exception as e:
         logger.error(f"Failed to generate reminders: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/reminder-shard")
+async def process_reminder_shard_task(request: Request):
+    """
+    Generate and send reminders for one shard of users
+    Enqueued by /tasks/generate-reminders
+    """
+    try:
+        from src.services.reminder_service import process_reminder_shard
+        
+        payload = await request.json()
+        if payload.get("bucket") is None:
+            raise ValueError("Missing bucket")
+        
+        stats = await process_reminder_shard(payload)
+        
+        return {"status": "processed", **stats}
+    
+    except Exception as e:
+        logger.error(f"Failed to process reminder shard: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/precompute-digests")
+async def precompute_digests(request: Request):
+    """
+    Precompute next-period reminder digests
+    Called by Cloud Scheduler off-peak; processes the first page and
+    enqueues the following pages as digest-page tasks
+    """
+    try:
+        from src.services.reminder_service import precompute_reminder_digests
+        
+        payload = await request.json()
+        stats = await precompute_reminder_digests(payload)
+        
+        return {"status": "precomputed", **stats}
+    
+    except Exception as e:
+        logger.error(f"Failed to precompute digests: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/digest-page")
+async def process_digest_page(request: Request):
+    """
+    Precompute reminder digests for one page of users
+    Enqueued by /tasks/precompute-digests
+    """
+    return await precompute_digests(request)
+
+
+@router.post("/sync-event-reminders")
+async def sync_event_reminders(request: Request):
+    """
+    Schedule "N minutes before" reminders for upcoming events
+    Called by Cloud Scheduler (e.g. hourly) to pick up events created
+    outside the bot
+    """
+    try:
+        from src.services.reminder_service import sync_event_reminders as sync
+        
+        stats = await sync()
+        
+        return {"status": "synced", **stats}
+    
+    except Exception as e:
+        logger.error(f"Failed to sync event reminders: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/event-reminder")
+async def process_event_reminder(request: Request):
+    """
+    Send one user's "N minutes before" reminder
+    Enqueued with a deterministic name by the event reminder scheduler
+    """
+    try:
+        from src.services.event_reminder_scheduler import event_reminder_scheduler
+        
+        payload = await request.json()
+        if not payload.get("line_user_id") or payload.get("minute") is None:
+            raise ValueError("Missing line_user_id or minute")
+        
+        stats = await event_reminder_scheduler.send_due(payload)
+        
+        return {"status": "processed", **stats}
+    
+    except Exception as e:
+        logger.error(f"Failed to process event reminder: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/backfill-reminder-buckets")
+async def backfill_reminder_buckets(request: Request):
+    """
+    Recompute reminder_buckets for one page of users
+    Call again with the returned next_cursor until it is null
+    """
+    try:
+        from src.repositories.user_repository import UserRepository
+        
+        payload = await request.json()
+        
+        user_repo = UserRepository()
+        result = await user_repo.backfill_reminder_buckets(
+            start_after=payload.get("start_after"),
+            page_size=int(payload.get("page_size", 200))
+        )
+        
+        return {"status": "backfilled", **result}
+    
+    except Exception as e:
+        logger.error(f"Failed to backfill reminder buckets: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/backfill-context-expiry")
+async def backfill_context_expiry(request: Request):
+    """
+    Set expire_at on recent context documents written without it
+    One-off after deploying the expire_at fix for event reference writes;
+    call again with the returned next_cursor until it is null
+    """
+    try:
+        from src.repositories.conversation_repository import ConversationRepository
+        
+        payload = await request.json()
+        
+        conversation_repo = ConversationRepository()
+        result = await conversation_repo.backfill_context_expire_at(
+            start_after=payload.get("start_after"),
+            page_size=int(payload.get("page_size", 500))
+        )
+        
+        return {"status": "backfilled", **result}
+    
+    except Exception as e:
+        logger.error(f"Failed to backfill context expiry: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/announce")
+async def send_announcement_task(request: Request):
+    """
+    Send the same message (maintenance notice, plan announcement, ...)
+    to the given users, or to all active users, via LINE multicast
+    """
+    try:
+        from src.services.reminder_service import send_announcement
+        
+        payload = await request.json()
+        message = payload.get("message")
+        
+        if not message:
+            raise ValueError("Missing message")
+        
+        stats = await send_announcement(message, payload.get("line_user_ids"))
+        
+        return {"status": "sent", **stats}
+    
+    except Exception as e:
+        logger.error(f"Failed to send announcement: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/proactive-suggestions")
 async def generate_proactive_suggestions(request: Request):
     """
@@ -84,22 +256,16 @@ async def generate_proactive_suggestions(request: Request):
     Called by Cloud Scheduler
     """
     try:
-        from src.services.conversation_service import ConversationService
+        from src.services.conversation_service import get_conversation_service
         from src.repositories.user_repository import UserRepository
-        from linebot.v3.messaging import (
-            ApiClient,
-            MessagingApi,
-            PushMessageRequest,
-            TextMessage,
-            Configuration
-        )
         from src.core.config import settings
+        from src.services.push_queue import push_queue
         
         # Only process if AI is enabled
         if not settings.USE_AI_AGENT or not settings.OPENAI_API_KEY:
             return {"status": "skipped", "reason": "AI agent not enabled"}
         
-        conversation_service = ConversationService()
+        conversation_service = get_conversation_service()
         user_repo = UserRepository()
         
         # Get active users
@@ -108,36 +274,20 @@ async def generate_proactive_suggestions(request: Request):
             limit=100  # Process in batches
         )
         
-        # LINE API configuration
-        configuration = Configuration(
-            host="https://api.line.me",
-            access_token=settings.LINE_CHANNEL_ACCESS_TOKEN
-        )
-        
         count = 0
         
-        async with ApiClient(configuration=configuration) as api_client:
-            api = MessagingApi(api_client)
+        for user in users:
+            line_user_id = user['id']
             
-            for user in users:
-                line_user_id = user['id']
-                
-                # Generate suggestions
-                suggestions = await conversation_service.get_proactive_suggestions(
-                    line_user_id
-                )
-                
-                if suggestions:
-                    # Send suggestions
-                    try:
-                        request = PushMessageRequest(
-                            to=line_user_id,
-                            messages=[TextMessage(text=f"💡 提案：\n{suggestions}")]
-                        )
-                        await api.push_message(request)
-                        count += 1
-                    except Exception as e:
-                        logger.error(f"Failed to send suggestion to {line_user_id}: {e}")
+            # Generate suggestions
+            suggestions = await conversation_service.get_proactive_suggestions(
+                line_user_id
+            )
+            
+            if suggestions:
+                # Queue suggestions for rate-limited delivery
+                if await push_queue.enqueue([line_user_id], f"💡 提案：\n{suggestions}"):
+                    count += 1
         
         return {"status": "sent", "count": count}
         
@@ -146,49 +296,90 @@ async def generate_proactive_suggestions(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/reset-ai-usage")
-async def reset_monthly_ai_usage(request: Request):
+@router.get("/dead-letters")
+async def list_dead_letters(limit: int = 100):
     """
-    Reset monthly AI usage counters
-    Called by Cloud Scheduler monthly
+    List LINE messages that could not be delivered
     """
     try:
-        from src.repositories.user_repository import UserRepository
-        from datetime import datetime, timedelta
+        from src.services.push_queue import push_queue
         
-        user_repo = UserRepository()
+        entries = await push_queue.dead_letters.list(limit=limit)
         
-        # Get all users
-        users = await user_repo.query(limit=1000)
+        return {"count": len(entries), "entries": entries}
+    
+    except Exception as e:
+        logger.error(f"Failed to list dead letters: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/replay-dead-letters")
+async def replay_dead_letters(request: Request):
+    """
+    Send dead-lettered LINE messages again
+    Messages LINE rejected permanently are skipped unless
+    include_permanent is set
+    """
+    try:
+        from src.services.push_queue import push_queue
         
-        count = 0
-        for user in users:
-            subscription = user.get('subscription', {})
-            last_reset = subscription.get('last_reset_at')
-            
-            # Check if reset is needed (30 days since last reset)
-            should_reset = False
-            if last_reset:
-                last_reset_date = datetime.fromisoformat(last_reset)
-                if datetime.now() - last_reset_date >= timedelta(days=30):
-                    should_reset = True
-            else:
-                should_reset = True
-            
-            if should_reset:
-                subscription['ai_calls_used'] = 0
-                subscription['last_reset_at'] = datetime.now().isoformat()
-                
-                success = await user_repo.update(user['id'], {
-                    'subscription': subscription
-                })
-                
-                if success:
-                    count += 1
+        payload = await request.json()
+        stats = await push_queue.replay_dead_letters(
+            limit=int(payload.get("limit", 100)),
+            include_permanent=bool(payload.get("include_permanent", False))
+        )
+        
+        return {"status": "replayed", **stats}
+    
+    except Exception as e:
+        logger.error(f"Failed to replay dead letters: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/drain-webhook-events")
+async def drain_webhook_events(request: Request):
+    """
+    Process queued webhook events
+    Called by a scheduler where no worker pool runs (e.g. Vercel) to pick
+    up events whose background drain was frozen or lost
+    """
+    try:
+        from src.services.webhook_queue import webhook_workers
+        
+        payload = await request.json()
+        processed = await webhook_workers.drain(
+            max_events=int(payload.get("max_events", 100))
+        )
+        
+        return {"status": "drained", "processed": processed}
+    
+    except Exception as e:
+        logger.error(f"Failed to drain webhook events: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/purge-conversations")
+async def purge_expired_conversations(request: Request):
+    """
+    Delete expired conversation documents
+    For environments without a Firestore TTL policy (e.g. emulator)
+    Called by Cloud Scheduler; call again while has_more is true
+    """
+    try:
+        from src.repositories.conversation_repository import ConversationRepository
+        
+        payload = await request.json()
+        page_size = int(payload.get("page_size", 500))
+        max_pages = int(payload.get("max_pages", 20))
         
-        logger.info(f"Reset AI usage for {count} users")
-        return {"status": "reset", "count": count}
+        conversation_repo = ConversationRepository()
+        result = await conversation_repo.purge_expired_conversations(
+            page_size=page_size,
+            max_pages=max_pages
+        )
         
+        return {"status": "purged", **result}
+    
     except Exception as e:
-        logger.error(f"Failed to reset AI usage: {e}")
+        logger.error(f"Failed to purge conversations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
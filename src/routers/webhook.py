@@ -4,11 +4,12 @@ LINE Webhook handler
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
 from linebot.v3.webhook import WebhookParser
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
 import logging
 
 from src.core.config import settings
-from src.services.message_handler import handle_text_message
+from src.core.idempotency import webhook_dedup
+from src.services.message_handler import is_handled_event
+from src.services.webhook_queue import webhook_workers
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -44,15 +45,29 @@ async def handle_webhook(
         logger.error(f"Failed to parse webhook: {e}")
         raise HTTPException(status_code=500, detail="Parse error")
     
-    # Process events in background
+    # Persist events; the worker pool processes them after we respond
     for event in events:
-        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
-            background_tasks.add_task(
-                handle_text_message,
-                event
-            )
-        else:
+        if not is_handled_event(event):
             logger.info(f"Unhandled event type: {type(event)}")
+            continue
+        
+        # Skip redeliveries of events we already accepted
+        event_id = getattr(event, 'webhook_event_id', None)
+        if not await webhook_dedup.claim(event_id):
+            logger.info(f"Skipping duplicate webhook event {event_id}")
+            continue
+        
+        try:
+            await webhook_workers.submit(event.to_json())
+        except Exception as e:
+            # Let LINE redeliver rather than lose the event
+            logger.error(f"Failed to queue webhook event {event_id}: {e}")
+            await webhook_dedup.release(event_id)
+            raise HTTPException(status_code=500, detail="Queue unavailable")
+    
+    # Without a running worker pool (serverless), drain after responding
+    if not webhook_workers.is_running:
+        background_tasks.add_task(webhook_workers.drain)
     
     # Return immediately to LINE
     return {"status": "ok"}
\ No newline at end of file
@@ -3,6 +3,7 @@ Authentication service for Google OAuth
 """
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
+import asyncio
 import logging
 from urllib.parse import urlencode
 from google.auth.transport.requests import Request
@@ -10,7 +11,9 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 
+from src.core.cache import TTLCache
 from src.core.config import settings
+from src.core.crypto import decrypt_token
 from src.repositories.user_repository import UserRepository
 
 logger = logging.getLogger(__name__)
@@ -21,6 +24,18 @@ SCOPES = [
     'https://www.googleapis.com/auth/userinfo.email'
 ]
 
+# Refreshed credentials, reused until shortly before the access token expires
+_credentials_cache = TTLCache(settings.CREDENTIALS_CACHE_MAX_ENTRIES, 3600)
+
+# In-flight loads, so concurrent callers share a single refresh
+_credential_loads: Dict[str, asyncio.Task] = {}
+
+# Users known to have no linked account, so repeat messages skip the user read
+_unlinked_users = TTLCache(
+    settings.UNLINKED_CACHE_MAX_ENTRIES,
+    settings.UNLINKED_CACHE_TTL_SECONDS
+)
+
 
 def generate_google_auth_url(state: str, code_challenge: str) -> str:
     """
@@ -117,6 +132,8 @@ async def save_user_tokens(
     """
     try:
         user_repo = UserRepository()
+        invalidate_user_credentials(line_user_id)
+        _unlinked_users.delete(line_user_id)
         
         # Check if user exists
         existing_user = await user_repo.get_user(line_user_id)
@@ -142,25 +159,99 @@ async def save_user_tokens(
         return False
 
 
-async def get_user_credentials(line_user_id: str) -> Optional[Credentials]:
+async def get_user_credentials(
+    line_user_id: str,
+    user: Optional[Dict[str, Any]] = None
+) -> Optional[Credentials]:
     """
     Get valid Google credentials for user
     
     Args:
         line_user_id: LINE user ID
+        user: User document if already loaded
         
     Returns:
         Google credentials or None
     """
+    credentials = _credentials_cache.get(line_user_id)
+    if credentials is not None:
+        return credentials
+    
+    load = _credential_loads.get(line_user_id)
+    if load is None:
+        load = asyncio.create_task(_load_user_credentials(line_user_id, user))
+        _credential_loads[line_user_id] = load
+        load.add_done_callback(lambda _: _credential_loads.pop(line_user_id, None))
+    
+    # Shielded so a cancelled caller does not abort the shared load
+    return await asyncio.shield(load)
+
+
+async def warm_user_credentials(
+    line_user_id: str,
+    user: Optional[Dict[str, Any]] = None
+) -> bool:
+    """
+    Load and refresh credentials ahead of Calendar calls
+    
+    Args:
+        line_user_id: LINE user ID
+        user: User document if already loaded
+    
+    Returns:
+        True if valid credentials are available
+    """
+    return await get_user_credentials(line_user_id, user) is not None
+
+
+def invalidate_user_credentials(line_user_id: str):
+    """
+    Drop cached credentials, e.g. after the user re-links
+    
+    Args:
+        line_user_id: LINE user ID
+    """
+    _credentials_cache.delete(line_user_id)
+
+
+def is_known_unlinked(line_user_id: str) -> bool:
+    """
+    Check the negative cache for users without a linked account
+    
+    Args:
+        line_user_id: LINE user ID
+    
+    Returns:
+        True if the user was recently seen without a linked account
+    """
+    return line_user_id in _unlinked_users
+
+
+def mark_unlinked(line_user_id: str):
+    """
+    Remember that a user has no linked account
+    
+    Args:
+        line_user_id: LINE user ID
+    """
+    _unlinked_users.set(line_user_id, True)
+
+
+async def _load_user_credentials(
+    line_user_id: str,
+    user: Optional[Dict[str, Any]] = None
+) -> Optional[Credentials]:
+    """Build and refresh credentials from the stored refresh token"""
     try:
         user_repo = UserRepository()
-        user = await user_repo.get_user(line_user_id)
+        if user is None:
+            user = await user_repo.get_user(line_user_id)
         
-        if not user:
+        if not user or not user.get('google_refresh_token_encrypted'):
             return None
         
         # Get decrypted refresh token
-        refresh_token = await user_repo.get_user_refresh_token(line_user_id)
+        refresh_token = decrypt_token(user['google_refresh_token_encrypted'])
         if not refresh_token:
             return None
         
@@ -176,7 +267,7 @@ async def get_user_credentials(line_user_id: str) -> Optional[Credentials]:
         
         # Refresh if needed
         if not credentials.valid:
-            credentials.refresh(Request())
+            await asyncio.to_thread(credentials.refresh, Request())
             
             # Update token expiry in database
             await user_repo.update_user_tokens(
@@ -185,6 +276,13 @@ async def get_user_credentials(line_user_id: str) -> Optional[Credentials]:
                 credentials.expiry
             )
         
+        # Cache until shortly before the access token expires
+        if credentials.expiry:
+            ttl = (credentials.expiry - datetime.utcnow()).total_seconds()
+            ttl -= settings.CREDENTIALS_EXPIRY_MARGIN_SECONDS
+            if ttl > 0:
+                _credentials_cache.set(line_user_id, credentials, ttl)
+        
         return credentials
         
     except Exception as e:
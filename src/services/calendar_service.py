@@ -2,12 +2,15 @@
 Google Calendar service
 """
 from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import asyncio
 import logging
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from src.repositories.user_repository import UserRepository
 from src.services.auth_service import get_user_credentials
+from src.services.event_reminder_scheduler import event_reminder_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -40,14 +43,21 @@ class CalendarService:
             # Build event
             event = self._build_event_from_entities(entities)
             
-            # Create event
-            created_event = service.events().insert(
-                calendarId='primary',
-                body=event
-            ).execute()
+            # Create event (blocking HTTP call runs in a worker thread)
+            created_event = await asyncio.to_thread(
+                service.events().insert(
+                    calendarId='primary',
+                    body=event
+                ).execute
+            )
             
             logger.info(f"Created event {created_event['id']} for user {line_user_id}")
             
+            await event_reminder_scheduler.schedule_event(
+                line_user_id, self._format_event(created_event)
+            )
+            await UserRepository().clear_reminder_digest(line_user_id)
+            
             return {
                 'success': True,
                 'message': f"予定「{event.get('summary', '')}」を追加しました。",
@@ -76,30 +86,57 @@ class CalendarService:
         Returns:
             List of events
         """
+        # Determine date range
+        start_date = entities.get('date', datetime.now().date())
+        if 'start_date' in entities:
+            start_date = entities['start_date']
+        end_date = entities.get('end_date', start_date)
+        
+        result = await self.fetch_events(line_user_id, start_date, end_date)
+        return result['events'] if result else []
+    
+    async def fetch_events(
+        self,
+        line_user_id: str,
+        start_date: date,
+        end_date: date,
+        etag: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Fetch events in a date range, optionally as a conditional request
+        
+        Args:
+            line_user_id: LINE user ID
+            start_date: First day of the range
+            end_date: Last day of the range (inclusive)
+            etag: ETag of a previous result; if unchanged nothing is returned
+        
+        Returns:
+            Dict with events, etag and not_modified, or None on error
+        """
         try:
             credentials = await get_user_credentials(line_user_id)
             if not credentials:
-                return []
+                return None
             
             service = build('calendar', 'v3', credentials=credentials)
             
-            # Determine date range
-            start_date = entities.get('date', datetime.now().date())
-            if 'start_date' in entities:
-                start_date = entities['start_date']
-            
             # Set time range
             time_min = datetime.combine(start_date, datetime.min.time()).isoformat() + 'Z'
-            time_max = datetime.combine(start_date, datetime.max.time()).isoformat() + 'Z'
+            time_max = datetime.combine(end_date, datetime.max.time()).isoformat() + 'Z'
             
             # Get events
-            events_result = service.events().list(
+            request = service.events().list(
                 calendarId='primary',
                 timeMin=time_min,
                 timeMax=time_max,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            )
+            if etag:
+                request.headers['If-None-Match'] = etag
+            
+            events_result = await asyncio.to_thread(request.execute)
             
             events = events_result.get('items', [])
             
@@ -109,14 +146,20 @@ class CalendarService:
                 formatted_event = self._format_event(event)
                 formatted_events.append(formatted_event)
             
-            return formatted_events
+            return {
+                'events': formatted_events,
+                'etag': events_result.get('etag'),
+                'not_modified': False
+            }
             
         except HttpError as e:
+            if etag and e.resp.status == 304:
+                return {'events': None, 'etag': etag, 'not_modified': True}
             logger.error(f"Google Calendar API error: {e}")
-            return []
+            return None
         except Exception as e:
             logger.error(f"Error listing events: {e}")
-            return []
+            return None
     
     async def delete_event(
         self,
@@ -150,8 +193,11 @@ class CalendarService:
             # Delete first matching event
             event_id = events[0].get('id')
             if event_id:
-                service.events().delete(calendarId='primary', eventId=event_id).execute()
-                return {'success': True, 'message': '予定を削除しました。'}
+                await asyncio.to_thread(
+                    service.events().delete(calendarId='primary', eventId=event_id).execute
+                )
+                await UserRepository().clear_reminder_digest(line_user_id)
+                return {'success': True, 'message': '予定を削除しました。', 'event_id': event_id}
             
             return {'success': False, 'message': '予定の削除に失敗しました。'}
             
@@ -162,6 +208,45 @@ class CalendarService:
             logger.error(f"Error deleting event: {e}")
             return {'success': False, 'message': 'エラーが発生しました。'}
     
+    async def delete_event_by_id(
+        self,
+        line_user_id: str,
+        event_id: str
+    ) -> Dict[str, Any]:
+        """
+        Delete event from Google Calendar by its event ID
+        
+        Args:
+            line_user_id: LINE user ID
+            event_id: Google Calendar event ID
+        
+        Returns:
+            Result dict
+        """
+        try:
+            credentials = await get_user_credentials(line_user_id)
+            if not credentials:
+                return {'success': False, 'message': '認証エラーが発生しました。'}
+            
+            service = build('calendar', 'v3', credentials=credentials)
+            await asyncio.to_thread(
+                service.events().delete(calendarId='primary', eventId=event_id).execute
+            )
+            
+            logger.info(f"Deleted event {event_id} for user {line_user_id}")
+            await UserRepository().clear_reminder_digest(line_user_id)
+            
+            return {'success': True, 'message': '予定を削除しました。', 'event_id': event_id}
+        
+        except HttpError as e:
+            if e.resp.status in (404, 410):
+                return {'success': False, 'message': '削除する予定が見つかりませんでした。'}
+            logger.error(f"Google Calendar API error: {e}")
+            return {'success': False, 'message': 'カレンダーの更新に失敗しました。'}
+        except Exception as e:
+            logger.error(f"Error deleting event {event_id}: {e}")
+            return {'success': False, 'message': 'エラーが発生しました。'}
+    
     async def update_event(
         self,
         line_user_id: str,
@@ -178,7 +263,9 @@ class CalendarService:
             Result dict
         """
         # For initial release, redirect to delete + add
-        # In production, implement proper event update logic
+        # In production, implement proper event update logic; like
+        # add_event it must then call event_reminder_scheduler.schedule_event
+        # for the updated event (the old reminder is skipped when it runs)
         return {'success': False, 'message': '予定の更新機能は開発中です。'}
     
     def _build_event_from_entities(self, entities: Dict[str, Any]) -> Dict[str, Any]:
@@ -221,6 +308,7 @@ class CalendarService:
         
         # Format start time
         start = event.get('start', {})
+        formatted['start'] = start.get('dateTime') or start.get('date')
         if 'dateTime' in start:
             start_dt = datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00'))
             formatted['start_time'] = start_dt.strftime('%H:%M')
@@ -2,25 +2,56 @@
 Conversation management service
 """
 from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta, timezone
 import logging
 
 from src.repositories.conversation_repository import ConversationRepository
-from src.agents.calendar_agent import CalendarAgent
+from src.agents.calendar_agent import get_calendar_agent
+from src.services.conversation_writer import conversation_writer
 
 logger = logging.getLogger(__name__)
 
 
+def collect_event_references(results: List[Dict[str, Any]]) -> tuple:
+    """
+    Collect events touched by calendar operations
+    
+    Args:
+        results: Function results, in execution order
+    
+    Returns:
+        Tuple of (referenced events newest first, deleted event IDs)
+    """
+    referenced = []
+    removed_ids = []
+    
+    for result in results:
+        if result.get("event"):
+            referenced.append(result["event"])
+        referenced.extend(result.get("events", []))
+        if result.get("deleted_event_id"):
+            removed_ids.append(result["deleted_event_id"])
+    
+    return list(reversed(referenced)), removed_ids
+
+
 class ConversationService:
-    """Service for managing conversations with context"""
+    """
+    Service for managing conversations with context
+    
+    Stateless per request; use get_conversation_service() for the shared
+    instance so the agent and its OpenAI client are reused.
+    """
     
     def __init__(self):
         self.conversation_repo = ConversationRepository()
-        self.calendar_agent = CalendarAgent()
+        self.calendar_agent = get_calendar_agent()
     
     async def process_message_with_ai(
         self,
         line_user_id: str,
-        message: str
+        message: str,
+        context: Optional[Dict[str, Any]] = None
     ) -> str:
         """
         Process message with AI agent and conversation context
@@ -28,64 +59,101 @@ class ConversationService:
         Args:
             line_user_id: LINE user ID
             message: User's message
+            context: Conversation context if already loaded
             
         Returns:
             AI response
         """
         try:
-            # Save user message
-            await self.conversation_repo.add_message(
-                line_user_id=line_user_id,
-                role="user",
-                content=message
-            )
+            received_at = datetime.now(timezone.utc)
             
-            # Get conversation context
-            context = await self.conversation_repo.get_conversation_context(line_user_id)
+            # Get conversation context (single document read)
+            if context is None:
+                context = await self.conversation_repo.get_conversation_context(line_user_id)
             
             # Process with AI
             response, function_results = await self.calendar_agent.process_message(
                 user_id=line_user_id,
                 message=message,
-                conversation_history=context.get("messages", [])
+                conversation_history=context.get("messages", []),
+                context_summary=context.get("summary"),
+                recent_events=context.get("recent_events", [])
             )
             
-            # Save AI response
-            await self.conversation_repo.add_message(
-                line_user_id=line_user_id,
-                role="assistant",
-                content=response,
-                metadata={
-                    "function_results": function_results
-                } if function_results else None
+            # Persist the exchange in the background, off the reply path
+            await conversation_writer.submit(
+                line_user_id,
+                self._build_exchange_writes(
+                    line_user_id,
+                    context,
+                    message,
+                    response,
+                    function_results,
+                    received_at
+                )
             )
             
-            # If there were function results with events, save them for context
-            for result in function_results:
-                if "event" in result:
-                    await self._save_event_context(line_user_id, result["event"])
-            
             return response
-            
+        
         except Exception as e:
             logger.error(f"Error processing message with AI: {e}")
             return "申し訳ございません。処理中にエラーが発生しました。"
     
-    async def _save_event_context(
+    def _build_exchange_writes(
         self,
         line_user_id: str,
-        event: Dict[str, Any]
-    ):
-        """Save event information for context"""
-        try:
-            await self.conversation_repo.add_message(
-                line_user_id=line_user_id,
-                role="system",
-                content=f"Event referenced: {event.get('title', 'Unknown')}",
-                metadata={"event": event}
+        context: Dict[str, Any],
+        message: str,
+        response: str,
+        function_results: List[Dict[str, Any]],
+        received_at: datetime
+    ) -> list:
+        """Build all writes for one exchange: recent context plus audit history"""
+        replied_at = datetime.now(timezone.utc)
+        referenced_events, removed_event_ids = collect_event_references(function_results)
+        last_event = referenced_events[0] if referenced_events else None
+        
+        writes = [
+            # Recent context ring buffer and event pointers
+            self.conversation_repo.build_recent_context(
+                line_user_id,
+                context,
+                [
+                    {"role": "user", "content": message},
+                    {"role": "assistant", "content": response}
+                ],
+                referenced_events=referenced_events,
+                removed_event_ids=removed_event_ids
+            ),
+            # Full history for audit
+            self.conversation_repo.build_message(
+                line_user_id,
+                role="user",
+                content=message,
+                timestamp=received_at
+            ),
+            self.conversation_repo.build_message(
+                line_user_id,
+                role="assistant",
+                content=response,
+                metadata={
+                    "function_results": function_results
+                } if function_results else None,
+                timestamp=replied_at
             )
-        except Exception as e:
-            logger.error(f"Error saving event context: {e}")
+        ]
+        
+        # Save referenced events for context
+        if last_event:
+            writes.append(self.conversation_repo.build_message(
+                line_user_id,
+                role="system",
+                content=f"Event referenced: {last_event.get('title', 'Unknown')}",
+                metadata={"event": last_event},
+                timestamp=replied_at + timedelta(microseconds=1)
+            ))
+        
+        return writes
     
     async def get_proactive_suggestions(
         self,
@@ -153,4 +221,20 @@ class ConversationService:
             if current_end and next_start and current_end >= next_start:
                 return True
         
-        return False
\ No newline at end of file
+        return False
+
+
+_conversation_service: Optional[ConversationService] = None
+
+
+def get_conversation_service() -> ConversationService:
+    """
+    Get the shared conversation service
+    
+    Returns:
+        ConversationService created on first use
+    """
+    global _conversation_service
+    if _conversation_service is None:
+        _conversation_service = ConversationService()
+    return _conversation_service
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""
+Background writer for conversation persistence
+"""
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from src.core.config import settings
+from src.core.firestore import get_db
+
+logger = logging.getLogger(__name__)
+
+# Firestore allows at most 500 operations per batch
+MAX_BATCH_OPERATIONS = 500
+
+
+class ConversationWriter:
+    """
+    Queue conversation writes and commit them off the reply path
+    
+    Writes are grouped per user and flushed with a single batched commit.
+    When the writer is not running (e.g. on Vercel, where there is no
+    lifespan) or the buffer is full, writes are committed inline instead.
+    
+    Buffered writes are readable through apply_pending(), so a user's next
+    message builds its context on the previous exchange even before that
+    exchange is committed.
+    """
+    
+    def __init__(
+        self,
+        max_pending: int = None,
+        flush_interval: float = None
+    ):
+        self.max_pending = max_pending or settings.CONVERSATION_WRITER_MAX_PENDING
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else settings.CONVERSATION_WRITER_FLUSH_INTERVAL
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Entries taken off the queue but not yet handed to a commit
+        self._in_hand: list = []
+        self._flush: Optional[asyncio.Future] = None
+        # Buffered (data, merge) writes per document path, oldest first
+        self._pending_docs: Dict[str, list] = {}
+    
+    @property
+    def is_running(self) -> bool:
+        """Whether the background flush loop is running"""
+        return self._task is not None and not self._task.done()
+    
+    async def start(self):
+        """Start the background flush loop"""
+        if self.is_running:
+            return
+        
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Conversation writer started")
+    
+    async def stop(self):
+        """Stop the flush loop and commit everything still buffered"""
+        if not self.is_running:
+            return
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        
+        # Let a commit that was under way finish
+        if self._flush is not None and not self._flush.done():
+            await self._flush
+        self._flush = None
+        
+        # Flush remaining writes, including any the loop was holding
+        pending = self._in_hand + self._drain()
+        self._in_hand = []
+        if pending:
+            await self._commit(pending)
+        
+        self._task = None
+        logger.info(f"Conversation writer stopped, flushed {len(pending)} pending entries")
+    
+    async def submit(self, line_user_id: str, writes: List[Tuple]):
+        """
+        Queue writes for a user
+        
+        Args:
+            line_user_id: LINE user ID
+            writes: List of (document reference, data[, merge]) tuples
+        """
+        if not writes:
+            return
+        
+        if self.is_running:
+            try:
+                self._queue.put_nowait((line_user_id, writes))
+                self._track(writes)
+                return
+            except asyncio.QueueFull:
+                logger.warning("Conversation writer buffer full, writing inline")
+        
+        await self._commit([(line_user_id, writes)])
+    
+    def apply_pending(self, path: str, data: Optional[dict]) -> Optional[dict]:
+        """
+        Overlay buffered writes for a document on data read from Firestore
+        
+        Args:
+            path: Document path (DocumentReference.path)
+            data: Stored document data, or None if it does not exist
+        
+        Returns:
+            Data as it will be once buffered writes are committed
+        """
+        for pending, merge in self._pending_docs.get(path, []):
+            data = {**(data or {}), **pending} if merge else dict(pending)
+        return data
+    
+    def _track(self, writes: List[Tuple]):
+        """Remember buffered writes until they are committed"""
+        for doc_ref, data, *options in writes:
+            self._pending_docs.setdefault(doc_ref.path, []).append(
+                (data, bool(options and options[0]))
+            )
+    
+    def _untrack(self, writes: List[Tuple]):
+        """Forget committed writes"""
+        for doc_ref, data, *_ in writes:
+            remaining = [
+                entry for entry in self._pending_docs.get(doc_ref.path, [])
+                if entry[0] is not data
+            ]
+            if remaining:
+                self._pending_docs[doc_ref.path] = remaining
+            else:
+                self._pending_docs.pop(doc_ref.path, None)
+    
+    async def _run(self):
+        """Collect queued writes and commit them in batches"""
+        while True:
+            self._in_hand.append(await self._queue.get())
+            
+            # Give the reply a head start and let more writes accumulate
+            if self.flush_interval:
+                await asyncio.sleep(self.flush_interval)
+            
+            pending = self._in_hand + self._drain()
+            self._in_hand = []
+            
+            # Shielded so stop() waits for the commit instead of cutting it off
+            self._flush = asyncio.ensure_future(self._commit(pending))
+            try:
+                await asyncio.shield(self._flush)
+            except Exception as e:
+                logger.error(f"Error flushing conversation writes: {e}")
+    
+    def _drain(self) -> list:
+        """Take everything currently buffered"""
+        pending = []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        return pending
+    
+    async def _commit(self, pending: list):
+        """Commit pending writes, grouped per user to keep their order"""
+        grouped: Dict[str, list] = {}
+        for line_user_id, writes in pending:
+            grouped.setdefault(line_user_id, []).extend(writes)
+        
+        operations = [write for writes in grouped.values() for write in writes]
+        
+        for i in range(0, len(operations), MAX_BATCH_OPERATIONS):
+            chunk = operations[i:i + MAX_BATCH_OPERATIONS]
+            try:
+                await asyncio.to_thread(self._commit_batch, chunk)
+            except Exception as e:
+                logger.error(f"Error committing {len(chunk)} conversation writes: {e}")
+            finally:
+                self._untrack(chunk)
+    
+    def _commit_batch(self, operations: list):
+        """Commit a single Firestore batch"""
+        batch = get_db().batch()
+        for doc_ref, data, *options in operations:
+            batch.set(doc_ref, data, merge=bool(options and options[0]))
+        batch.commit()
+
+
+# Global instance
+conversation_writer = ConversationWriter()
\ No newline at end of file
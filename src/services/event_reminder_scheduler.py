@@ -0,0 +1,256 @@
+"""
+Scheduler for "N minutes before" event reminders
+"""
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import pytz
+
+from src.core.config import settings
+from src.core.idempotency import IdempotencyStore
+from src.core.task_queue import get_task_enqueuer, register_task_handler
+from src.repositories.user_repository import UserRepository
+
+logger = logging.getLogger(__name__)
+
+
+def to_minute(moment: datetime) -> int:
+    """Convert a datetime to an absolute minute index"""
+    return int(moment.timestamp() // 60)
+
+
+def from_minute(minute: int) -> datetime:
+    """Convert an absolute minute index back to a UTC datetime"""
+    return datetime.fromtimestamp(minute * 60, timezone.utc)
+
+
+def get_event_start(event: Dict[str, Any]) -> Optional[datetime]:
+    """
+    Get the start of a formatted event
+    
+    Returns:
+        Timezone-aware start, or None for all-day or malformed events
+    """
+    start = event.get('start') or event.get('datetime')
+    try:
+        start_at = datetime.fromisoformat(start.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if start_at.tzinfo is None:
+        return None
+    return start_at
+
+
+def get_reminder_task_id(line_user_id: str, minute: int) -> str:
+    """
+    Get the deterministic task ID of a user's reminder at a minute
+    
+    Every instance derives the same ID for the same reminder, so the task
+    queue keeps one task however many instances schedule it.
+    """
+    return f"event-reminder-{line_user_id}-{minute}"
+
+
+class EventReminderScheduler:
+    """
+    Schedules and sends reminders a user-chosen number of minutes before events
+    
+    Each reminder is a delayed task named by (user, minute), so the
+    schedule lives in the task queue rather than on one instance. The task
+    only carries the time: when it runs, it reads the user's current lead
+    time and the events starting in that minute, so events deleted or
+    moved since scheduling (in the bot or in Google Calendar) are skipped
+    and events sharing a minute are coalesced into one message. Events
+    edited outside the bot are picked up by the next hourly sync.
+    
+    A task can run more than once: the local enqueuer forgets task IDs
+    after TASK_DEDUP_TTL_SECONDS (or on restart) and the hourly sync then
+    enqueues them again, and Cloud Tasks delivers at least once. Sending
+    is therefore guarded by a sent marker per task ID, kept until well
+    after the sync horizon has passed.
+    """
+    
+    def __init__(self):
+        self.timezone = pytz.timezone(settings.REMINDER_TIMEZONE)
+        self.sent_markers = IdempotencyStore(
+            backend=settings.EVENT_REMINDER_DEDUP_BACKEND,
+            max_entries=settings.TASK_DEDUP_MAX_ENTRIES,
+            ttl_seconds=(settings.EVENT_REMINDER_SYNC_DAYS + 2) * 86400,
+            collection_name='event_reminders_sent'
+        )
+        self.stats = {'scheduled': 0, 'sent': 0, 'skipped': 0, 'failed': 0}
+    
+    async def get_lead_time(self, line_user_id: str) -> int:
+        """
+        Get the user's current reminder lead time
+        
+        Returns:
+            Minutes before events, or 0 if disabled or the user is inactive
+        """
+        user = await UserRepository().get_user(line_user_id)
+        if not user or not user.get('is_active', True):
+            return 0
+        return user.get('preferences', {}).get('reminder_before_event_minutes') or 0
+    
+    async def schedule_event(
+        self,
+        line_user_id: str,
+        event: Dict[str, Any],
+        minutes_before: Optional[int] = None
+    ) -> bool:
+        """
+        Schedule the reminder for one event
+        
+        Args:
+            line_user_id: LINE user ID
+            event: Event with title and ISO start datetime
+            minutes_before: Lead time; read from the user's preferences if omitted
+        
+        Returns:
+            True if a reminder task was enqueued (or already existed)
+        """
+        if not settings.EVENT_REMINDERS_ENABLED:
+            return False
+        
+        # All-day events have no start time
+        start_at = get_event_start(event)
+        if start_at is None:
+            return False
+        
+        try:
+            if minutes_before is None:
+                minutes_before = await self.get_lead_time(line_user_id)
+            if not minutes_before:
+                return False
+            
+            minute = to_minute(start_at - timedelta(minutes=minutes_before))
+            fire_at = from_minute(minute)
+            if fire_at <= datetime.now(timezone.utc):
+                return False
+            
+            scheduled = await get_task_enqueuer().enqueue(
+                'event-reminder',
+                {
+                    'line_user_id': line_user_id,
+                    'minute': minute,
+                    'minutes_before': minutes_before
+                },
+                task_id=get_reminder_task_id(line_user_id, minute),
+                schedule_at=fire_at
+            )
+            if scheduled:
+                self.stats['scheduled'] += 1
+            return scheduled
+        
+        except Exception as e:
+            logger.error(f"Error scheduling event reminder for {line_user_id}: {e}")
+            return False
+    
+    async def sync_user_events(
+        self,
+        line_user_id: str,
+        events: List[Dict[str, Any]],
+        minutes_before: int
+    ) -> int:
+        """
+        Schedule reminders for a user's upcoming events
+        
+        Reminders that already exist are deduplicated by task ID; stale
+        ones are dropped when they run.
+        
+        Args:
+            line_user_id: LINE user ID
+            events: The user's upcoming events
+            minutes_before: Lead time from the user's preferences
+        
+        Returns:
+            Number of reminders scheduled
+        """
+        if not minutes_before:
+            return 0
+        
+        results = await asyncio.gather(*(
+            self.schedule_event(line_user_id, event, minutes_before)
+            for event in events
+        ))
+        return sum(1 for scheduled in results if scheduled)
+    
+    async def send_due(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send the reminder scheduled for one user and minute
+        
+        Args:
+            payload: Task payload with line_user_id, minute and minutes_before
+        
+        Returns:
+            Metrics (sent, events)
+        
+        Raises:
+            RuntimeError: If the calendar could not be read, so the task is retried
+        """
+        line_user_id = payload['line_user_id']
+        minute = int(payload['minute'])
+        
+        # A changed lead time has its own tasks from the next sync
+        minutes_before = await self.get_lead_time(line_user_id)
+        if not minutes_before or minutes_before != payload.get('minutes_before'):
+            self.stats['skipped'] += 1
+            return {'sent': 0, 'events': 0}
+        
+        from src.services.calendar_service import CalendarService
+        
+        start_minute = minute + minutes_before
+        start_day = from_minute(start_minute).date()
+        result = await CalendarService().fetch_events(line_user_id, start_day, start_day)
+        if result is None:
+            raise RuntimeError(f"Could not read the calendar of {line_user_id}")
+        
+        events = []
+        for event in result['events']:
+            start_at = get_event_start(event)
+            if start_at and to_minute(start_at) == start_minute:
+                events.append(event)
+        if not events:
+            self.stats['skipped'] += 1
+            return {'sent': 0, 'events': 0}
+        
+        # Another run of the same task already sent it
+        task_id = get_reminder_task_id(line_user_id, minute)
+        if not await self.sent_markers.claim(task_id):
+            self.stats['skipped'] += 1
+            return {'sent': 0, 'events': 0}
+        
+        success = await self._send(line_user_id, events, minutes_before)
+        if not success:
+            await self.sent_markers.release(task_id)
+        return {'sent': 1 if success else 0, 'events': len(events)}
+    
+    async def _send(
+        self,
+        line_user_id: str,
+        events: List[Dict[str, Any]],
+        minutes_before: int
+    ) -> bool:
+        """Send one coalesced reminder message"""
+        from src.services.reminder_service import send_reminder
+        
+        lines = [f"⏰ まもなく予定の時間です（{minutes_before}分前）：\n"]
+        for event in events:
+            start_time = get_event_start(event).astimezone(self.timezone).strftime('%H:%M')
+            lines.append(f"• {start_time} {event.get('title', '(タイトルなし)')}")
+        
+        try:
+            success = await send_reminder(line_user_id, "\n".join(lines))
+        except Exception as e:
+            logger.error(f"Failed to send event reminder to {line_user_id}: {e}")
+            success = False
+        
+        self.stats['sent' if success else 'failed'] += 1
+        return success
+
+
+# Global instance
+event_reminder_scheduler = EventReminderScheduler()
+
+register_task_handler('event-reminder', event_reminder_scheduler.send_due)
\ No newline at end of file
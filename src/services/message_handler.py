@@ -1,146 +1,362 @@
 """
 Message handler service for processing LINE messages
 """
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from linebot.v3.webhooks import (
+    Event,
+    FollowEvent,
+    MessageEvent,
+    TextMessageContent,
+    UnfollowEvent
+)
 from linebot.v3.messaging import (
-    ApiClient,
-    MessagingApi,
     ReplyMessageRequest,
-    TextMessage,
-    Configuration
+    TextMessage
 )
+from typing import Optional
+import asyncio
 import logging
 
+from src.agents.result_renderer import format_subscription_info
+from src.core.admission import message_admission
 from src.core.config import settings
+from src.core.deadline import Deadline
+from src.core.line_client import get_messaging_api
 from src.repositories.user_repository import UserRepository
+from src.repositories.conversation_repository import (
+    ConversationRepository,
+    match_event_reference
+)
+from src.services.auth_service import (
+    is_known_unlinked,
+    mark_unlinked,
+    warm_user_credentials
+)
 from src.services.nlp_service import NLPService
 from src.services.calendar_service import CalendarService
-from src.services.conversation_service import ConversationService
+from src.services.conversation_service import get_conversation_service
 from src.services.subscription_service import SubscriptionService
+from src.services.conversation_writer import conversation_writer
+from src.services.push_queue import push_queue
 
 logger = logging.getLogger(__name__)
 
-# LINE Bot API configuration
-configuration = Configuration(
-    host="https://api.line.me",
-    access_token=settings.LINE_CHANNEL_ACCESS_TOKEN
-)
+# Words that refer back to a previously mentioned event
+EVENT_REFERENCE_WORDS = ['さっき', '先ほど', 'その', 'あの', '今の']
+
+# Reply for messages shed by admission control
+BUSY_MESSAGE = "ただいま混雑しています。しばらくしてからもう一度お試しください。"
+
+# Reply sent when the answer will not be ready before the reply token expires
+INTERIM_MESSAGE = "確認しています。少々お待ちください…"
+
+
+def is_handled_event(event: Event) -> bool:
+    """
+    Check whether a webhook event is processed by this service
+    
+    Args:
+        event: LINE webhook event
+    
+    Returns:
+        True for text messages and follow/unfollow events
+    """
+    if isinstance(event, MessageEvent):
+        return isinstance(event.message, TextMessageContent)
+    return isinstance(event, (FollowEvent, UnfollowEvent))
+
+
+def link_required_message() -> str:
+    """Reply asking the user to link Google Calendar"""
+    return (
+        "Googleカレンダーとの連携が必要です。\n"
+        "以下のリンクから連携設定を行ってください：\n"
+        f"{settings.BASE_URL}/liff?openExternalBrowser=1"
+    )
+
+
+async def handle_event(event: Event):
+    """
+    Dispatch a webhook event to its handler
+    
+    Args:
+        event: LINE webhook event
+    """
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        await handle_text_message(event)
+    elif isinstance(event, FollowEvent):
+        await handle_follow_event(event)
+    elif isinstance(event, UnfollowEvent):
+        await handle_unfollow_event(event)
+    else:
+        logger.info(f"Unhandled event type: {type(event)}")
 
 
 async def handle_text_message(event: MessageEvent):
     """
     Handle incoming text message from LINE
     
+    Messages beyond the admission limits get a fast canned reply instead
+    of queueing behind everyone else.
+    
     Args:
         event: LINE message event
     """
+    # Users who never linked get the link prompt without a user read
+    if is_known_unlinked(event.source.user_id):
+        await respond(
+            event.source.user_id,
+            event.reply_token,
+            link_required_message(),
+            Deadline.after(settings.REPLY_TOKEN_TTL_SECONDS, start=event.timestamp / 1000)
+        )
+        return
+    
+    if not await message_admission.acquire():
+        # Pushed instead if the reply token has expired
+        await respond(
+            event.source.user_id,
+            event.reply_token,
+            BUSY_MESSAGE,
+            Deadline.after(settings.REPLY_TOKEN_TTL_SECONDS, start=event.timestamp / 1000)
+        )
+        return
+    
     try:
-        line_user_id = event.source.user_id
-        message_text = event.message.text
-        reply_token = event.reply_token
-        
-        logger.info(f"Processing message from {line_user_id}: {message_text}")
-        
-        # Check if user is linked
-        user_repo = UserRepository()
-        user = await user_repo.get_user(line_user_id)
+        await _process_text_message(event)
+    finally:
+        message_admission.release()
+
+
+async def _process_text_message(event: MessageEvent):
+    """
+    Process an admitted text message and reply
+    
+    The reply token is only valid for a short time after the event. If the
+    answer is not ready shortly before it expires, an interim reply uses
+    the token and the final answer is pushed. Processing that runs longer
+    than MESSAGE_PROCESSING_TIMEOUT is cancelled.
+    
+    Args:
+        event: LINE message event
+    """
+    line_user_id = event.source.user_id
+    message_text = event.message.text
+    reply_token = event.reply_token
+    
+    received_at = event.timestamp / 1000
+    reply_deadline = Deadline.after(settings.REPLY_TOKEN_TTL_SECONDS, start=received_at)
+    # The processing budget starts now, not at the event: a redelivered or
+    # reclaimed event is still answered (by push once the token expired)
+    processing_deadline = Deadline.after(settings.MESSAGE_PROCESSING_TIMEOUT)
+    
+    logger.info(f"Processing message from {line_user_id}: {message_text}")
+    
+    work = asyncio.create_task(_generate_reply(line_user_id, message_text))
+    try:
+        # Wait for the answer while the reply token is safely usable
+        wait = reply_deadline.remaining() - settings.REPLY_SAFETY_MARGIN_SECONDS
+        if wait > 0:
+            await asyncio.wait({work}, timeout=wait)
         
-        if not user or not user.get('google_email'):
-            # User not linked
-            reply_text = (
-                "Googleカレンダーとの連携が必要です。\n"
-                "以下のリンクから連携設定を行ってください：\n"
-                f"{settings.BASE_URL}/liff?openExternalBrowser=1"
-            )
-            await send_reply(reply_token, reply_text)
-            return
+        if not work.done() and not reply_deadline.expired:
+            if await send_reply(reply_token, INTERIM_MESSAGE):
+                reply_token = None
         
-        # Check subscription and AI availability
-        subscription_service = SubscriptionService()
-        can_use_ai, reason = await subscription_service.check_ai_availability(line_user_id)
+        reply_text = await asyncio.wait_for(
+            work,
+            timeout=max(0, processing_deadline.remaining())
+        )
+    
+    except asyncio.TimeoutError:
+        logger.warning(f"Message from {line_user_id} exceeded the processing deadline")
+        reply_text = "処理に時間がかかりすぎたため中断しました。もう一度お試しください。"
+    except Exception as e:
+        logger.error(f"Error handling message: {e}", exc_info=True)
+        reply_text = "エラーが発生しました。しばらくしてからもう一度お試しください。"
+    
+    await respond(line_user_id, reply_token, reply_text, reply_deadline)
+
+
+async def _generate_reply(line_user_id: str, message_text: str) -> str:
+    """
+    Run NLP/AI and Calendar work for a message
+    
+    Args:
+        line_user_id: LINE user ID
+        message_text: Message text
+    
+    Returns:
+        Reply text
+    """
+    # Check if user is linked
+    user_repo = UserRepository()
+    user = await user_repo.get_user(line_user_id)
+    
+    if not user or not user.get('google_email'):
+        # User not linked
+        mark_unlinked(line_user_id)
+        return link_required_message()
+    
+    # Quota check, context load and NLP pre-parse overlap; the credential
+    # refresh keeps running in the background while the LLM is called
+    subscription_service = SubscriptionService()
+    warm_up = asyncio.create_task(warm_user_credentials(line_user_id, user))
+    (can_use_ai, reason), context, parsed = await asyncio.gather(
+        subscription_service.check_ai_availability(line_user_id, user),
+        ConversationRepository().get_conversation_context(line_user_id),
+        NLPService().process_message(message_text)
+    )
+    
+    # Global AI setting must also be enabled
+    if can_use_ai and settings.USE_AI_AGENT and settings.OPENAI_API_KEY:
+        # Use AI agent for natural conversation
+        conversation_service = get_conversation_service()
+        reply_text = await conversation_service.process_message_with_ai(
+            line_user_id,
+            message_text,
+            context=context
+        )
         
-        # Global AI setting must also be enabled
-        if can_use_ai and settings.USE_AI_AGENT and settings.OPENAI_API_KEY:
-            # Use AI agent for natural conversation
-            conversation_service = ConversationService()
-            reply_text = await conversation_service.process_message_with_ai(
-                line_user_id,
-                message_text
+        # Increment usage counter
+        await subscription_service.increment_ai_usage(line_user_id, user)
+    
+    elif not can_use_ai and reason:
+        # User requested AI but can't use it
+        user_prefs = user.get('preferences', {})
+        if user_prefs.get('use_ai_agent', False):
+            reply_text = f"{reason}\n\nパターン認識モードで処理します。"
+            # Fall back to pattern matching
+            reply_text += await _process_with_pattern_matching(
+                line_user_id, message_text, parsed, context
             )
-            
-            # Increment usage counter
-            await subscription_service.increment_ai_usage(line_user_id)
-            
-        elif not can_use_ai and reason:
-            # User requested AI but can't use it
-            user_prefs = user.get('preferences', {})
-            if user_prefs.get('use_ai_agent', False):
-                reply_text = f"{reason}\n\nパターン認識モードで処理します。"
-                # Fall back to pattern matching
-                reply_text += await _process_with_pattern_matching(
-                    line_user_id, message_text
-                )
-            else:
-                # Process with pattern matching
-                reply_text = await _process_with_pattern_matching(
-                    line_user_id, message_text
-                )
         else:
-            # Fall back to pattern matching
+            # Process with pattern matching
             reply_text = await _process_with_pattern_matching(
-                line_user_id, message_text
+                line_user_id, message_text, parsed, context
             )
-        
-        await send_reply(reply_token, reply_text)
-        
+    else:
+        # Fall back to pattern matching
+        reply_text = await _process_with_pattern_matching(
+            line_user_id, message_text, parsed, context
+        )
+    
+    # Stop waiting on the warm-up; the shared load is shielded and still completes
+    warm_up.cancel()
+    
+    return reply_text
+
+
+async def handle_follow_event(event: FollowEvent):
+    """
+    Handle follow (friend added or unblocked) events
+    
+    Reactivates linked users so reminders resume.
+    
+    Args:
+        event: LINE follow event
+    """
+    line_user_id = event.source.user_id
+    
+    try:
+        user_repo = UserRepository()
+        if await user_repo.set_user_active(line_user_id, True):
+            logger.info(f"Reactivated user {line_user_id} on follow")
+    
     except Exception as e:
-        logger.error(f"Error handling message: {e}", exc_info=True)
-        try:
-            await send_reply(
-                reply_token,
-                "エラーが発生しました。しばらくしてからもう一度お試しください。"
-            )
-        except:
-            pass
+        logger.error(f"Error handling follow for {line_user_id}: {e}")
 
 
-async def send_reply(reply_token: str, message: str):
+async def handle_unfollow_event(event: UnfollowEvent):
+    """
+    Handle unfollow (blocked) events
+    
+    Deactivates the user so reminder and suggestion jobs skip them.
+    
+    Args:
+        event: LINE unfollow event
+    """
+    line_user_id = event.source.user_id
+    
+    try:
+        user_repo = UserRepository()
+        if await user_repo.set_user_active(line_user_id, False, reason='unfollowed'):
+            logger.info(f"Deactivated user {line_user_id} on unfollow")
+    
+    except Exception as e:
+        logger.error(f"Error handling unfollow for {line_user_id}: {e}")
+
+
+async def send_reply(reply_token: str, message: str) -> bool:
     """
     Send reply message to LINE
     
     Args:
         reply_token: Reply token from LINE
         message: Message text to send
+    
+    Returns:
+        True if successful
     """
     try:
-        async with ApiClient(configuration=configuration) as api_client:
-            api = MessagingApi(api_client)
-            
-            request = ReplyMessageRequest(
-                reply_token=reply_token,
-                messages=[TextMessage(text=message)]
-            )
-            
-            await api.reply_message(request)
-            
+        request = ReplyMessageRequest(
+            reply_token=reply_token,
+            messages=[TextMessage(text=message)]
+        )
+        
+        await get_messaging_api().reply_message(request)
+        return True
+    
     except Exception as e:
         logger.error(f"Failed to send reply: {e}")
+        return False
 
 
-async def _process_with_pattern_matching(line_user_id: str, message_text: str) -> str:
+async def respond(
+    line_user_id: str,
+    reply_token: Optional[str],
+    message: str,
+    reply_deadline: Deadline
+):
+    """
+    Answer a user, falling back to push when the reply token is unusable
+    
+    Args:
+        line_user_id: LINE user ID
+        reply_token: Reply token, or None if it was already used
+        message: Message text to send
+        reply_deadline: When the reply token expires
+    """
+    if reply_token and not reply_deadline.expired:
+        if await send_reply(reply_token, message):
+            return
+    
+    logger.info(f"Reply token unusable for {line_user_id}, pushing instead")
+    await push_queue.enqueue([line_user_id], message)
+
+
+async def _process_with_pattern_matching(
+    line_user_id: str,
+    message_text: str,
+    parsed: Optional[tuple] = None,
+    context: Optional[dict] = None
+) -> str:
     """
     Process message with pattern matching
     
     Args:
         line_user_id: LINE user ID
         message_text: Message text
+        parsed: (intent, entities) if already extracted
+        context: Conversation context if already loaded
         
     Returns:
         Reply text
     """
     try:
-        nlp_service = NLPService()
-        intent, entities = await nlp_service.process_message(message_text)
+        if parsed is None:
+            nlp_service = NLPService()
+            parsed = await nlp_service.process_message(message_text)
+        intent, entities = parsed
         
         logger.info(f"Pattern matching - Intent: {intent}, Entities: {entities}")
         
@@ -149,14 +365,48 @@ async def _process_with_pattern_matching(line_user_id: str, message_text: str) -
         
         if intent == "add_event":
             result = await calendar_service.add_event(line_user_id, entities)
+            if result.get('success'):
+                start = entities.get('datetime')
+                await _remember_events(line_user_id, [{
+                    'event_id': result.get('event_id'),
+                    'title': entities.get('title', ''),
+                    'datetime': start.isoformat() if start else None
+                }], context=context)
             return result.get('message', '予定を追加しました。')
             
         elif intent == "list_events":
             events = await calendar_service.list_events(line_user_id, entities)
+            if events:
+                await _remember_events(line_user_id, list(reversed(events)), context=context)
             return format_events_list(events)
             
         elif intent == "delete_event":
-            result = await calendar_service.delete_event(line_user_id, entities)
+            reference = None
+            
+            # Resolve "さっきの会議" from the event pointers, no history query.
+            # The event must be named; reference words alone are too common.
+            if any(word in message_text for word in EVENT_REFERENCE_WORDS):
+                if context is None:
+                    context = await ConversationRepository().get_conversation_context(line_user_id)
+                reference = match_event_reference(context["recent_events"], message_text)
+                if not reference and context["recent_events"]:
+                    return format_delete_candidates(context["recent_events"])
+            
+            if reference:
+                result = await calendar_service.delete_event_by_id(
+                    line_user_id,
+                    reference['event_id']
+                )
+            else:
+                result = await calendar_service.delete_event(line_user_id, entities)
+            
+            if result.get('success') and result.get('event_id'):
+                await _remember_events(
+                    line_user_id,
+                    [],
+                    removed_event_ids=[result['event_id']],
+                    context=context
+                )
             return result.get('message', '予定を削除しました。')
             
         elif intent == "update_event":
@@ -167,15 +417,7 @@ async def _process_with_pattern_matching(line_user_id: str, message_text: str) -
             subscription_service = SubscriptionService()
             info = await subscription_service.get_subscription_info(line_user_id)
             if info:
-                return (
-                    f"📊 **現在のプラン情報**\n\n"
-                    f"プラン: {info['plan_name']}\n"
-                    f"料金: {info['price']}円/月\n"
-                    f"AI利用回数: {info['ai_calls_used']}/{info['ai_calls_limit']}\n"
-                    f"残り回数: {info['ai_calls_remaining']}\n\n"
-                    f"{'✅' if info['features']['ai_agent'] else '❌'} AIエージェントモード\n"
-                    f"✅ パターン認識モード"
-                )
+                return format_subscription_info(info)
             return "プラン情報を取得できませんでした。"
             
         elif intent == "upgrade_plan":
@@ -217,6 +459,56 @@ async def _process_with_pattern_matching(line_user_id: str, message_text: str) -
         return "エラーが発生しました。"
 
 
+async def _remember_events(
+    line_user_id: str,
+    events: list,
+    removed_event_ids: list = None,
+    context: dict = None
+):
+    """
+    Update the user's referenced event pointers
+    
+    Args:
+        line_user_id: LINE user ID
+        events: Events touched by this message (newest first)
+        removed_event_ids: Event IDs that no longer exist
+        context: Conversation context if already loaded
+    """
+    try:
+        conversation_repo = ConversationRepository()
+        if context is None:
+            context = await conversation_repo.get_conversation_context(line_user_id)
+        
+        await conversation_writer.submit(line_user_id, [
+            conversation_repo.build_event_references(
+                line_user_id,
+                context,
+                events,
+                removed_event_ids
+            )
+        ])
+    
+    except Exception as e:
+        logger.error(f"Error updating event references: {e}")
+
+
+def format_delete_candidates(recent_events: list) -> str:
+    """
+    Ask which recently mentioned event to delete
+    
+    Args:
+        recent_events: Recent event references (newest first)
+    
+    Returns:
+        Formatted text message
+    """
+    lines = ["どの予定を削除しますか？予定名を含めてもう一度送ってください。\n"]
+    for ref in recent_events:
+        lines.append(f"• {ref.get('title') or '(タイトルなし)'}")
+    lines.append("\n例：「さっきの会議を削除」")
+    return "\n".join(lines)
+
+
 def format_events_list(events: list) -> str:
     """
     Format events list for display
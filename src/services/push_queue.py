@@ -0,0 +1,448 @@
+"""
+Rate-limited outbound LINE push queue with retry and dead-lettering
+"""
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+import uuid
+from linebot.v3.messaging import (
+    MulticastRequest,
+    PushMessageRequest,
+    TextMessage
+)
+from linebot.v3.messaging.exceptions import ApiException
+
+from src.core.config import settings
+from src.core.line_client import get_messaging_api
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying; other 4xx responses are permanent
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# LINE answers 409 when a request with the same retry key was already accepted
+ALREADY_ACCEPTED_STATUS = 409
+
+# LINE error texts meaning the recipient can never receive pushes
+# (blocked the account, never added it as a friend, or unknown user ID).
+# Generic texts such as "Not found" are deliberately absent: any 404
+# (wrong endpoint, missing resource) would deactivate the user.
+UNREACHABLE_RECIPIENT_MARKERS = [
+    "the user hasn't added the line official account as a friend",
+    "the user has blocked the line official account",
+    "the property, 'to', in the request body is invalid"
+]
+
+
+def is_unreachable_recipient(status: Optional[int], body: Optional[str]) -> bool:
+    """
+    Check whether a push error means the recipient can never be reached
+    
+    Args:
+        status: HTTP status of the LINE API response
+        body: Response body
+    
+    Returns:
+        True for permanent recipient errors
+    """
+    if status not in (400, 403, 404):
+        return False
+    text = (body or "").lower()
+    return any(marker in text for marker in UNREACHABLE_RECIPIENT_MARKERS)
+
+
+class TokenBucket:
+    """Token-bucket rate limiter"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class DeadLetterStore:
+    """Base class for storing messages that could not be delivered"""
+    
+    async def add(self, entry: Dict[str, Any]):
+        """Store a failed message"""
+        raise NotImplementedError
+    
+    async def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """List stored messages, oldest first"""
+        raise NotImplementedError
+    
+    async def remove(self, retry_key: str):
+        """Remove a stored message by its retry key"""
+        raise NotImplementedError
+
+
+class InMemoryDeadLetterStore(DeadLetterStore):
+    """Dead-letter store kept in memory (tests and local development)"""
+    
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+    
+    async def add(self, entry: Dict[str, Any]):
+        self.entries.append(entry)
+    
+    async def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return self.entries[:limit]
+    
+    async def remove(self, retry_key: str):
+        self.entries = [entry for entry in self.entries if entry['retry_key'] != retry_key]
+
+
+class SQLiteDeadLetterStore(DeadLetterStore):
+    """Dead-letter store in a local SQLite file"""
+    
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL)"
+        )
+        self._conn.commit()
+    
+    async def add(self, entry: Dict[str, Any]):
+        self._conn.execute(
+            "INSERT INTO dead_letters (entry) VALUES (?)",
+            (json.dumps(entry, ensure_ascii=False),)
+        )
+        self._conn.commit()
+    
+    async def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT entry FROM dead_letters ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    async def remove(self, retry_key: str):
+        self._conn.execute(
+            "DELETE FROM dead_letters WHERE json_extract(entry, '$.retry_key') = ?",
+            (retry_key,)
+        )
+        self._conn.commit()
+
+
+class FirestoreDeadLetterStore(DeadLetterStore):
+    """Dead-letter store in the push_dead_letters collection"""
+    
+    collection_name = 'push_dead_letters'
+    
+    async def add(self, entry: Dict[str, Any]):
+        from src.core.firestore import get_db
+        
+        doc_ref = get_db().collection(self.collection_name).document(entry['retry_key'])
+        await asyncio.to_thread(doc_ref.set, entry)
+    
+    async def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        from src.core.firestore import get_db
+        
+        query = (
+            get_db().collection(self.collection_name)
+            .order_by('failed_at')
+            .limit(limit)
+        )
+        docs = await asyncio.to_thread(lambda: list(query.stream()))
+        return [doc.to_dict() for doc in docs]
+    
+    async def remove(self, retry_key: str):
+        from src.core.firestore import get_db
+        
+        doc_ref = get_db().collection(self.collection_name).document(retry_key)
+        await asyncio.to_thread(doc_ref.delete)
+
+
+def create_dead_letter_store() -> DeadLetterStore:
+    """
+    Create the dead-letter store selected by PUSH_DEAD_LETTER_BACKEND
+    
+    Returns:
+        "memory", "sqlite" (PUSH_DEAD_LETTER_PATH) or "firestore" store
+    """
+    backend = settings.PUSH_DEAD_LETTER_BACKEND
+    if backend == "memory":
+        return InMemoryDeadLetterStore()
+    if backend == "sqlite":
+        return SQLiteDeadLetterStore(settings.PUSH_DEAD_LETTER_PATH)
+    return FirestoreDeadLetterStore()
+
+
+class PushQueue:
+    """
+    Outbound queue for LINE push and multicast messages
+    
+    Workers send at most LINE_PUSH_RATE_LIMIT pushes and
+    LINE_MULTICAST_RATE_LIMIT multicasts per second. Retryable failures are
+    retried with exponential backoff under the same X-Line-Retry-Key, so a
+    request LINE already accepted is never delivered twice. Permanent
+    failures go to the dead-letter store, as do messages still queued or
+    waiting to be retried at shutdown; replay_dead_letters() sends them
+    again. When the queue is not running (e.g. on Vercel), messages are
+    sent inline.
+    """
+    
+    def __init__(self, dead_letters: Optional[DeadLetterStore] = None):
+        self.push_limiter = TokenBucket(settings.LINE_PUSH_RATE_LIMIT)
+        self.multicast_limiter = TokenBucket(settings.LINE_MULTICAST_RATE_LIMIT)
+        self._dead_letters = dead_letters
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Messages taken by a worker (sending or waiting to retry), by retry key
+        self._in_hand: Dict[str, Dict[str, Any]] = {}
+        self.stats = {
+            'sent': 0,
+            'retried': 0,
+            'dead_lettered': 0,
+            'deactivated': 0,
+            'replayed': 0
+        }
+    
+    @property
+    def dead_letters(self) -> DeadLetterStore:
+        """Dead-letter store, created on first use"""
+        if self._dead_letters is None:
+            self._dead_letters = create_dead_letter_store()
+        return self._dead_letters
+    
+    @property
+    def is_running(self) -> bool:
+        """Whether the workers are running"""
+        return any(not worker.done() for worker in self._workers)
+    
+    @property
+    def pending(self) -> int:
+        """Number of queued messages"""
+        return self._queue.qsize() if self._queue is not None else 0
+    
+    async def start(self):
+        """Start the send workers"""
+        if self.is_running:
+            return
+        
+        self._queue = asyncio.Queue(maxsize=settings.PUSH_QUEUE_MAX_PENDING)
+        self._workers = [
+            asyncio.create_task(self._run())
+            for _ in range(settings.PUSH_QUEUE_WORKERS)
+        ]
+        logger.info(f"Push queue started with {len(self._workers)} workers")
+    
+    async def stop(self):
+        """Give queued messages a chance to go out, then stop the workers"""
+        if not self.is_running:
+            return
+        
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=settings.PUSH_QUEUE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Push queue stopped with {self.pending} messages pending")
+        
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        
+        # Keep whatever is left, including retries cut short, for a later replay
+        left = list(self._in_hand.values())
+        self._in_hand.clear()
+        while not self._queue.empty():
+            left.append(self._queue.get_nowait())
+        for item in left:
+            await self._dead_letter(item, None, "Push queue shut down")
+        
+        logger.info("Push queue stopped")
+    
+    async def enqueue(
+        self,
+        to: List[str],
+        message: str,
+        retry_key: Optional[str] = None
+    ) -> bool:
+        """
+        Queue a message for one user (push) or many users (multicast)
+        
+        Args:
+            to: LINE user IDs (at most 500)
+            message: Message text
+            retry_key: X-Line-Retry-Key (generated if omitted)
+        
+        Returns:
+            True if the message was queued, or sent when running inline
+        """
+        item = {
+            'to': list(to),
+            'message': message,
+            'retry_key': retry_key or str(uuid.uuid4()),
+            'attempts': 0
+        }
+        
+        if self.is_running:
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except asyncio.QueueFull:
+                logger.warning("Push queue full, sending inline")
+        
+        return await self._deliver(item)
+    
+    async def replay_dead_letters(
+        self,
+        limit: int = 100,
+        include_permanent: bool = False
+    ) -> Dict[str, int]:
+        """
+        Send dead-lettered messages again
+        
+        Messages keep their retry key, so one that LINE accepted before
+        it was dead-lettered is not delivered twice.
+        
+        Args:
+            limit: Maximum messages to replay
+            include_permanent: Also replay messages LINE rejected with a
+                non-retryable status
+        
+        Returns:
+            Replay metrics (replayed, skipped)
+        """
+        stats = {'replayed': 0, 'skipped': 0}
+        
+        for entry in await self.dead_letters.list(limit=limit):
+            status = entry.get('status')
+            if not include_permanent and status is not None and status not in RETRYABLE_STATUSES:
+                stats['skipped'] += 1
+                continue
+            
+            # Failing again stores it anew
+            await self.dead_letters.remove(entry['retry_key'])
+            await self.enqueue(entry['to'], entry['message'], retry_key=entry['retry_key'])
+            stats['replayed'] += 1
+        
+        self.stats['replayed'] += stats['replayed']
+        logger.info(f"Replayed dead letters: {stats}")
+        return stats
+    
+    async def _run(self):
+        """Send queued messages"""
+        while True:
+            item = await self._queue.get()
+            self._in_hand[item['retry_key']] = item
+            try:
+                await self._deliver(item)
+            except Exception as e:
+                logger.error(f"Error delivering queued message: {e}")
+            finally:
+                self._queue.task_done()
+            
+            # Not reached on cancellation, so stop() dead-letters the item
+            self._in_hand.pop(item['retry_key'], None)
+    
+    async def _deliver(self, item: Dict[str, Any]) -> bool:
+        """Send a message, retrying transient failures"""
+        while True:
+            item['attempts'] += 1
+            status = None
+            try:
+                await asyncio.wait_for(self._send(item), timeout=settings.PUSH_TIMEOUT)
+                self.stats['sent'] += 1
+                return True
+            
+            except ApiException as e:
+                status = e.status
+                if status == ALREADY_ACCEPTED_STATUS:
+                    self.stats['sent'] += 1
+                    return True
+                error = f"{e.status} {e.reason}: {e.body}"
+                
+                # Only single pushes tell which recipient is unreachable
+                if len(item['to']) == 1 and is_unreachable_recipient(status, str(e.body)):
+                    await self._deactivate_recipient(item['to'][0])
+            except asyncio.TimeoutError:
+                error = "Timed out"
+            except Exception as e:
+                error = str(e)
+            
+            retryable = status is None or status in RETRYABLE_STATUSES
+            if not retryable or item['attempts'] > settings.PUSH_MAX_RETRIES:
+                await self._dead_letter(item, status, error)
+                return False
+            
+            delay = min(
+                settings.PUSH_RETRY_MAX_DELAY,
+                settings.PUSH_RETRY_BASE_DELAY * 2 ** (item['attempts'] - 1)
+            )
+            self.stats['retried'] += 1
+            logger.warning(
+                f"Push to {len(item['to'])} users failed ({error}), "
+                f"retrying in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+    
+    async def _send(self, item: Dict[str, Any]):
+        """Send one request to LINE"""
+        api = get_messaging_api()
+        messages = [TextMessage(text=item['message'])]
+        
+        if len(item['to']) == 1:
+            await self.push_limiter.acquire()
+            await api.push_message(
+                PushMessageRequest(to=item['to'][0], messages=messages),
+                x_line_retry_key=item['retry_key']
+            )
+        else:
+            await self.multicast_limiter.acquire()
+            await api.multicast(
+                MulticastRequest(to=item['to'], messages=messages),
+                x_line_retry_key=item['retry_key']
+            )
+    
+    async def _deactivate_recipient(self, line_user_id: str):
+        """Stop fan-out jobs from spending work on an unreachable user"""
+        from src.repositories.user_repository import UserRepository
+        
+        self.stats['deactivated'] += 1
+        logger.info(f"Deactivating unreachable user {line_user_id}")
+        
+        await UserRepository().set_user_active(line_user_id, False, reason='unreachable')
+    
+    async def _dead_letter(self, item: Dict[str, Any], status: Optional[int], error: str):
+        """Store a message that could not be delivered"""
+        self.stats['dead_lettered'] += 1
+        logger.error(f"Dead-lettering message to {len(item['to'])} users: {error}")
+        
+        try:
+            await self.dead_letters.add({
+                **item,
+                'status': status,
+                'error': error,
+                'failed_at': datetime.now(timezone.utc).isoformat()
+            })
+        except Exception as e:
+            logger.error(f"Failed to store dead letter: {e}")
+
+
+# Global instance
+push_queue = PushQueue()
\ No newline at end of file
@@ -1,161 +1,613 @@
 """
 Reminder service for sending scheduled notifications
 """
-from typing import List, Dict, Any
-from datetime import datetime, time
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import date, datetime, timedelta, timezone
+import asyncio
 import logging
-from linebot.v3.messaging import (
-    ApiClient,
-    MessagingApi,
-    PushMessageRequest,
-    TextMessage,
-    Configuration
-)
+import time
+import pytz
 
 from src.core.config import settings
-from src.repositories.user_repository import UserRepository
+from src.core.task_queue import get_task_enqueuer, register_task_handler
+from src.repositories.user_repository import UserRepository, get_reminder_bucket
 from src.services.calendar_service import CalendarService
+from src.services.event_reminder_scheduler import event_reminder_scheduler
+from src.services.push_queue import push_queue
 
 logger = logging.getLogger(__name__)
 
-# LINE Bot API configuration
-configuration = Configuration(
-    host="https://api.line.me",
-    access_token=settings.LINE_CHANNEL_ACCESS_TOKEN
-)
+# LINE multicast accepts at most 500 recipients per request
+MULTICAST_MAX_RECIPIENTS = 500
 
 
 async def send_reminder(line_user_id: str, message: str) -> bool:
     """
     Send reminder message to user
     
+    The message goes through the rate-limited push queue, which retries
+    transient failures and dead-letters permanent ones.
+    
     Args:
         line_user_id: LINE user ID
         message: Reminder message
         
     Returns:
-        True if successful
+        True if the message was accepted for delivery
     """
-    try:
-        async with ApiClient(configuration=configuration) as api_client:
-            api = MessagingApi(api_client)
-            
-            request = PushMessageRequest(
-                to=line_user_id,
-                messages=[TextMessage(text=message)]
-            )
-            
-            await api.push_message(request)
-            logger.info(f"Sent reminder to {line_user_id}")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Failed to send reminder to {line_user_id}: {e}")
-        return False
+    return await push_queue.enqueue([line_user_id], message)
+
+
+async def send_multicast(line_user_ids: List[str], message: str) -> bool:
+    """
+    Send the same message to up to MULTICAST_MAX_RECIPIENTS users in one request
+    
+    Args:
+        line_user_ids: LINE user IDs
+        message: Message text
+    
+    Returns:
+        True if the message was accepted for delivery
+    """
+    return await push_queue.enqueue(line_user_ids, message)
+
+
+async def deliver_messages(messages: Dict[str, str]) -> Dict[str, bool]:
+    """
+    Deliver messages, multicasting identical texts
+    
+    Recipients are grouped by message text. Groups are sent with one
+    multicast per MULTICAST_MAX_RECIPIENTS users; single recipients are pushed.
+    
+    Args:
+        messages: Message text per LINE user ID
+    
+    Returns:
+        Whether the message was accepted for delivery, per LINE user ID
+    """
+    groups: Dict[str, List[str]] = {}
+    for line_user_id, message in messages.items():
+        groups.setdefault(message, []).append(line_user_id)
+    
+    requests = []
+    for message, line_user_ids in groups.items():
+        for i in range(0, len(line_user_ids), MULTICAST_MAX_RECIPIENTS):
+            requests.append((line_user_ids[i:i + MULTICAST_MAX_RECIPIENTS], message))
+    
+    async def send(line_user_ids: List[str], message: str) -> bool:
+        if len(line_user_ids) == 1:
+            return await send_reminder(line_user_ids[0], message)
+        return await send_multicast(line_user_ids, message)
+    
+    results = await asyncio.gather(*(
+        send(line_user_ids, message) for line_user_ids, message in requests
+    ))
+    
+    delivered = {}
+    for (line_user_ids, _), success in zip(requests, results):
+        for line_user_id in line_user_ids:
+            delivered[line_user_id] = success
+    return delivered
+
+
+async def send_announcement(
+    message: str,
+    line_user_ids: Optional[List[str]] = None
+) -> Dict[str, int]:
+    """
+    Send the same message to many users via multicast
+    
+    Args:
+        message: Announcement text
+        line_user_ids: Recipients (defaults to all active users)
+    
+    Returns:
+        Delivery metrics (recipients, sent, failed)
+    """
+    if line_user_ids is None:
+        user_repo = UserRepository()
+        line_user_ids = await user_repo.get_active_user_ids()
+    
+    delivered = await deliver_messages(
+        {line_user_id: message for line_user_id in line_user_ids}
+    )
+    
+    sent = sum(1 for success in delivered.values() if success)
+    stats = {
+        'recipients': len(delivered),
+        'sent': sent,
+        'failed': len(delivered) - sent
+    }
+    logger.info(f"Sent announcement: {stats}")
+    return stats
+
+
+def get_current_reminder_bucket(now: Optional[datetime] = None) -> int:
+    """
+    Get the reminder bucket for the current time in the reminder timezone
+    
+    Args:
+        now: Reference time (defaults to current time)
+    
+    Returns:
+        Bucket start as minutes since midnight
+    """
+    tz = pytz.timezone(settings.REMINDER_TIMEZONE)
+    now = now.astimezone(tz) if now else datetime.now(tz)
+    return get_reminder_bucket(now.strftime('%H:%M'))
+
+
+def get_reminder_time_slot(preferences: Dict[str, Any], bucket: int) -> Optional[str]:
+    """
+    Get which of the user's reminder times falls in the bucket
+    
+    Args:
+        preferences: User preferences
+        bucket: Minute-of-day bucket
+    
+    Returns:
+        'morning', 'evening' or None
+    """
+    if get_reminder_bucket(preferences.get('reminder_time_morning', '09:00')) == bucket:
+        return 'morning'
+    if get_reminder_bucket(preferences.get('reminder_time_evening', '21:00')) == bucket:
+        return 'evening'
+    return None
 
 
-async def generate_reminders_for_all_users(time_slot: str) -> int:
+async def plan_reminder_shards(bucket: int) -> Dict[str, Any]:
     """
-    Generate reminders for all eligible users
+    Split users due in a bucket into shards and enqueue one task per shard
+    
+    Shards are contiguous user ID ranges, so each worker can load its users
+    with a cursor query. Workers run on any instance via the task queue.
     
     Args:
-        time_slot: 'morning' or 'evening'
+        bucket: Minute-of-day bucket (see get_current_reminder_bucket)
         
     Returns:
-        Number of reminders generated
+        Planning result (users, shards, enqueued)
+    """
+    user_repo = UserRepository()
+    user_ids = await user_repo.get_user_ids_for_reminder(bucket)
+    
+    # Task IDs are keyed on the shard's user ID range, not its position:
+    # a retried run re-enqueues identical shards as duplicates, and a
+    # shard whose membership changed in between is a new task rather
+    # than a dedup hit that would skip its users
+    tz = pytz.timezone(settings.REMINDER_TIMEZONE)
+    run_date = datetime.now(tz).strftime('%Y%m%d')
+    
+    enqueuer = get_task_enqueuer()
+    shard_size = settings.REMINDER_SHARD_SIZE
+    shards = 0
+    enqueued = 0
+    
+    for i in range(0, len(user_ids), shard_size):
+        shard = user_ids[i:i + shard_size]
+        shards += 1
+        
+        accepted = await enqueuer.enqueue(
+            'reminder-shard',
+            {
+                'bucket': bucket,
+                'start_at': shard[0],
+                'end_at': shard[-1]
+            },
+            task_id=f"reminders-{run_date}-{bucket}-{shard[0]}-{shard[-1]}"
+        )
+        if accepted:
+            enqueued += 1
+    
+    logger.info(f"Planned {shards} reminder shards for {len(user_ids)} users in bucket {bucket}")
+    return {'users': len(user_ids), 'shards': shards, 'enqueued': enqueued}
+
+
+async def process_reminder_shard(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Generate reminders for one shard of users
+    
+    Args:
+        payload: Task payload with bucket, start_at and end_at
+    
+    Returns:
+        Run metrics (users, sent, skipped, failed, timeouts, duration_ms)
+    
+    Raises:
+        Exception: The shard could not be processed; the task endpoint
+            answers 500 so Cloud Tasks retries it
     """
+    started = time.monotonic()
+    bucket = int(payload['bucket'])
+    stats = {
+        'users': 0,
+        'sent': 0,
+        'skipped': 0,
+        'failed': 0,
+        'timeouts': 0
+    }
+    
     try:
         user_repo = UserRepository()
-        users = await user_repo.get_users_for_reminder(time_slot)
+        users = await user_repo.get_users_for_reminder(
+            bucket,
+            start_at=payload.get('start_at'),
+            end_at=payload.get('end_at')
+        )
+        stats['users'] = len(users)
+        
+        await process_reminder_users(users, bucket, stats)
+        
+    except Exception as e:
+        logger.error(f"Error processing reminder shard {payload}: {e}")
+        raise
+    
+    stats['duration_ms'] = int((time.monotonic() - started) * 1000)
+    logger.info(f"Processed reminder shard {payload}: {stats}")
+    return stats
+
+
+register_task_handler('reminder-shard', process_reminder_shard)
+
+
+async def process_reminder_users(
+    users: List[Dict[str, Any]],
+    bucket: int,
+    stats: Dict[str, int]
+):
+    """
+    Run the reminder pipeline for a list of users with bounded concurrency
+    
+    Messages are generated per user first, then delivered together so
+    identical texts go out as a single multicast.
+    
+    Args:
+        users: User documents
+        bucket: Minute-of-day bucket
+        stats: Metrics dict updated in place
+    """
+    calendar_service = CalendarService()
+    semaphore = asyncio.Semaphore(settings.REMINDER_CONCURRENCY)
+    progress_every = max(100, settings.REMINDER_CONCURRENCY * 10)
+    messages: Dict[str, str] = {}
+    
+    async def worker(user: Dict[str, Any]):
+        async with semaphore:
+            outcome, message = await _prepare_user_reminder(user, bucket, calendar_service)
         
-        count = 0
-        calendar_service = CalendarService()
+        if message:
+            messages[user['id']] = message
+        else:
+            stats[outcome] += 1
         
-        for user in users:
-            line_user_id = user['id']
-            preferences = user.get('preferences', {})
-            
-            # Check if user wants reminders for this time slot
-            reminder_time = None
-            if time_slot == 'morning':
-                reminder_time = preferences.get('reminder_time_morning', '09:00')
-            elif time_slot == 'evening':
-                reminder_time = preferences.get('reminder_time_evening', '21:00')
-            
-            if not reminder_time:
-                continue
-            
-            # Generate reminder message
-            message = await generate_reminder_message(
+        done = len(messages) + stats['skipped'] + stats['failed'] + stats['timeouts']
+        if done % progress_every == 0:
+            logger.info(f"Reminder progress: {done}/{len(users)} {stats}")
+    
+    await asyncio.gather(*(worker(user) for user in users))
+    
+    delivered = await deliver_messages(messages)
+    for success in delivered.values():
+        stats['sent' if success else 'failed'] += 1
+
+
+async def _prepare_user_reminder(
+    user: Dict[str, Any],
+    bucket: int,
+    calendar_service: CalendarService
+) -> Tuple[str, Optional[str]]:
+    """
+    Generate one user's reminder message
+    
+    Returns:
+        Tuple of (outcome, message). The outcome is 'skipped', 'failed' or
+        'timeouts' when there is no message to deliver.
+    """
+    line_user_id = user['id']
+    preferences = user.get('preferences', {})
+    
+    # Check if the user's reminder time is really in this bucket
+    if not get_reminder_time_slot(preferences, bucket):
+        return 'skipped', None
+    
+    try:
+        # Precomputed digest, or credentials refresh + Calendar list
+        message = await asyncio.wait_for(
+            generate_reminder_message(
                 line_user_id,
                 preferences,
-                calendar_service
-            )
-            
-            if message:
-                # In production, this would queue the task in Cloud Tasks
-                # For now, send immediately
-                success = await send_reminder(line_user_id, message)
-                if success:
-                    count += 1
+                calendar_service,
+                digest=user.get('reminder_digest')
+            ),
+            timeout=settings.REMINDER_CALENDAR_TIMEOUT
+        )
+        if not message:
+            return 'skipped', None
+        return 'sent', message
+    
+    except asyncio.TimeoutError:
+        logger.warning(f"Reminder for {line_user_id} timed out")
+        return 'timeouts', None
+    except Exception as e:
+        logger.error(f"Error processing reminder for {line_user_id}: {e}")
+        return 'failed', None
+
+
+def get_digest_period(
+    preferences: Dict[str, Any],
+    now: Optional[datetime] = None
+) -> tuple[date, date]:
+    """
+    Get the period a reminder digest covers: the next reminder_days_ahead days
+    
+    Args:
+        preferences: User preferences
+        now: Reference time (defaults to current time)
+    
+    Returns:
+        Tuple of (start date, end date inclusive)
+    """
+    tz = pytz.timezone(settings.REMINDER_TIMEZONE)
+    today = now.astimezone(tz).date() if now else datetime.now(tz).date()
+    days_ahead = max(1, preferences.get('reminder_days_ahead', 1))
+    
+    start_date = today + timedelta(days=1)
+    return start_date, start_date + timedelta(days=days_ahead - 1)
+
+
+def build_reminder_message(events: List[Dict[str, Any]], days_ahead: int) -> Optional[str]:
+    """
+    Build reminder message from events
+    
+    Args:
+        events: Formatted calendar events
+        days_ahead: Number of days covered
+    
+    Returns:
+        Reminder message or None if there are no events
+    """
+    if not events:
+        return None  # No events, no reminder needed
+    
+    # Build reminder message
+    if days_ahead == 1:
+        message = "📅 明日の予定をお知らせします：\n\n"
+    else:
+        message = f"📅 今後{days_ahead}日間の予定をお知らせします：\n\n"
+    
+    for event in events[:5]:  # Limit to 5 events
+        start_time = event.get('start_time', '')
+        title = event.get('title', '(タイトルなし)')
         
-        logger.info(f"Generated {count} reminders for {time_slot}")
-        return count
+        if start_time:
+            message += f"• {start_time} {title}\n"
+        else:
+            message += f"• {title}\n"
+    
+    if len(events) > 5:
+        message += f"\n... 他{len(events) - 5}件の予定があります"
+    
+    return message
+
+
+def _is_digest_for_period(
+    digest: Optional[Dict[str, Any]],
+    preferences: Dict[str, Any]
+) -> bool:
+    """Check that a stored digest covers the current period"""
+    if not digest:
+        return False
+    
+    start_date, _ = get_digest_period(preferences)
+    return (
+        digest.get('start_date') == start_date.isoformat()
+        and digest.get('days_ahead') == preferences.get('reminder_days_ahead', 1)
+    )
+
+
+async def compute_reminder_digest(
+    line_user_id: str,
+    preferences: Dict[str, Any],
+    calendar_service: CalendarService,
+    digest: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Compute the reminder digest for the user's next period
+    
+    If a digest for the same period is given, its ETag is used for a
+    conditional request and the stored message is kept when unchanged.
+    
+    Args:
+        line_user_id: LINE user ID
+        preferences: User preferences
+        calendar_service: Calendar service instance
+        digest: Previously stored digest
+    
+    Returns:
+        Digest dict or None on error
+    """
+    days_ahead = preferences.get('reminder_days_ahead', 1)
+    start_date, end_date = get_digest_period(preferences)
+    etag = digest.get('etag') if _is_digest_for_period(digest, preferences) else None
+    
+    result = await calendar_service.fetch_events(line_user_id, start_date, end_date, etag)
+    if result is None:
+        return None
+    
+    computed_at = datetime.now(timezone.utc)
+    
+    if result['not_modified']:
+        return {**digest, 'computed_at': computed_at}
+    
+    return {
+        'start_date': start_date.isoformat(),
+        'days_ahead': days_ahead,
+        'message': build_reminder_message(result['events'], max(1, days_ahead)),
+        'etag': result['etag'],
+        'computed_at': computed_at
+    }
+
+
+async def precompute_reminder_digests(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Precompute reminder digests for one page of users
+    
+    Runs off-peak so that reminder slots only push (or revalidate cheaply).
+    Enqueues the next page through the task queue until all users are done.
+    
+    Args:
+        payload: Task payload with optional start_after and page_size
+    
+    Returns:
+        Page metrics (users, computed, failed, next_cursor)
+    """
+    page_size = int(payload.get('page_size', settings.REMINDER_SHARD_SIZE))
+    
+    user_repo = UserRepository()
+    users = await user_repo.get_reminder_users_page(
+        start_after=payload.get('start_after'),
+        page_size=page_size
+    )
+    
+    calendar_service = CalendarService()
+    semaphore = asyncio.Semaphore(settings.REMINDER_CONCURRENCY)
+    digests = {}
+    
+    async def worker(user: Dict[str, Any]):
+        async with semaphore:
+            try:
+                digest = await asyncio.wait_for(
+                    compute_reminder_digest(
+                        user['id'],
+                        user.get('preferences', {}),
+                        calendar_service,
+                        user.get('reminder_digest')
+                    ),
+                    timeout=settings.REMINDER_CALENDAR_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                digest = None
+            if digest:
+                digests[user['id']] = digest
+    
+    await asyncio.gather(*(worker(user) for user in users))
+    await user_repo.save_reminder_digests(digests)
+    
+    # Continue with the next page
+    next_cursor = users[-1]['id'] if len(users) == page_size else None
+    if next_cursor:
+        await get_task_enqueuer().enqueue(
+            'digest-page',
+            {'start_after': next_cursor, 'page_size': page_size},
+            task_id=f"digests-{datetime.now(timezone.utc).strftime('%Y%m%d%H')}-{next_cursor}"
+        )
+    
+    stats = {
+        'users': len(users),
+        'computed': len(digests),
+        'failed': len(users) - len(digests),
+        'next_cursor': next_cursor
+    }
+    logger.info(f"Precomputed reminder digests: {stats}")
+    return stats
+
+
+register_task_handler('digest-page', precompute_reminder_digests)
+
+
+async def sync_event_reminders() -> Dict[str, Any]:
+    """
+    Schedule pre-event reminders for upcoming events
+    
+    Loads the upcoming events of every user with reminder_before_event_minutes
+    set and enqueues their reminder tasks. This picks up events created
+    outside the bot; reminders that already exist are deduplicated by task ID.
+    
+    Returns:
+        Sync metrics (users, scheduled, failed)
+    """
+    user_repo = UserRepository()
+    minutes_by_user = await user_repo.get_event_reminder_settings()
+    
+    calendar_service = CalendarService()
+    semaphore = asyncio.Semaphore(settings.REMINDER_CONCURRENCY)
+    tz = pytz.timezone(settings.REMINDER_TIMEZONE)
+    today = datetime.now(tz).date()
+    end_date = today + timedelta(days=settings.EVENT_REMINDER_SYNC_DAYS)
+    stats = {'users': len(minutes_by_user), 'scheduled': 0, 'failed': 0}
+    
+    async def worker(line_user_id: str, minutes_before: int):
+        async with semaphore:
+            try:
+                result = await asyncio.wait_for(
+                    calendar_service.fetch_events(line_user_id, today, end_date),
+                    timeout=settings.REMINDER_CALENDAR_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                result = None
         
-    except Exception as e:
-        logger.error(f"Error generating reminders: {e}")
-        return 0
+        if not result:
+            stats['failed'] += 1
+            return
+        stats['scheduled'] += await event_reminder_scheduler.sync_user_events(
+            line_user_id, result['events'], minutes_before
+        )
+    
+    await asyncio.gather(*(
+        worker(line_user_id, minutes_before)
+        for line_user_id, minutes_before in minutes_by_user.items()
+    ))
+    
+    logger.info(f"Synced event reminders: {stats}")
+    return stats
 
 
 async def generate_reminder_message(
     line_user_id: str,
     preferences: Dict[str, Any],
-    calendar_service: CalendarService
-) -> str:
+    calendar_service: CalendarService,
+    digest: Optional[Dict[str, Any]] = None
+) -> Optional[str]:
     """
     Generate reminder message for user
     
+    A precomputed digest for the current period that is younger than
+    DIGEST_MAX_AGE_MINUTES is sent as is, so the peak slot makes no token
+    refresh or Calendar request. Changes made through the bot clear the
+    digest (see CalendarService); changes made in Google Calendar are
+    picked up when the off-peak precompute job revalidates it. Older
+    digests are revalidated here with a conditional request.
+    
     Args:
         line_user_id: LINE user ID
         preferences: User preferences
         calendar_service: Calendar service instance
+        digest: Precomputed digest stored on the user
         
     Returns:
         Reminder message or None
     """
     try:
-        days_ahead = preferences.get('reminder_days_ahead', 1)
-        
-        # Get events for the specified period
-        entities = {
-            'start_date': datetime.now().date(),
-            'end_date': (datetime.now() + datetime.timedelta(days=days_ahead)).date()
-        }
-        
-        events = await calendar_service.list_events(line_user_id, entities)
-        
-        if not events:
-            return None  # No events, no reminder needed
-        
-        # Build reminder message
-        if days_ahead == 1:
-            message = "📅 明日の予定をお知らせします：\n\n"
-        else:
-            message = f"📅 今後{days_ahead}日間の予定をお知らせします：\n\n"
+        if _is_digest_for_period(digest, preferences):
+            computed_at = digest.get('computed_at')
+            max_age = timedelta(minutes=settings.DIGEST_MAX_AGE_MINUTES)
+            if computed_at and datetime.now(timezone.utc) - computed_at <= max_age:
+                return digest.get('message')
         
-        for event in events[:5]:  # Limit to 5 events
-            start_time = event.get('start_time', '')
-            title = event.get('title', '(タイトルなし)')
-            
-            if start_time:
-                message += f"• {start_time} {title}\n"
-            else:
-                message += f"• {title}\n"
+        new_digest = await compute_reminder_digest(
+            line_user_id,
+            preferences,
+            calendar_service,
+            digest
+        )
+        if new_digest is None:
+            return None
         
-        if len(events) > 5:
-            message += f"\n... 他{len(events) - 5}件の予定があります"
+        # Keep the digest for later slots in the same period
+        if not digest or new_digest.get('etag') != digest.get('etag'):
+            await UserRepository().save_reminder_digests({line_user_id: new_digest})
         
-        return message
+        return new_digest['message']
         
     except Exception as e:
         logger.error(f"Error generating reminder message: {e}")
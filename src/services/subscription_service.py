@@ -3,6 +3,7 @@ Subscription management service
 """
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
+import calendar
 import logging
 
 from src.repositories.user_repository import UserRepository
@@ -33,24 +34,74 @@ PLAN_CONFIGS = {
 }
 
 
+def get_billing_period_key(anchor_day: int, now: Optional[datetime] = None) -> str:
+    """
+    Get the billing period key for the given time
+    
+    A period starts on anchor_day of each month (clamped to the month's
+    length) and is keyed by the month it starts in, e.g. "2026-10".
+    
+    Args:
+        anchor_day: Day of month the billing cycle starts on (1-31)
+        now: Reference time (defaults to current time)
+    
+    Returns:
+        Period key in YYYY-MM format
+    """
+    now = now or datetime.now()
+    year, month = now.year, now.month
+    
+    start_day = min(anchor_day, calendar.monthrange(year, month)[1])
+    if now.day < start_day:
+        # Still inside the period that started last month
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    
+    return f"{year:04d}-{month:02d}"
+
+
+def get_billing_anchor_day(user: Dict[str, Any]) -> int:
+    """Get the day of month the user's billing cycle starts on"""
+    anchor_day = user.get('subscription', {}).get('billing_anchor_day')
+    if anchor_day:
+        return int(anchor_day)
+    
+    created_at = user.get('created_at')
+    if isinstance(created_at, datetime):
+        return created_at.day
+    
+    return 1
+
+
+def get_current_ai_usage(user: Dict[str, Any], now: Optional[datetime] = None) -> int:
+    """Get AI calls used by the user in the current billing period"""
+    period_key = get_billing_period_key(get_billing_anchor_day(user), now)
+    return user.get('ai_usage', {}).get(period_key, 0)
+
+
 class SubscriptionService:
     """Service for managing user subscriptions"""
     
     def __init__(self):
         self.user_repo = UserRepository()
     
-    async def check_ai_availability(self, line_user_id: str) -> tuple[bool, str]:
+    async def check_ai_availability(
+        self,
+        line_user_id: str,
+        user: Optional[Dict[str, Any]] = None
+    ) -> tuple[bool, str]:
         """
         Check if user can use AI agent
         
         Args:
             line_user_id: LINE user ID
+            user: User document if already loaded
             
         Returns:
             Tuple of (can_use_ai, reason_message)
         """
         try:
-            user = await self.user_repo.get_user(line_user_id)
+            if user is None:
+                user = await self.user_repo.get_user(line_user_id)
             if not user:
                 return False, "ユーザー情報が見つかりません"
             
@@ -65,18 +116,10 @@ class SubscriptionService:
                 return True, ""
             
             # Check monthly limit for other plans
-            ai_calls_used = subscription.get('ai_calls_used', 0)
+            # Usage is keyed by billing period, so a new period starts at zero
+            ai_calls_used = get_current_ai_usage(user)
             ai_calls_limit = plan_config['ai_calls_limit']
             
-            # Reset monthly counter if needed
-            last_reset = subscription.get('last_reset_at')
-            if last_reset:
-                last_reset_date = datetime.fromisoformat(last_reset)
-                if datetime.now() - last_reset_date > timedelta(days=30):
-                    # Reset counter
-                    await self._reset_monthly_counter(line_user_id)
-                    ai_calls_used = 0
-            
             # Check limit
             if ai_calls_limit > 0 and ai_calls_used >= ai_calls_limit:
                 return False, (
@@ -98,54 +141,35 @@ class SubscriptionService:
             logger.error(f"Error checking AI availability: {e}")
             return False, "エラーが発生しました"
     
-    async def increment_ai_usage(self, line_user_id: str) -> bool:
+    async def increment_ai_usage(
+        self,
+        line_user_id: str,
+        user: Optional[Dict[str, Any]] = None
+    ) -> bool:
         """
-        Increment AI usage counter
+        Increment AI usage counter for the current billing period
         
         Args:
             line_user_id: LINE user ID
+            user: Already loaded user data (avoids an extra read)
             
         Returns:
             True if successful
         """
         try:
-            user = await self.user_repo.get_user(line_user_id)
-            if not user:
-                return False
-            
-            subscription = user.get('subscription', {})
-            ai_calls_used = subscription.get('ai_calls_used', 0)
+            if user is None:
+                user = await self.user_repo.get_user(line_user_id)
+                if not user:
+                    return False
             
-            # Update counter
-            subscription['ai_calls_used'] = ai_calls_used + 1
+            period_key = get_billing_period_key(get_billing_anchor_day(user))
             
-            return await self.user_repo.update(line_user_id, {
-                'subscription': subscription
-            })
+            return await self.user_repo.increment_ai_usage(line_user_id, period_key)
             
         except Exception as e:
             logger.error(f"Error incrementing AI usage: {e}")
             return False
     
-    async def _reset_monthly_counter(self, line_user_id: str) -> bool:
-        """Reset monthly AI usage counter"""
-        try:
-            user = await self.user_repo.get_user(line_user_id)
-            if not user:
-                return False
-            
-            subscription = user.get('subscription', {})
-            subscription['ai_calls_used'] = 0
-            subscription['last_reset_at'] = datetime.now().isoformat()
-            
-            return await self.user_repo.update(line_user_id, {
-                'subscription': subscription
-            })
-            
-        except Exception as e:
-            logger.error(f"Error resetting counter: {e}")
-            return False
-    
     async def upgrade_plan(self, line_user_id: str, new_plan: str) -> Dict[str, Any]:
         """
         Upgrade user's subscription plan
@@ -177,6 +201,7 @@ class SubscriptionService:
             
             subscription['plan'] = new_plan
             subscription['is_active'] = True
+            subscription.setdefault('billing_anchor_day', get_billing_anchor_day(user))
             subscription['expires_at'] = (datetime.now() + timedelta(days=30)).isoformat()
             
             # Enable AI for paid plans
@@ -226,7 +251,7 @@ class SubscriptionService:
             plan_config = PLAN_CONFIGS.get(plan, PLAN_CONFIGS['free'])
             
             # Calculate remaining AI calls
-            ai_calls_used = subscription.get('ai_calls_used', 0)
+            ai_calls_used = get_current_ai_usage(user)
             ai_calls_limit = plan_config['ai_calls_limit']
             ai_calls_remaining = (
                 '無制限' if ai_calls_limit == -1 
@@ -0,0 +1,88 @@
+"""
+Per-user ordered dispatcher for webhook processing
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class MailboxFull(Exception):
+    """Raised when a user's mailbox cannot take more work"""
+
+
+class UserDispatcher:
+    """
+    Actor-style dispatcher: one mailbox and one runner per user
+    
+    Jobs for the same user run one at a time in submission order, so quick
+    follow-ups such as "明日15時に会議" and "やっぱりさっきのキャンセル" cannot
+    overtake each other. Different users run fully in parallel. A runner
+    exits as soon as its mailbox is empty, so idle users cost nothing.
+    """
+    
+    def __init__(self, mailbox_size: Optional[int] = None):
+        self.mailbox_size = mailbox_size or settings.WEBHOOK_USER_MAILBOX_SIZE
+        self._mailboxes: Dict[str, asyncio.Queue] = {}
+        self._runners: set = set()
+        self.stats = {'dispatched': 0, 'rejected': 0}
+    
+    @property
+    def active_users(self) -> int:
+        """Number of users with queued or running jobs"""
+        return len(self._mailboxes)
+    
+    def submit(self, key: str, job: Job) -> asyncio.Future:
+        """
+        Queue a job behind the user's earlier jobs
+        
+        Args:
+            key: User key (LINE source.user_id)
+            job: Coroutine function to run
+        
+        Returns:
+            Future resolved with the job's result
+        
+        Raises:
+            MailboxFull: The user already has mailbox_size jobs waiting
+        """
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = asyncio.Queue(maxsize=self.mailbox_size)
+            self._mailboxes[key] = mailbox
+            runner = asyncio.create_task(self._run(key, mailbox))
+            self._runners.add(runner)
+            runner.add_done_callback(self._runners.discard)
+        
+        future = asyncio.get_running_loop().create_future()
+        try:
+            mailbox.put_nowait((job, future))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise MailboxFull(f"Mailbox for {key} is full")
+        
+        self.stats['dispatched'] += 1
+        return future
+    
+    async def _run(self, key: str, mailbox: asyncio.Queue):
+        """Run a user's jobs in order until the mailbox is empty"""
+        try:
+            while not mailbox.empty():
+                job, future = mailbox.get_nowait()
+                try:
+                    result = await job()
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+        finally:
+            # Nothing can be added between the empty check and removal,
+            # because both happen without yielding to the event loop
+            if self._mailboxes.get(key) is mailbox:
+                del self._mailboxes[key]
\ No newline at end of file
@@ -0,0 +1,547 @@
+"""
+Durable webhook event queue and worker pool
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+
+from src.core.config import settings
+from src.services.user_dispatcher import MailboxFull, UserDispatcher
+
+logger = logging.getLogger(__name__)
+
+QueuedEvent = Tuple[str, str, int]  # (queue item ID, event JSON, attempts)
+
+
+class EventQueue:
+    """
+    Base class for durable event queues
+    
+    Claimed items are leased; an item that is not acked before its lease
+    runs out becomes claimable again, which gives at-least-once delivery.
+    """
+    
+    async def put(self, payload: str) -> str:
+        """
+        Add an event
+        
+        Args:
+            payload: Event JSON
+        
+        Returns:
+            Queue item ID
+        """
+        raise NotImplementedError
+    
+    async def claim(self, limit: int, lease_seconds: float) -> List[QueuedEvent]:
+        """
+        Lease up to limit available items, oldest first
+        
+        Returns:
+            List of (item ID, payload, attempts including this one)
+        """
+        raise NotImplementedError
+    
+    async def ack(self, item_id: str):
+        """Remove a processed item"""
+        raise NotImplementedError
+    
+    async def nack(self, item_id: str, delay_seconds: float = 0):
+        """Make an item available again after a delay"""
+        raise NotImplementedError
+    
+    async def extend(self, item_ids: List[str], lease_seconds: float):
+        """Renew the lease of items that are still being processed"""
+        raise NotImplementedError
+    
+    async def size(self) -> int:
+        """Number of queued items, including leased ones"""
+        raise NotImplementedError
+
+
+class InMemoryEventQueue(EventQueue):
+    """Event queue kept in memory (tests and local development; not durable)"""
+    
+    def __init__(self):
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._sequence = 0
+    
+    async def put(self, payload: str) -> str:
+        self._sequence += 1
+        item_id = f"{self._sequence:020d}"
+        self._items[item_id] = {'payload': payload, 'available_at': 0.0, 'attempts': 0}
+        return item_id
+    
+    async def claim(self, limit: int, lease_seconds: float) -> List[QueuedEvent]:
+        now = time.time()
+        claimed = []
+        for item_id in sorted(self._items):
+            item = self._items[item_id]
+            if item['available_at'] <= now:
+                item['available_at'] = now + lease_seconds
+                item['attempts'] += 1
+                claimed.append((item_id, item['payload'], item['attempts']))
+                if len(claimed) >= limit:
+                    break
+        return claimed
+    
+    async def ack(self, item_id: str):
+        self._items.pop(item_id, None)
+    
+    async def nack(self, item_id: str, delay_seconds: float = 0):
+        item = self._items.get(item_id)
+        if item is not None:
+            item['available_at'] = time.time() + delay_seconds
+    
+    async def extend(self, item_ids: List[str], lease_seconds: float):
+        lease_until = time.time() + lease_seconds
+        for item_id in item_ids:
+            item = self._items.get(item_id)
+            if item is not None:
+                item['available_at'] = lease_until
+    
+    async def size(self) -> int:
+        return len(self._items)
+
+
+class SQLiteEventQueue(EventQueue):
+    """Event queue in a local SQLite file (survives process restarts)"""
+    
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "payload TEXT NOT NULL, "
+            "available_at REAL NOT NULL DEFAULT 0, "
+            "attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+    
+    async def put(self, payload: str) -> str:
+        cursor = self._conn.execute(
+            "INSERT INTO webhook_events (payload) VALUES (?)", (payload,)
+        )
+        self._conn.commit()
+        return str(cursor.lastrowid)
+    
+    async def claim(self, limit: int, lease_seconds: float) -> List[QueuedEvent]:
+        now = time.time()
+        rows = self._conn.execute(
+            "SELECT id, payload, attempts FROM webhook_events WHERE available_at <= ? "
+            "ORDER BY id LIMIT ?",
+            (now, limit)
+        ).fetchall()
+        self._conn.executemany(
+            "UPDATE webhook_events SET available_at = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            [(now + lease_seconds, row[0]) for row in rows]
+        )
+        self._conn.commit()
+        return [(str(row[0]), row[1], row[2] + 1) for row in rows]
+    
+    async def ack(self, item_id: str):
+        self._conn.execute("DELETE FROM webhook_events WHERE id = ?", (int(item_id),))
+        self._conn.commit()
+    
+    async def nack(self, item_id: str, delay_seconds: float = 0):
+        self._conn.execute(
+            "UPDATE webhook_events SET available_at = ? WHERE id = ?",
+            (time.time() + delay_seconds, int(item_id))
+        )
+        self._conn.commit()
+    
+    async def extend(self, item_ids: List[str], lease_seconds: float):
+        lease_until = time.time() + lease_seconds
+        self._conn.executemany(
+            "UPDATE webhook_events SET available_at = ? WHERE id = ?",
+            [(lease_until, int(item_id)) for item_id in item_ids]
+        )
+        self._conn.commit()
+    
+    async def size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM webhook_events").fetchone()[0]
+
+
+class FirestoreEventQueue(EventQueue):
+    """Event queue in the webhook_event_queue collection, shared by all instances"""
+    
+    collection_name = 'webhook_event_queue'
+    
+    @property
+    def collection(self):
+        from src.core.firestore import get_db
+        return get_db().collection(self.collection_name)
+    
+    async def put(self, payload: str) -> str:
+        now = datetime.now(timezone.utc)
+        # Time-ordered IDs keep claims roughly FIFO
+        item_id = f"{now.strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        await asyncio.to_thread(self.collection.document(item_id).set, {
+            'payload': payload,
+            'available_at': now,
+            'attempts': 0,
+            'created_at': now
+        })
+        return item_id
+    
+    async def claim(self, limit: int, lease_seconds: float) -> List[QueuedEvent]:
+        return await asyncio.to_thread(self._claim, limit, lease_seconds)
+    
+    def _claim(self, limit: int, lease_seconds: float) -> List[QueuedEvent]:
+        """Lease available documents, each in its own transaction"""
+        from google.cloud import firestore
+        from src.core.firestore import get_db
+        
+        now = datetime.now(timezone.utc)
+        lease_until = now + timedelta(seconds=lease_seconds)
+        candidates = (
+            self.collection
+            .where('available_at', '<=', now)
+            .order_by('available_at')
+            .limit(limit)
+            .stream()
+        )
+        
+        @firestore.transactional
+        def lease(transaction, doc_ref):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists or snapshot.get('available_at') > now:
+                return None
+            attempts = snapshot.get('attempts') + 1
+            transaction.update(doc_ref, {
+                'available_at': lease_until,
+                'attempts': attempts
+            })
+            return snapshot.get('payload'), attempts
+        
+        claimed = []
+        for doc in candidates:
+            try:
+                leased = lease(get_db().transaction(), doc.reference)
+            except Exception as e:
+                # Another instance leased it first
+                logger.debug(f"Could not lease queued event {doc.id}: {e}")
+                continue
+            if leased is not None:
+                claimed.append((doc.id, *leased))
+        
+        return sorted(claimed)
+    
+    async def ack(self, item_id: str):
+        await asyncio.to_thread(self.collection.document(item_id).delete)
+    
+    async def nack(self, item_id: str, delay_seconds: float = 0):
+        await asyncio.to_thread(self.collection.document(item_id).update, {
+            'available_at': datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+        })
+    
+    async def extend(self, item_ids: List[str], lease_seconds: float):
+        await asyncio.to_thread(self._extend, item_ids, lease_seconds)
+    
+    def _extend(self, item_ids: List[str], lease_seconds: float):
+        """Renew leases one document at a time, skipping acked items"""
+        from google.api_core import exceptions
+        
+        lease_until = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+        for item_id in item_ids:
+            try:
+                self.collection.document(item_id).update({'available_at': lease_until})
+            except exceptions.NotFound:
+                pass
+    
+    async def size(self) -> int:
+        result = await asyncio.to_thread(self.collection.count().get)
+        return int(result[0][0].value)
+
+
+def create_event_queue() -> EventQueue:
+    """
+    Create the event queue selected by WEBHOOK_QUEUE_BACKEND
+    
+    Returns:
+        "memory", "sqlite" (WEBHOOK_QUEUE_PATH) or "firestore" queue
+    """
+    backend = settings.WEBHOOK_QUEUE_BACKEND
+    if backend == "sqlite":
+        return SQLiteEventQueue(settings.WEBHOOK_QUEUE_PATH)
+    if backend == "firestore":
+        return FirestoreEventQueue()
+    return InMemoryEventQueue()
+
+
+class WebhookWorkerPool:
+    """
+    Drains the event queue with a bounded number of concurrent handlers
+    
+    Events are routed through a UserDispatcher, so each user's events run
+    in order while different users run in parallel. Items are acked only
+    after their handler finishes, and their leases are renewed while they
+    wait in a mailbox or run, so a slow handler or a busy user does not
+    get the item redelivered. An item that finds its user's mailbox full
+    is requeued, and that user's later items are requeued behind it until
+    it gets in, so overflow never reorders a user's events. Failed items
+    are retried with backoff up to WEBHOOK_QUEUE_MAX_ATTEMPTS times; items
+    left leased by a stopped or crashed instance are picked up again once
+    their lease expires.
+    """
+    
+    def __init__(
+        self,
+        queue: EventQueue,
+        handler: Callable[[str], Awaitable[Any]],
+        workers: Optional[int] = None,
+        key_func: Optional[Callable[[str], Optional[str]]] = None
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers or settings.WEBHOOK_WORKERS
+        self.key_func = key_func
+        self.dispatcher = UserDispatcher()
+        self._wakeup = asyncio.Event()
+        self._in_flight: set = set()
+        # Claimed items not yet acked or nacked (in a mailbox or running)
+        self._scheduled: Dict[str, asyncio.Future] = {}
+        # Per user: the item requeued on a full mailbox, and until when
+        # later items of that user are held back behind it
+        self._requeued: Dict[str, Tuple[str, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._renewer: Optional[asyncio.Task] = None
+        self.stats = {'processed': 0, 'retried': 0, 'dropped': 0}
+    
+    @property
+    def is_running(self) -> bool:
+        """Whether the poll loop is running"""
+        return self._task is not None and not self._task.done()
+    
+    @property
+    def in_flight(self) -> int:
+        """Number of events being processed"""
+        return len(self._in_flight)
+    
+    async def start(self):
+        """Start the poll loop"""
+        if self.is_running:
+            return
+        self._task = asyncio.create_task(self._run())
+        self._start_renewer()
+        logger.info(f"Webhook worker pool started with {self.workers} workers")
+    
+    async def stop(self):
+        """Stop polling and give in-flight events time to finish"""
+        if not self.is_running:
+            return
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        
+        if self._in_flight:
+            # Unfinished items stay leased and are redelivered later
+            await asyncio.wait(self._in_flight, timeout=settings.WEBHOOK_QUEUE_DRAIN_TIMEOUT)
+        await self._stop_renewer()
+        logger.info(f"Webhook worker pool stopped, {self.in_flight} events left in flight")
+    
+    async def submit(self, payload: str) -> str:
+        """
+        Persist an event and wake the poll loop
+        
+        Args:
+            payload: Event JSON
+        
+        Returns:
+            Queue item ID
+        """
+        item_id = await self.queue.put(payload)
+        self._wakeup.set()
+        return item_id
+    
+    async def drain(self, max_events: Optional[int] = None) -> int:
+        """
+        Process queued events until the queue is empty
+        
+        Used where no poll loop runs (Vercel, /tasks/drain-webhook-events).
+        
+        Args:
+            max_events: Stop after claiming this many events
+        
+        Returns:
+            Number of events processed
+        """
+        processed = 0
+        renewing = self._start_renewer()
+        try:
+            while max_events is None or processed < max_events:
+                limit = self.workers
+                if max_events is not None:
+                    limit = min(limit, max_events - processed)
+                
+                items = await self.queue.claim(limit, settings.WEBHOOK_QUEUE_LEASE_SECONDS)
+                items = [item for item in items if item[0] not in self._scheduled]
+                if not items:
+                    break
+                
+                await asyncio.gather(*(self._schedule(item) for item in items))
+                processed += len(items)
+        finally:
+            if renewing:
+                await self._stop_renewer()
+        
+        return processed
+    
+    async def _run(self):
+        """Claim events as handler slots become free"""
+        while True:
+            try:
+                free = self.workers - self.in_flight
+                items = []
+                if free > 0:
+                    items = await self.queue.claim(free, settings.WEBHOOK_QUEUE_LEASE_SECONDS)
+                
+                # Claimed oldest first, so mailboxes keep each user's order
+                for item in items:
+                    if item[0] in self._scheduled:
+                        # Re-claimed while still held here; its lease is renewed
+                        continue
+                    task = self._schedule(item)
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._finished)
+                
+                if not items:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(
+                            self._wakeup.wait(),
+                            timeout=settings.WEBHOOK_QUEUE_POLL_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error polling webhook queue: {e}")
+                await asyncio.sleep(settings.WEBHOOK_QUEUE_POLL_INTERVAL)
+    
+    def _schedule(self, item: QueuedEvent) -> asyncio.Future:
+        """Hand an item to its user's mailbox (or run it directly if it has no user)"""
+        item_id, payload, attempts = item
+        key = self.key_func(payload) if self.key_func else None
+        if key is None:
+            future = asyncio.ensure_future(self._process(*item))
+        else:
+            requeued = self._requeued.get(key)
+            if requeued is not None and requeued[1] <= time.monotonic():
+                # Expired: the requeued item was likely taken by another instance
+                del self._requeued[key]
+                requeued = None
+            if requeued is not None and requeued[0] != item_id:
+                # Later events wait until the requeued one is in the mailbox
+                return self._requeue(item_id)
+            
+            try:
+                future = self.dispatcher.submit(key, lambda: self._process(*item))
+            except MailboxFull:
+                logger.warning(f"Mailbox full for {key}, requeueing webhook event {item_id}")
+                self._requeued[key] = (
+                    item_id,
+                    time.monotonic() + settings.WEBHOOK_QUEUE_LEASE_SECONDS
+                )
+                return self._requeue(item_id)
+            self._requeued.pop(key, None)
+        
+        self._scheduled[item_id] = future
+        future.add_done_callback(lambda _: self._scheduled.pop(item_id, None))
+        return future
+    
+    def _requeue(self, item_id: str) -> asyncio.Future:
+        """Give an item back to the queue for a later claim"""
+        return asyncio.ensure_future(
+            self.queue.nack(item_id, settings.WEBHOOK_QUEUE_POLL_INTERVAL)
+        )
+    
+    def _start_renewer(self) -> bool:
+        """Start renewing leases unless already running"""
+        if self._renewer is not None and not self._renewer.done():
+            return False
+        self._renewer = asyncio.create_task(self._renew_leases())
+        return True
+    
+    async def _stop_renewer(self):
+        """Stop renewing leases"""
+        if self._renewer is not None:
+            self._renewer.cancel()
+            try:
+                await self._renewer
+            except asyncio.CancelledError:
+                pass
+            self._renewer = None
+    
+    async def _renew_leases(self):
+        """Extend the leases of held items well before they run out"""
+        lease_seconds = settings.WEBHOOK_QUEUE_LEASE_SECONDS
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            if not self._scheduled:
+                continue
+            try:
+                await self.queue.extend(list(self._scheduled), lease_seconds)
+            except Exception as e:
+                logger.error(f"Error renewing webhook event leases: {e}")
+    
+    def _finished(self, task: asyncio.Future):
+        """Free the handler slot of a finished event"""
+        self._in_flight.discard(task)
+        self._wakeup.set()
+    
+    async def _process(self, item_id: str, payload: str, attempts: int):
+        """Run the handler for one item and ack or retry it"""
+        try:
+            await self.handler(payload)
+            await self.queue.ack(item_id)
+            self.stats['processed'] += 1
+        
+        except Exception as e:
+            if attempts >= settings.WEBHOOK_QUEUE_MAX_ATTEMPTS:
+                logger.error(f"Dropping webhook event {item_id} after {attempts} attempts: {e}")
+                await self.queue.ack(item_id)
+                self.stats['dropped'] += 1
+                return
+            
+            delay = min(60, 2 ** attempts)
+            await self.queue.nack(item_id, delay)
+            self.stats['retried'] += 1
+            logger.warning(f"Webhook event {item_id} failed ({e}), retrying in {delay}s")
+
+
+def get_event_user_key(payload: str) -> Optional[str]:
+    """Get the LINE user ID (source.userId) of a queued event"""
+    try:
+        return json.loads(payload).get('source', {}).get('userId')
+    except (ValueError, AttributeError):
+        return None
+
+
+async def process_webhook_event(payload: str):
+    """Deserialize a queued webhook event and dispatch it"""
+    from linebot.v3.webhooks import Event
+    from src.services.message_handler import handle_event
+    
+    await handle_event(Event.from_json(payload))
+
+
+# Global instances
+webhook_queue = create_event_queue()
+webhook_workers = WebhookWorkerPool(
+    webhook_queue,
+    process_webhook_event,
+    key_func=get_event_user_key
+)
\ No newline at end of file
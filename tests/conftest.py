@@ -0,0 +1,32 @@
+"""
+Shared test fixtures
+"""
+import os
+
+# Settings require a project; set it before any src module is imported
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "test-project")
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+
+from src.repositories import base_repository
+
+
+@pytest.fixture
+def firestore_db(monkeypatch):
+    """
+    Firestore client for repositories under test
+    
+    Talks to the emulator when FIRESTORE_EMULATOR_HOST is set; otherwise it
+    can still build queries, which is enough for query-shape tests.
+    """
+    db = firestore.Client(project="test-project", credentials=AnonymousCredentials())
+    monkeypatch.setattr(base_repository, "get_db", lambda: db)
+    return db
+
+
+requires_emulator = pytest.mark.skipif(
+    not os.getenv("FIRESTORE_EMULATOR_HOST"),
+    reason="Firestore emulator not running"
+)
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""
+Tests for admission control
+"""
+import asyncio
+
+import pytest
+
+from src.core.admission import AdmissionController
+from src.core.config import settings
+
+
+def test_waiting_limit_follows_worker_count(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_WORKERS", 20)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_IN_FLIGHT", 16)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAITING", None)
+    
+    controller = AdmissionController()
+    
+    assert controller.max_in_flight + controller.max_waiting == settings.WEBHOOK_WORKERS
+
+
+@pytest.mark.asyncio
+async def test_queue_full_sheds_beyond_waiting_limit():
+    controller = AdmissionController(max_in_flight=1, max_waiting=1, queue_timeout=1.0)
+    assert await controller.acquire()
+    
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    
+    assert not await controller.acquire()
+    assert controller.metrics()["shed"]["queue_full"] == 1
+    
+    controller.release()
+    assert await waiting
+    controller.release()
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""
+Tests for the calendar agent's model calls
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import calendar_agent as calendar_agent_module
+from src.agents.calendar_agent import CalendarAgent
+from src.core.config import settings
+from src.services.calendar_service import CalendarService
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.requests = []
+    
+    async def create(self, **request):
+        self.requests.append(request)
+        message = SimpleNamespace(content="了解しました。", tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.mark.asyncio
+async def test_turn_without_tools_is_not_streamed(monkeypatch):
+    monkeypatch.setattr(settings, "AGENT_STREAMING", True)
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(calendar_agent_module, "get_openai_client", lambda: client)
+    
+    content, tool_calls, results = await CalendarAgent()._complete(
+        "U1", [{"role": "user", "content": "ありがとう"}], [], tool_choice="none"
+    )
+    
+    assert content == "了解しました。"
+    assert tool_calls == [] and results == []
+    assert "stream" not in completions.requests[0]
+
+RECENT_EVENTS = [
+    {"event_id": "ev2", "title": "歯医者", "datetime": "2026-10-20T10:00:00+09:00"},
+    {"event_id": "ev1", "title": "会議", "datetime": "2026-10-21T15:00:00+09:00"}
+]
+
+
+@pytest.fixture
+def deleted(monkeypatch):
+    event_ids = []
+    
+    async def delete_event_by_id(self, line_user_id, event_id):
+        event_ids.append(event_id)
+        return {"success": True, "message": "予定を削除しました。", "event_id": event_id}
+    
+    monkeypatch.setattr(CalendarService, "delete_event_by_id", delete_event_by_id)
+    return event_ids
+
+
+@pytest.mark.asyncio
+async def test_unnamed_delete_asks_instead_of_deleting_newest(deleted):
+    result = await CalendarAgent()._delete_event("U1", {}, RECENT_EVENTS)
+    
+    assert deleted == []
+    assert "error" in result
+    assert [c["event_id"] for c in result["candidates"]] == ["ev2", "ev1"]
+
+
+@pytest.mark.asyncio
+async def test_named_recent_event_is_deleted(deleted):
+    result = await CalendarAgent()._delete_event("U1", {"title": "会議"}, RECENT_EVENTS)
+    
+    assert deleted == ["ev1"]
+    assert result["deleted_event_id"] == "ev1"
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Tests for conversation context helpers
+"""
+from src.repositories.conversation_repository import (
+    ConversationRepository,
+    match_event_reference
+)
+
+RECENT_EVENTS = [
+    {"event_id": "ev2", "title": "歯医者"},
+    {"event_id": "ev1", "title": "会議"}
+]
+
+
+def test_reference_word_alone_matches_nothing():
+    assert match_event_reference(RECENT_EVENTS, "その日の予定を消して") is None
+
+
+def test_named_event_is_matched():
+    assert match_event_reference(RECENT_EVENTS, "さっきの会議を削除")["event_id"] == "ev1"
+
+
+def test_event_id_is_matched():
+    assert match_event_reference(RECENT_EVENTS, "ev2 を削除")["event_id"] == "ev2"
+
+
+def test_event_reference_write_sets_expiry(firestore_db):
+    _, data, merge = ConversationRepository().build_event_references(
+        "U1", {"recent_events": RECENT_EVENTS}, [{"event_id": "ev3", "title": "打ち合わせ"}]
+    )
+    
+    assert merge
+    assert data["expire_at"] is not None
+
+
+def test_context_backfill_page_query_starts_after_document_id(firestore_db):
+    proto = ConversationRepository()._context_page_query("U500", 500)._to_protobuf()
+    
+    assert not proto.start_at.before
+    assert proto.start_at.values[0].reference_value.endswith("/documents/conversation_context/U500")
+    assert proto.limit == 500
\ No newline at end of file
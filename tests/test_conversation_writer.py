@@ -0,0 +1,114 @@
+"""
+Tests for the background conversation writer
+"""
+import asyncio
+
+import pytest
+
+from src.services.conversation_writer import ConversationWriter
+
+
+class FakeDocRef:
+    def __init__(self, path):
+        self.path = path
+
+
+@pytest.fixture
+def committed(monkeypatch):
+    """Operations committed by writers, recorded instead of sent to Firestore"""
+    operations = []
+    monkeypatch.setattr(
+        ConversationWriter,
+        "_commit_batch",
+        lambda self, chunk: operations.extend(chunk)
+    )
+    return operations
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_entry_held_during_flush_interval(committed):
+    writer = ConversationWriter(max_pending=10, flush_interval=5)
+    await writer.start()
+    
+    write = (FakeDocRef("conversations/m1"), {"content": "hi"})
+    await writer.submit("U1", [write])
+    await asyncio.sleep(0.05)  # The loop has taken the entry and is sleeping
+    
+    await writer.stop()
+    
+    assert committed == [write]
+
+
+@pytest.mark.asyncio
+async def test_stop_waits_for_commit_in_progress(monkeypatch):
+    operations = []
+    
+    def slow_commit(self, chunk):
+        import time
+        time.sleep(0.2)
+        operations.extend(chunk)
+    
+    monkeypatch.setattr(ConversationWriter, "_commit_batch", slow_commit)
+    writer = ConversationWriter(max_pending=10, flush_interval=0)
+    await writer.start()
+    
+    write = (FakeDocRef("conversations/m1"), {"content": "hi"})
+    await writer.submit("U1", [write])
+    await asyncio.sleep(0.05)  # The commit is running in a worker thread
+    
+    await writer.stop()
+    
+    assert operations == [write]
+
+@pytest.mark.asyncio
+async def test_pending_writes_overlay_stored_data(committed):
+    writer = ConversationWriter(max_pending=10, flush_interval=5)
+    await writer.start()
+    
+    doc_ref = FakeDocRef("conversation_context/U1")
+    await writer.submit("U1", [
+        (doc_ref, {"turns": ["a"], "summary": ""}),
+        (doc_ref, {"recent_events": ["e1"]}, True)
+    ])
+    
+    assert writer.apply_pending(doc_ref.path, {"turns": [], "recent_events": []}) == {
+        "turns": ["a"],
+        "summary": "",
+        "recent_events": ["e1"]
+    }
+    
+    await writer.stop()
+    
+    # Committed writes are read from Firestore again
+    assert writer.apply_pending(doc_ref.path, {"turns": ["stored"]}) == {"turns": ["stored"]}
+
+
+@pytest.mark.asyncio
+async def test_second_exchange_builds_on_buffered_first(firestore_db, committed, monkeypatch):
+    from google.cloud.firestore_v1.document import DocumentReference
+    from src.repositories.conversation_repository import ConversationRepository
+    
+    class MissingSnapshot:
+        exists = False
+    
+    monkeypatch.setattr(DocumentReference, "get", lambda self, *args, **kwargs: MissingSnapshot())
+    writer = ConversationWriter(max_pending=10, flush_interval=5)
+    monkeypatch.setattr(
+        "src.repositories.conversation_repository.conversation_writer",
+        writer
+    )
+    await writer.start()
+    repo = ConversationRepository()
+    
+    for text in ("first", "second"):
+        context = await repo.get_conversation_context("U1")
+        await writer.submit("U1", [repo.build_recent_context(
+            "U1",
+            context,
+            [{"role": "user", "content": text}]
+        )])
+    
+    context = await repo.get_conversation_context("U1")
+    await writer.stop()
+    
+    assert [turn["content"] for turn in context["messages"]] == ["first", "second"]
\ No newline at end of file
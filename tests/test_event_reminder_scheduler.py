@@ -0,0 +1,137 @@
+"""
+Tests for "N minutes before" event reminders
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.core.config import settings
+from src.services import event_reminder_scheduler as scheduler_module
+from src.services import reminder_service
+from src.services.calendar_service import CalendarService
+from src.services.event_reminder_scheduler import (
+    EventReminderScheduler,
+    from_minute,
+    to_minute
+)
+
+
+class RecordingEnqueuer:
+    def __init__(self):
+        self.tasks = {}
+    
+    async def enqueue(self, task_name, payload, task_id=None, schedule_at=None):
+        self.tasks.setdefault(task_id, (task_name, payload, schedule_at))
+        return True
+
+
+def upcoming_event(event_id, start_at, title="会議"):
+    return {"id": event_id, "title": title, "start": start_at.isoformat()}
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(settings, "EVENT_REMINDER_DEDUP_BACKEND", "memory")
+    scheduler = EventReminderScheduler()
+    
+    async def get_lead_time(line_user_id):
+        return 10
+    
+    monkeypatch.setattr(scheduler, "get_lead_time", get_lead_time)
+    return scheduler
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    messages = []
+    
+    async def send_reminder(line_user_id, message):
+        messages.append((line_user_id, message))
+        return True
+    
+    monkeypatch.setattr(reminder_service, "send_reminder", send_reminder)
+    return messages
+
+
+def calendar_with(monkeypatch, events):
+    async def fetch_events(self, line_user_id, start_date, end_date, etag=None):
+        return {"events": events, "etag": None, "not_modified": False}
+    
+    monkeypatch.setattr(CalendarService, "fetch_events", fetch_events)
+
+
+@pytest.mark.asyncio
+async def test_instances_schedule_the_same_task(monkeypatch, scheduler):
+    enqueuer = RecordingEnqueuer()
+    monkeypatch.setattr(scheduler_module, "get_task_enqueuer", lambda: enqueuer)
+    start_at = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(hours=1)
+    event = upcoming_event("e1", start_at)
+    
+    # Two instances seeing the same event derive the same task
+    assert await scheduler.schedule_event("U1", event)
+    assert await EventReminderScheduler().schedule_event("U1", event, minutes_before=10)
+    
+    assert len(enqueuer.tasks) == 1
+    task_name, payload, schedule_at = next(iter(enqueuer.tasks.values()))
+    assert task_name == "event-reminder"
+    assert payload["minutes_before"] == 10
+    assert schedule_at == start_at - timedelta(minutes=10)
+
+
+@pytest.mark.asyncio
+async def test_due_reminder_is_coalesced_per_minute(monkeypatch, scheduler, sent):
+    start_at = from_minute(to_minute(datetime.now(timezone.utc)) + 10)
+    calendar_with(monkeypatch, [
+        upcoming_event("e1", start_at, "会議"),
+        upcoming_event("e2", start_at, "電話"),
+        upcoming_event("e3", start_at + timedelta(hours=1), "夕食")
+    ])
+    
+    stats = await scheduler.send_due(
+        {"line_user_id": "U1", "minute": to_minute(start_at) - 10, "minutes_before": 10}
+    )
+    
+    assert stats == {"sent": 1, "events": 2}
+    assert len(sent) == 1
+    assert "会議" in sent[0][1] and "電話" in sent[0][1] and "夕食" not in sent[0][1]
+
+
+@pytest.mark.asyncio
+async def test_deleted_event_is_not_reminded(monkeypatch, scheduler, sent):
+    # The event was deleted (possibly on another instance) after scheduling
+    start_at = from_minute(to_minute(datetime.now(timezone.utc)) + 10)
+    calendar_with(monkeypatch, [])
+    
+    stats = await scheduler.send_due(
+        {"line_user_id": "U1", "minute": to_minute(start_at) - 10, "minutes_before": 10}
+    )
+    
+    assert stats == {"sent": 0, "events": 0}
+    assert sent == []
+
+
+@pytest.mark.asyncio
+async def test_changed_lead_time_skips_old_task(monkeypatch, scheduler, sent):
+    start_at = from_minute(to_minute(datetime.now(timezone.utc)) + 30)
+    calendar_with(monkeypatch, [upcoming_event("e1", start_at)])
+    
+    stats = await scheduler.send_due(
+        {"line_user_id": "U1", "minute": to_minute(start_at) - 30, "minutes_before": 30}
+    )
+    
+    assert stats["sent"] == 0
+    assert sent == []
+
+
+@pytest.mark.asyncio
+async def test_rerun_task_sends_once(monkeypatch, scheduler, sent):
+    # Re-enqueued after the local dedup window, or redelivered by Cloud Tasks
+    start_at = from_minute(to_minute(datetime.now(timezone.utc)) + 10)
+    calendar_with(monkeypatch, [upcoming_event("e1", start_at)])
+    payload = {"line_user_id": "U1", "minute": to_minute(start_at) - 10, "minutes_before": 10}
+    
+    first = await scheduler.send_due(payload)
+    second = await scheduler.send_due(payload)
+    
+    assert first["sent"] == 1 and second["sent"] == 0
+    assert len(sent) == 1
\ No newline at end of file
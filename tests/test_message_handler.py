@@ -0,0 +1,75 @@
+"""
+Tests for LINE message handling
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.services import message_handler
+
+
+def text_event(text, age_seconds=0.0):
+    return SimpleNamespace(
+        source=SimpleNamespace(user_id="U1"),
+        message=SimpleNamespace(text=text),
+        reply_token="reply-token",
+        timestamp=(time.time() - age_seconds) * 1000
+    )
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    sent = []
+    
+    async def respond(line_user_id, reply_token, message, reply_deadline):
+        sent.append((reply_token, message))
+    
+    async def send_reply(reply_token, message):
+        return True
+    
+    monkeypatch.setattr(message_handler, "respond", respond)
+    monkeypatch.setattr(message_handler, "send_reply", send_reply)
+    return sent
+
+
+@pytest.mark.asyncio
+async def test_reclaimed_old_event_is_still_answered(monkeypatch, responses):
+    async def generate_reply(line_user_id, message_text):
+        return "明日の予定はありません。"
+    
+    monkeypatch.setattr(message_handler, "_generate_reply", generate_reply)
+    
+    # Older than both the reply token and the processing timeout
+    await message_handler._process_text_message(text_event("明日の予定", age_seconds=600))
+    
+    assert responses == [("reply-token", "明日の予定はありません。")]
+
+@pytest.mark.asyncio
+async def test_listed_events_reuse_loaded_context(monkeypatch):
+    context = {"recent_events": []}
+    built = []
+    
+    class FakeConversationRepository:
+        async def get_conversation_context(self, line_user_id):
+            raise AssertionError("context was loaded twice")
+        
+        def build_event_references(self, line_user_id, context, events, removed_event_ids):
+            built.append((context, events))
+            return "update"
+    
+    async def list_events(self, line_user_id, entities):
+        return [{"event_id": "e1", "title": "会議", "datetime": "2026-10-20T10:00:00+09:00"}]
+    
+    async def submit(line_user_id, updates):
+        return True
+    
+    monkeypatch.setattr(message_handler, "ConversationRepository", FakeConversationRepository)
+    monkeypatch.setattr(message_handler.CalendarService, "list_events", list_events)
+    monkeypatch.setattr(message_handler.conversation_writer, "submit", submit)
+    
+    await message_handler._process_with_pattern_matching(
+        "U1", "明日の予定", parsed=("list_events", {}), context=context
+    )
+    
+    assert [loaded for loaded, _ in built] == [context]
\ No newline at end of file
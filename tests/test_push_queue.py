@@ -0,0 +1,100 @@
+"""
+Tests for the LINE push queue
+"""
+import asyncio
+
+import pytest
+from linebot.v3.messaging.exceptions import ApiException
+
+from src.core.config import settings
+from src.services.push_queue import (
+    InMemoryDeadLetterStore,
+    PushQueue,
+    is_unreachable_recipient
+)
+
+
+def test_unknown_recipient_is_unreachable():
+    body = '{"message":"The property, \'to\', in the request body is invalid (line: -, column: -)"}'
+    
+    assert is_unreachable_recipient(400, body)
+
+
+def test_generic_not_found_keeps_user_active():
+    assert not is_unreachable_recipient(404, '{"message":"Not found"}')
+
+
+def test_retryable_status_is_never_unreachable():
+    assert not is_unreachable_recipient(500, "the user has blocked the line official account")
+
+
+@pytest.mark.asyncio
+async def test_retries_reuse_the_retry_key_and_accept_conflict(monkeypatch):
+    monkeypatch.setattr(settings, "PUSH_RETRY_BASE_DELAY", 0.001)
+    
+    # The first request reached LINE but its response was lost
+    responses = [
+        ApiException(status=500, reason="Internal Server Error"),
+        ApiException(status=409, reason="Conflict")
+    ]
+    retry_keys = []
+    
+    async def send(item):
+        retry_keys.append(item["retry_key"])
+        raise responses.pop(0)
+    
+    queue = PushQueue(dead_letters=InMemoryDeadLetterStore())
+    monkeypatch.setattr(queue, "_send", send)
+    
+    assert await queue.enqueue(["U1"], "hello")
+    
+    assert len(retry_keys) == 2
+    assert retry_keys[0] == retry_keys[1]
+    assert queue.stats["sent"] == 1
+    assert await queue.dead_letters.list() == []
+
+
+@pytest.mark.asyncio
+async def test_retry_in_backoff_is_dead_lettered_on_stop_and_replayed(monkeypatch):
+    monkeypatch.setattr(settings, "PUSH_QUEUE_WORKERS", 1)
+    monkeypatch.setattr(settings, "PUSH_QUEUE_DRAIN_TIMEOUT", 0.05)
+    monkeypatch.setattr(settings, "PUSH_RETRY_BASE_DELAY", 30.0)
+    
+    sent = []
+    
+    async def failing_send(item):
+        raise ConnectionError("LINE unavailable")
+    
+    queue = PushQueue(dead_letters=InMemoryDeadLetterStore())
+    monkeypatch.setattr(queue, "_send", failing_send)
+    await queue.start()
+    await queue.enqueue(["U1"], "hello", retry_key="key-1")
+    await asyncio.sleep(0.01)
+    
+    # The message is sleeping in retry backoff when the queue stops
+    await queue.stop()
+    
+    entries = await queue.dead_letters.list()
+    assert [entry["retry_key"] for entry in entries] == ["key-1"]
+    
+    async def send(item):
+        sent.append((item["to"], item["message"], item["retry_key"]))
+    
+    monkeypatch.setattr(queue, "_send", send)
+    stats = await queue.replay_dead_letters()
+    
+    assert stats == {"replayed": 1, "skipped": 0}
+    assert sent == [(["U1"], "hello", "key-1")]
+    assert await queue.dead_letters.list() == []
+
+
+@pytest.mark.asyncio
+async def test_permanent_failures_are_not_replayed_by_default():
+    queue = PushQueue(dead_letters=InMemoryDeadLetterStore())
+    await queue.dead_letters.add(
+        {"to": ["U1"], "message": "hello", "retry_key": "key-2", "attempts": 1, "status": 400}
+    )
+    
+    stats = await queue.replay_dead_letters()
+    
+    assert stats == {"replayed": 0, "skipped": 1}
\ No newline at end of file
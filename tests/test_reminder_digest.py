@@ -0,0 +1,84 @@
+"""
+Tests for reminder digest use and revalidation
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.services import reminder_service
+
+PREFERENCES = {"reminder_enabled": True, "reminder_days_ahead": 1}
+
+
+class FakeCalendarService:
+    def __init__(self, result):
+        self.result = result
+        self.etags = []
+    
+    async def fetch_events(self, line_user_id, start_date, end_date, etag=None):
+        self.etags.append(etag)
+        return self.result
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """Digests saved to the user repository"""
+    digests = {}
+    
+    class FakeUserRepository:
+        async def save_reminder_digests(self, new_digests):
+            digests.update(new_digests)
+            return True
+    
+    monkeypatch.setattr(reminder_service, "UserRepository", FakeUserRepository)
+    return digests
+
+
+def stored_digest(age_minutes=24 * 60):
+    start_date, _ = reminder_service.get_digest_period(PREFERENCES)
+    return {
+        "start_date": start_date.isoformat(),
+        "days_ahead": 1,
+        "message": "stored reminder",
+        "etag": '"v1"',
+        "computed_at": datetime.now(timezone.utc) - timedelta(minutes=age_minutes)
+    }
+
+
+@pytest.mark.asyncio
+async def test_fresh_digest_is_sent_without_calling_google(saved):
+    calendar = FakeCalendarService(None)
+    
+    message = await reminder_service.generate_reminder_message(
+        "U1", PREFERENCES, calendar, digest=stored_digest(age_minutes=30)
+    )
+    
+    assert message == "stored reminder"
+    assert calendar.etags == []
+
+
+@pytest.mark.asyncio
+async def test_old_digest_is_revalidated_and_kept_when_unchanged(saved):
+    calendar = FakeCalendarService({"events": None, "etag": '"v1"', "not_modified": True})
+    
+    message = await reminder_service.generate_reminder_message(
+        "U1", PREFERENCES, calendar, digest=stored_digest()
+    )
+    
+    assert calendar.etags == ['"v1"']
+    assert message == "stored reminder"
+    assert saved == {}
+
+
+@pytest.mark.asyncio
+async def test_changed_calendar_replaces_digest(saved):
+    events = [{"title": "会議", "start_time": "10:00", "end_time": "11:00"}]
+    calendar = FakeCalendarService({"events": events, "etag": '"v2"', "not_modified": False})
+    
+    message = await reminder_service.generate_reminder_message(
+        "U1", PREFERENCES, calendar, digest=stored_digest()
+    )
+    
+    assert message != "stored reminder"
+    assert "会議" in message
+    assert saved["U1"]["etag"] == '"v2"'
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Tests for sharded reminder processing
+"""
+import asyncio
+
+import pytest
+
+from src.core.task_queue import LocalTaskEnqueuer, register_task_handler
+
+from src.repositories.user_repository import UserRepository
+from src.services import reminder_service
+from tests.conftest import requires_emulator
+
+BUCKET = 540
+
+
+def test_shard_query_uses_document_id_cursors(firestore_db):
+    query = UserRepository()._reminder_shard_query(BUCKET, start_at="U002", end_at="U004")
+    
+    # Building the protobuf is where an invalid cursor raises
+    proto = query._to_protobuf()
+    
+    assert proto.start_at.before
+    assert proto.start_at.values[0].reference_value.endswith("/documents/users/U002")
+    assert not proto.end_at.before
+    assert proto.end_at.values[0].reference_value.endswith("/documents/users/U004")
+
+
+def test_shard_query_without_bounds(firestore_db):
+    proto = UserRepository()._reminder_shard_query(BUCKET)._to_protobuf()
+    
+    assert not proto.start_at.values
+    assert not proto.end_at.values
+
+
+@pytest.mark.asyncio
+async def test_failed_shard_read_raises_for_retry(firestore_db, monkeypatch):
+    async def failing_query(self, bucket, start_at=None, end_at=None):
+        raise RuntimeError("Firestore unavailable")
+    
+    monkeypatch.setattr(UserRepository, "get_users_for_reminder", failing_query)
+    
+    with pytest.raises(RuntimeError):
+        await reminder_service.process_reminder_shard({"bucket": BUCKET})
+
+
+@pytest.mark.asyncio
+async def test_failed_user_id_read_fails_the_plan(firestore_db, monkeypatch):
+    def failing_stream(self, *args, **kwargs):
+        raise RuntimeError("Firestore unavailable")
+    
+    monkeypatch.setattr("google.cloud.firestore_v1.query.Query.stream", failing_stream)
+    
+    with pytest.raises(RuntimeError):
+        await reminder_service.plan_reminder_shards(BUCKET)
+
+
+class RecordingEnqueuer:
+    def __init__(self):
+        self.task_ids = []
+    
+    async def enqueue(self, task_name, payload, task_id=None, schedule_at=None):
+        self.task_ids.append(task_id)
+        return True
+
+
+@pytest.mark.asyncio
+async def test_shard_task_ids_follow_user_ranges(firestore_db, monkeypatch):
+    monkeypatch.setattr(reminder_service.settings, "REMINDER_SHARD_SIZE", 2)
+    enqueuer = RecordingEnqueuer()
+    monkeypatch.setattr(reminder_service, "get_task_enqueuer", lambda: enqueuer)
+    memberships = [["U1", "U2", "U3", "U4"], ["U2", "U3", "U4"]]
+    
+    async def get_user_ids(self, bucket):
+        return memberships.pop(0)
+    
+    monkeypatch.setattr(UserRepository, "get_user_ids_for_reminder", get_user_ids)
+    
+    # U1 left the bucket between a failed plan and its retry
+    await reminder_service.plan_reminder_shards(BUCKET)
+    first = list(enqueuer.task_ids)
+    await reminder_service.plan_reminder_shards(BUCKET)
+    retry = enqueuer.task_ids[len(first):]
+    
+    assert [task_id.split("-", 3)[3] for task_id in first] == ["U1-U2", "U3-U4"]
+    # The changed first shard is not mistaken for an already-enqueued one
+    assert retry[0].endswith("-U2-U3")
+    assert retry[0] not in first
+
+
+@pytest.mark.asyncio
+async def test_local_enqueuer_skips_duplicates_with_bounded_memory(monkeypatch):
+    calls = []
+    
+    async def handler(payload):
+        calls.append(payload["n"])
+    
+    register_task_handler("test-task", handler)
+    enqueuer = LocalTaskEnqueuer()
+    enqueuer._seen_ids.max_entries = 3
+    
+    for n in range(5):
+        assert await enqueuer.enqueue("test-task", {"n": n}, task_id=f"task-{n}")
+    assert await enqueuer.enqueue("test-task", {"n": 99}, task_id="task-4")
+    await asyncio.sleep(0)
+    
+    assert calls == [0, 1, 2, 3, 4]
+    assert len(enqueuer._seen_ids) == 3
+
+
+@requires_emulator
+@pytest.mark.asyncio
+async def test_process_reminder_shard_reads_only_its_range(firestore_db, monkeypatch):
+    users = firestore_db.collection("users")
+    for i in range(1, 6):
+        users.document(f"U00{i}").set({
+            "is_active": True,
+            "reminder_buckets": [BUCKET],
+            "preferences": {"reminder_enabled": True, "reminder_time_morning": "09:00"}
+        })
+    
+    prepared = []
+    
+    async def fake_prepare(user, bucket, calendar_service):
+        prepared.append(user["id"])
+        return "sent", f"reminder for {user['id']}"
+    
+    async def fake_deliver(messages):
+        return {line_user_id: True for line_user_id in messages}
+    
+    monkeypatch.setattr(reminder_service, "_prepare_user_reminder", fake_prepare)
+    monkeypatch.setattr(reminder_service, "deliver_messages", fake_deliver)
+    
+    try:
+        stats = await reminder_service.process_reminder_shard({
+            "bucket": BUCKET,
+            "start_at": "U002",
+            "end_at": "U004"
+        })
+    finally:
+        for i in range(1, 6):
+            users.document(f"U00{i}").delete()
+    
+    assert sorted(prepared) == ["U002", "U003", "U004"]
+    assert stats["users"] == 3
+    assert stats["sent"] == 3
\ No newline at end of file
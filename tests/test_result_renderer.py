@@ -0,0 +1,60 @@
+"""
+Tests for local rendering of function results
+"""
+from src.agents.result_renderer import format_datetime, render_result, render_results
+
+
+def test_added_event_is_rendered_with_details():
+    result = {
+        "success": True,
+        "message": "予定「会議」を追加しました。",
+        "event": {
+            "title": "会議",
+            "datetime": "2026-06-02T15:00:00+09:00",
+            "duration": 30,
+            "location": "本社"
+        }
+    }
+    
+    assert render_result("add_event", result) == (
+        "予定「会議」を追加しました。\n"
+        "🕐 6月2日(火) 15:00（30分）\n"
+        "📍 本社"
+    )
+
+
+def test_reminder_settings_list_only_updated_fields():
+    result = {
+        "success": True,
+        "updated_settings": {"reminder_enabled": False, "reminder_days_ahead": 3}
+    }
+    
+    assert render_result("update_reminder_settings", result) == (
+        "リマインダー設定を更新しました\n"
+        "・リマインダー: オフ\n"
+        "・通知する範囲: 3日先まで"
+    )
+
+
+def test_failed_status_uses_service_message():
+    assert render_result("delete_event", {"success": False}) == "処理に失敗しました。"
+    assert render_result("delete_event", {"success": True}) == "予定を削除しました。"
+
+
+def test_errors_and_open_ended_results_go_to_the_model():
+    assert render_result("delete_event", {"error": "どの予定ですか？"}) is None
+    assert render_result("search_events", {"events": []}) is None
+
+
+def test_results_are_joined_unless_one_needs_the_model():
+    deleted = ("delete_event", {"success": True, "message": "削除しました。"})
+    upgraded = ("upgrade_subscription", {"success": True, "message": "変更しました。"})
+    
+    assert render_results([deleted, upgraded]) == "削除しました。\n\n変更しました。"
+    assert render_results([deleted, ("search_events", {"events": []})]) is None
+    assert render_results([]) is None
+
+
+def test_unparseable_datetime_is_shown_as_is():
+    assert format_datetime("明日") == "明日"
+    assert format_datetime(None) == ""
\ No newline at end of file
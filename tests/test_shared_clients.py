@@ -0,0 +1,46 @@
+"""
+Tests for the shared API clients
+"""
+import asyncio
+
+from src.core.line_client import LineClient
+from src.core.openai_client import OpenAIClient
+
+
+async def get_after_yield(get):
+    client = get()
+    await asyncio.sleep(0)
+    return client
+
+
+def test_openai_client_from_previous_loop_is_closed(monkeypatch):
+    monkeypatch.setattr("src.core.openai_client.settings.OPENAI_API_KEY", "test-key")
+    shared = OpenAIClient()
+    
+    first = asyncio.run(get_after_yield(lambda: shared.client))
+    second = asyncio.run(get_after_yield(lambda: shared.client))
+    
+    assert first is not second
+    assert first.is_closed()
+    assert not second.is_closed()
+
+
+def test_line_client_from_previous_loop_is_closed(monkeypatch):
+    monkeypatch.setattr("src.core.line_client.settings.LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+    closed = []
+    shared = LineClient()
+    
+    asyncio.run(get_after_yield(lambda: shared.api))
+    old_api_client = shared._api_client
+    close = old_api_client.close
+    
+    async def record_close():
+        closed.append(old_api_client)
+        await close()
+    monkeypatch.setattr(old_api_client, "close", record_close)
+    
+    asyncio.run(get_after_yield(lambda: shared.api))
+    
+    assert closed == [old_api_client]
+    assert shared._api_client is not old_api_client
+    asyncio.run(shared._api_client.close())
\ No newline at end of file
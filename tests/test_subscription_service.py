@@ -0,0 +1,42 @@
+"""
+Tests for billing periods
+"""
+from datetime import datetime
+
+from src.services.subscription_service import (
+    get_billing_anchor_day,
+    get_billing_period_key,
+    get_current_ai_usage
+)
+
+
+def test_period_starts_on_anchor_day():
+    assert get_billing_period_key(15, datetime(2026, 10, 14, 23, 59)) == "2026-09"
+    assert get_billing_period_key(15, datetime(2026, 10, 15, 0, 0)) == "2026-10"
+
+
+def test_anchor_day_is_clamped_to_short_months():
+    # February has no 31st, so the period starts on its last day
+    assert get_billing_period_key(31, datetime(2026, 2, 27)) == "2026-01"
+    assert get_billing_period_key(31, datetime(2026, 2, 28)) == "2026-02"
+    assert get_billing_period_key(31, datetime(2028, 2, 29)) == "2028-02"
+
+
+def test_period_before_anchor_in_january_belongs_to_december():
+    assert get_billing_period_key(10, datetime(2027, 1, 5)) == "2026-12"
+
+
+def test_anchor_day_comes_from_subscription_then_signup():
+    assert get_billing_anchor_day({"subscription": {"billing_anchor_day": 20}}) == 20
+    assert get_billing_anchor_day({"created_at": datetime(2026, 3, 7)}) == 7
+    assert get_billing_anchor_day({}) == 1
+
+
+def test_current_usage_reads_the_anchored_period():
+    user = {
+        "subscription": {"billing_anchor_day": 20},
+        "ai_usage": {"2026-09": 8, "2026-10": 2}
+    }
+    
+    assert get_current_ai_usage(user, datetime(2026, 10, 19)) == 8
+    assert get_current_ai_usage(user, datetime(2026, 10, 20)) == 2
\ No newline at end of file
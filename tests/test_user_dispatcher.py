@@ -0,0 +1,82 @@
+"""
+Tests for the per-user dispatcher
+"""
+import asyncio
+
+import pytest
+
+from src.services.user_dispatcher import MailboxFull, UserDispatcher
+
+
+def record(log, key, label, delay):
+    async def job():
+        log.append((key, label, "start"))
+        await asyncio.sleep(delay)
+        log.append((key, label, "end"))
+        return label
+    return job
+
+
+@pytest.mark.asyncio
+async def test_jobs_for_one_user_run_in_submission_order():
+    dispatcher = UserDispatcher(mailbox_size=10)
+    log = []
+    
+    # The slow first job must still finish before the quick follow-up starts
+    futures = [
+        dispatcher.submit("U1", record(log, "U1", "add", 0.05)),
+        dispatcher.submit("U1", record(log, "U1", "cancel", 0.0))
+    ]
+    
+    assert await asyncio.gather(*futures) == ["add", "cancel"]
+    assert log == [
+        ("U1", "add", "start"),
+        ("U1", "add", "end"),
+        ("U1", "cancel", "start"),
+        ("U1", "cancel", "end")
+    ]
+    assert dispatcher.active_users == 0
+
+
+@pytest.mark.asyncio
+async def test_different_users_run_in_parallel():
+    dispatcher = UserDispatcher(mailbox_size=10)
+    log = []
+    
+    await asyncio.gather(
+        dispatcher.submit("U1", record(log, "U1", "slow", 0.05)),
+        dispatcher.submit("U2", record(log, "U2", "quick", 0.0))
+    )
+    
+    assert log.index(("U2", "quick", "end")) < log.index(("U1", "slow", "end"))
+
+
+@pytest.mark.asyncio
+async def test_failed_job_does_not_block_later_jobs():
+    dispatcher = UserDispatcher(mailbox_size=10)
+    
+    async def fail():
+        raise ValueError("boom")
+    
+    async def succeed():
+        return "ok"
+    
+    failed = dispatcher.submit("U1", fail)
+    later = dispatcher.submit("U1", succeed)
+    
+    with pytest.raises(ValueError):
+        await failed
+    assert await later == "ok"
+
+
+@pytest.mark.asyncio
+async def test_full_mailbox_rejects_new_jobs():
+    dispatcher = UserDispatcher(mailbox_size=1)
+    log = []
+    
+    first = dispatcher.submit("U1", record(log, "U1", "first", 0.0))
+    with pytest.raises(MailboxFull):
+        dispatcher.submit("U1", record(log, "U1", "second", 0.0))
+    
+    await first
+    assert dispatcher.stats == {"dispatched": 1, "rejected": 1}
\ No newline at end of file
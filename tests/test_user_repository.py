@@ -0,0 +1,27 @@
+"""
+Tests for user repository query construction
+"""
+from src.repositories.user_repository import UserRepository
+
+
+def test_reminder_users_page_query_starts_after_document_id(firestore_db):
+    query = UserRepository()._reminder_users_page_query("U200", 200)
+    
+    # Building the protobuf is where an invalid cursor raises
+    proto = query._to_protobuf()
+    
+    assert not proto.start_at.before
+    assert proto.start_at.values[0].reference_value.endswith("/documents/users/U200")
+    assert proto.limit == 200
+
+
+def test_first_reminder_users_page_has_no_cursor(firestore_db):
+    proto = UserRepository()._reminder_users_page_query(None, 200)._to_protobuf()
+    
+    assert not proto.start_at.values
+
+def test_backfill_page_query_starts_after_document_id(firestore_db):
+    proto = UserRepository()._backfill_page_query("U400", 200)._to_protobuf()
+    
+    assert not proto.start_at.before
+    assert proto.start_at.values[0].reference_value.endswith("/documents/users/U400")
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Tests for the webhook worker pool
+"""
+import asyncio
+import json
+
+import pytest
+
+from src.core.config import settings
+from src.services.webhook_queue import (
+    InMemoryEventQueue,
+    WebhookWorkerPool,
+    get_event_user_key
+)
+
+
+def user_event(event_id, user_id="U1"):
+    return json.dumps({"webhookEventId": event_id, "source": {"userId": user_id}})
+
+
+@pytest.mark.asyncio
+async def test_held_events_are_not_redelivered(monkeypatch):
+    # Leases far shorter than the handler, so they must be renewed
+    monkeypatch.setattr(settings, "WEBHOOK_QUEUE_LEASE_SECONDS", 0.15)
+    monkeypatch.setattr(settings, "WEBHOOK_QUEUE_POLL_INTERVAL", 0.01)
+    
+    handled = []
+    
+    async def handler(payload):
+        handled.append(json.loads(payload)["webhookEventId"])
+        await asyncio.sleep(0.4)
+    
+    queue = InMemoryEventQueue()
+    pool = WebhookWorkerPool(queue, handler, workers=4, key_func=get_event_user_key)
+    await queue.put(user_event("e1"))
+    await queue.put(user_event("e2"))
+    
+    await pool.start()
+    try:
+        for _ in range(200):
+            if not await queue.size():
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await pool.stop()
+    
+    assert handled == ["e1", "e2"]
+    assert await queue.size() == 0
+
+@pytest.mark.asyncio
+async def test_mailbox_overflow_keeps_user_order(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_USER_MAILBOX_SIZE", 1)
+    monkeypatch.setattr(settings, "WEBHOOK_QUEUE_POLL_INTERVAL", 0.2)
+    
+    handled = []
+    
+    async def handler(payload):
+        handled.append(json.loads(payload)["webhookEventId"])
+        await asyncio.sleep(0.1)
+    
+    queue = InMemoryEventQueue()
+    pool = WebhookWorkerPool(queue, handler, workers=10, key_func=get_event_user_key)
+    for event_id in ("e1", "e2", "e3"):
+        await queue.put(user_event(event_id))
+    
+    await pool.start()
+    try:
+        # e3 overflowed and was requeued; e4 arrives once the mailbox has room
+        await asyncio.sleep(0.15)
+        await pool.submit(user_event("e4"))
+        
+        for _ in range(300):
+            if not await queue.size():
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await pool.stop()
+    
+    assert handled == ["e1", "e2", "e3", "e4"]
\ No newline at end of file